@@ -0,0 +1,188 @@
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+import cv2  # type: ignore
+import numpy as np
+
+from stats_collector import QUALITY_LIMITATION_REASONS, StatsCollector
+from synthetic_media import DeadlinePacer
+
+# (解像度の倍率, 何フレームに 1 回送るか) の段階。先頭ほど高画質
+ADAPTATION_LEVELS: tuple[tuple[float, int], ...] = (
+    (1.0, 1),
+    (0.75, 1),
+    (0.5, 1),
+    (0.5, 2),
+    (0.25, 2),
+    (0.25, 3),
+)
+
+_LIMITED_REASONS = (
+    QUALITY_LIMITATION_REASONS.index("cpu"),
+    QUALITY_LIMITATION_REASONS.index("bandwidth"),
+)
+
+
+class AdaptationController:
+    """
+    送信の統計情報に合わせて、キャプチャしたフレームの解像度とフレームレートを落とすクラス。
+
+    エンコーダーが CPU や帯域で制限されている場合や、1 フレームのエンコード時間が
+    フレーム間隔に収まらない場合は 1 段階下げ、余裕のある状態が続いたら 1 段階戻します。
+    縮小は事前に確保したバッファへの cv2.resize で行い、
+    間引くフレームは on_captured に渡す前に捨てるので、エンコードの処理も減ります。
+    """
+
+    def __init__(
+        self,
+        get_raw_stats: Callable[[], Optional[str]],
+        target_bitrate_bps: Optional[float] = None,
+        interval_s: float = 1.0,
+        degrade_hold_s: float = 2.0,
+        upgrade_hold_s: float = 10.0,
+        encode_budget_ratio: float = 0.8,
+        levels: tuple[tuple[float, int], ...] = ADAPTATION_LEVELS,
+    ):
+        """
+        AdaptationController インスタンスを初期化します。
+
+        :param get_raw_stats: 生の統計情報を返す関数。ConnectionManager.get_raw_stats など
+        :param target_bitrate_bps: 目標のビットレート。推定帯域がこれを下回る間は段階を戻しません
+        :param interval_s: 統計情報を確認する間隔（秒）
+        :param degrade_hold_s: 段階を変えてから次に下げるまでに待つ時間（秒）
+        :param upgrade_hold_s: 段階を戻すまでに余裕のある状態が続く必要がある時間（秒）
+        :param encode_budget_ratio: エンコード時間に許容するフレーム間隔の割合
+        :param levels: (解像度の倍率, 何フレームに 1 回送るか) の段階
+        """
+        self._stats_collector = StatsCollector(get_raw_stats, interval_s=interval_s, capacity=2)
+        self._target_bitrate_bps: Optional[float] = target_bitrate_bps
+        self._interval_s: float = interval_s
+        self._degrade_hold_s: float = degrade_hold_s
+        self._upgrade_hold_s: float = upgrade_hold_s
+        self._encode_budget_ratio: float = encode_budget_ratio
+        self._levels: tuple[tuple[float, int], ...] = levels
+
+        self._level: int = 0
+        self._changed_at: float = -math.inf
+        # 余裕のある状態になった時刻。余裕がなければ None
+        self._healthy_since: Optional[float] = None
+
+        # 入力のフレームレートを求めるためのカウンター
+        self._frame_count: int = 0
+        self._prev_frame_count: int = 0
+        self._prev_updated_at: Optional[float] = None
+        self._input_fps: float = math.nan
+
+        self._buffer: Optional[np.ndarray] = None
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def level(self) -> int:
+        """現在の段階。0 が元の解像度とフレームレート。"""
+        return self._level
+
+    def start(self) -> None:
+        """統計情報の確認を別スレッドで開始します。"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """統計情報の確認を停止します。"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def process(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """
+        キャプチャしたフレームを現在の段階に合わせて間引き、縮小します。
+
+        縮小したフレームは次の呼び出しで上書きされるので、すぐに on_captured に渡してください。
+
+        :param frame: キャプチャした (高さ, 幅, 3) のフレーム
+        :return: 送るフレーム。間引く場合は None
+        """
+        scale, frame_interval = self._levels[self._level]
+        self._frame_count += 1
+        if self._frame_count % frame_interval:
+            return None
+        if scale == 1.0:
+            return frame
+
+        height, width = frame.shape[:2]
+        # I420 に変換できるように偶数にそろえる
+        size = (max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1))
+        if self._buffer is None or self._buffer.shape[1::-1] != size:
+            self._buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        cv2.resize(frame, size, dst=self._buffer, interpolation=cv2.INTER_AREA)
+        return self._buffer
+
+    def update(self, stats: dict[str, float], now: float) -> int:
+        """
+        統計情報から段階を決め直します。
+
+        :param stats: StatsCollector.latest() の値
+        :param now: 現在の時刻（time.monotonic() の値）
+        :return: 決め直した段階
+        """
+        if self._prev_updated_at is not None and now > self._prev_updated_at:
+            self._input_fps = (self._frame_count - self._prev_frame_count) / (
+                now - self._prev_updated_at
+            )
+        self._prev_frame_count = self._frame_count
+        self._prev_updated_at = now
+
+        quality_limitation = stats.get("quality_limitation", math.nan)
+        encode_time_s = stats.get("encode_time_per_frame_s", math.nan)
+        available_bitrate_bps = stats.get("available_outgoing_bitrate_bps", math.nan)
+
+        # 送っているフレームの間隔がエンコードに使える時間
+        encode_budget_s = math.nan
+        if self._input_fps > 0:
+            encode_budget_s = self._levels[self._level][1] / self._input_fps
+
+        limited = quality_limitation in _LIMITED_REASONS or (
+            encode_time_s > encode_budget_s * self._encode_budget_ratio
+        )
+        if limited:
+            self._healthy_since = None
+            if (
+                self._level < len(self._levels) - 1
+                and now - self._changed_at >= self._degrade_hold_s
+            ):
+                self._set_level(self._level + 1, now)
+            return self._level
+
+        # エンコード時間に半分以上の余裕があり、帯域も足りている場合だけ戻す
+        healthy = not (encode_time_s > encode_budget_s * self._encode_budget_ratio / 2) and (
+            self._target_bitrate_bps is None
+            or math.isnan(available_bitrate_bps)
+            or available_bitrate_bps >= self._target_bitrate_bps
+        )
+        if not healthy:
+            self._healthy_since = None
+            return self._level
+        if self._healthy_since is None:
+            self._healthy_since = now
+        if self._level > 0 and now - self._healthy_since >= self._upgrade_hold_s:
+            self._set_level(self._level - 1, now)
+            self._healthy_since = now
+        return self._level
+
+    def _set_level(self, level: int, now: float) -> None:
+        self._level = level
+        self._changed_at = now
+
+    def _run(self) -> None:
+        pacer = DeadlinePacer(1 / self._interval_s)
+        while pacer.wait(self._stopped):
+            try:
+                if self._stats_collector.sample():
+                    self.update(self._stats_collector.latest(), time.monotonic())
+            except Exception as e:
+                print(f"Failed to update adaptation: {e}")
@@ -0,0 +1,183 @@
+import math
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def channel_mix_matrix(input_channels: int, output_channels: int) -> np.ndarray:
+    """
+    チャンネル数を変換する (入力チャンネル数, 出力チャンネル数) の行列を返します。
+
+    モノラルへのダウンミックスは全チャンネルの平均、モノラルからのアップミックスは複製です。
+    それ以外は入力チャンネル i を出力チャンネル i % output_channels に割り当てて平均します。
+
+    :param input_channels: 入力のチャンネル数
+    :param output_channels: 出力のチャンネル数
+    """
+    matrix = np.zeros((input_channels, output_channels), dtype=np.float32)
+    if input_channels == 1:
+        matrix[0, :] = 1
+        return matrix
+    for i in range(input_channels):
+        matrix[i, i % output_channels] = 1
+    # 同じ出力チャンネルに割り当てた入力の数で割って平均にする
+    matrix /= matrix.sum(axis=0, keepdims=True)
+    return matrix
+
+
+def polyphase_filters(up: int, down: int, taps_per_phase: int = 16) -> np.ndarray:
+    """
+    up / down 倍にリサンプリングするためのローパスフィルターを位相ごとに分けて返します。
+
+    :param up: アップサンプリングの倍率
+    :param down: ダウンサンプリングの倍率
+    :param taps_per_phase: 位相あたりのタップ数
+    :return: (up, taps_per_phase) の配列。行 p は位相 p のフィルターを時間の逆順に並べたもの
+    """
+    taps = taps_per_phase * up
+    # アップサンプリング後のレートで見た遮断周波数。折り返しを避けるために少し下げる
+    cutoff = 0.5 / max(up, down) * 0.9
+    t = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(taps, 8.0)
+    # ゼロを挿入した分だけゲインが下がるので up 倍する
+    h *= up / h.sum()
+    # 位相 p のフィルターは h[p::up]。入力の窓との内積で計算できるように逆順にする
+    return np.ascontiguousarray(h.reshape(taps_per_phase, up).T[:, ::-1], dtype=np.float32)
+
+
+class AudioConverter:
+    """
+    int16 の音声のサンプリングレートとチャンネル数を変換するクラス。
+
+    サンプリングレートは NumPy でベクトル化したポリフェーズフィルターで変換します。
+    入力は任意の長さで渡せて、足りない分は次の呼び出しまで持ち越します。
+    作業用のバッファは事前に確保して使い回すので、変換ごとのメモリ確保は発生しません。
+    チャンネル数を減らす場合はリサンプリングの前に、増やす場合は後に変換します。
+    """
+
+    def __init__(
+        self,
+        input_sample_rate: int,
+        input_channels: int,
+        output_sample_rate: int,
+        output_channels: int,
+        max_input_frames: Optional[int] = None,
+        taps_per_phase: int = 16,
+    ):
+        """
+        AudioConverter インスタンスを初期化します。
+
+        :param input_sample_rate: 入力のサンプリングレート
+        :param input_channels: 入力のチャンネル数
+        :param output_sample_rate: 出力のサンプリングレート
+        :param output_channels: 出力のチャンネル数
+        :param max_input_frames: 1 回に渡す入力のサンプル数の上限。省略した場合は 100 ms 分。
+            超えた場合はバッファを確保し直します
+        :param taps_per_phase: リサンプリングのフィルターの位相あたりのタップ数
+        """
+        self.input_sample_rate: int = input_sample_rate
+        self.input_channels: int = input_channels
+        self.output_sample_rate: int = output_sample_rate
+        self.output_channels: int = output_channels
+
+        gcd = math.gcd(input_sample_rate, output_sample_rate)
+        self._up: int = output_sample_rate // gcd
+        self._down: int = input_sample_rate // gcd
+        self._resample: bool = self._up != self._down
+        # リサンプリングはチャンネル数が少ない方で行う
+        self._mid_channels: int = min(input_channels, output_channels)
+        self._downmix: Optional[np.ndarray] = None
+        if input_channels != self._mid_channels:
+            self._downmix = channel_mix_matrix(input_channels, self._mid_channels)
+        self._upmix: Optional[np.ndarray] = None
+        if output_channels != self._mid_channels:
+            self._upmix = channel_mix_matrix(self._mid_channels, output_channels)
+
+        self._taps: int = taps_per_phase
+        self._filters = polyphase_filters(self._up, self._down, taps_per_phase)
+        # 出力の周期内の j 番目のサンプルが使う入力の窓の位置とフィルターの位相
+        self._offsets: list[int] = [j * self._down // self._up for j in range(self._up)]
+        self._phases: list[int] = [j * self._down % self._up for j in range(self._up)]
+        # 窓の最初に必要な過去の入力のサンプル数。最初は無音として扱う
+        self._history: int = taps_per_phase - 1 if self._resample else 0
+        self._pending: int = self._history
+
+        self._allocate(max_input_frames or max(1, input_sample_rate // 10))
+
+    def _allocate(self, max_input_frames: int) -> None:
+        self._max_input_frames = max_input_frames
+        # 持ち越した入力と過去の入力を含めた入力のバッファ
+        input_capacity = self._history + self._down + max_input_frames
+        old_input = getattr(self, "_input", None)
+        self._input = np.zeros((input_capacity, self._mid_channels), dtype=np.float32)
+        if old_input is not None:
+            self._input[: self._pending] = old_input[: self._pending]
+        max_output_frames = (input_capacity // self._down + 1) * self._up
+        self._mid_output = np.empty((max_output_frames, self._mid_channels), dtype=np.float32)
+        self._output_float = np.empty((max_output_frames, self.output_channels), dtype=np.float32)
+        self._output = np.empty((max_output_frames, self.output_channels), dtype=np.int16)
+
+    def convert(self, data: np.ndarray) -> np.ndarray:
+        """
+        音声を変換します。
+
+        返すバッファは次の呼び出しで上書きされます。
+
+        :param data: (サンプル数, input_channels) の int16 の音声
+        :return: (変換できたサンプル数, output_channels) の int16 の音声
+        """
+        frames = len(data)
+        if frames > self._max_input_frames:
+            self._allocate(frames)
+
+        # チャンネル数を減らしてから入力のバッファに追記する
+        start = self._pending
+        destination = self._input[start : start + frames]
+        if self._downmix is not None:
+            np.matmul(data, self._downmix, out=destination)
+        else:
+            destination[:] = data
+        total = start + frames
+
+        if self._resample:
+            output_frames = self._resample_pending(total)
+        else:
+            np.copyto(self._mid_output[:frames], destination)
+            output_frames = frames
+            self._pending = 0
+
+        mid_output = self._mid_output[:output_frames]
+        output_float = self._output_float[:output_frames]
+        if self._upmix is not None:
+            np.matmul(mid_output, self._upmix, out=output_float)
+        else:
+            np.copyto(output_float, mid_output)
+        np.rint(output_float, out=output_float)
+        np.clip(output_float, -32768, 32767, out=output_float)
+        output = self._output[:output_frames]
+        output[:] = output_float
+        return output
+
+    def _resample_pending(self, total: int) -> int:
+        # 出力の 1 周期 (up サンプル) で入力を down サンプル消費する。揃った周期だけ変換する
+        periods = (total - self._history) // self._down
+        if periods > 0:
+            # windows[i] は入力の i から taps サンプル分の窓。(窓の数, チャンネル数, taps) になる
+            windows = sliding_window_view(self._input[:total], self._taps, axis=0)
+            output = self._mid_output[: periods * self._up].reshape(
+                periods, self._up, self._mid_channels
+            )
+            span = periods * self._down
+            for j, (offset, phase) in enumerate(zip(self._offsets, self._phases)):
+                np.matmul(
+                    windows[offset : offset + span : self._down],
+                    self._filters[phase],
+                    out=output[:, j],
+                )
+
+        # 消費した入力を捨て、次の窓に必要な過去の入力と端数を先頭に詰める
+        consumed = periods * self._down
+        self._pending = total - consumed
+        self._input[: self._pending] = self._input[consumed:total]
+        return periods * self._up
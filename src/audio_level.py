@@ -0,0 +1,322 @@
+import heapq
+import math
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+from sora_sdk import Sora, SoraAudioFrame, SoraConnection, SoraMediaTrack
+
+import startup_timing
+from config import get_config
+from connection_manager import ConnectionManager, SinkClasses
+from instrumentation import enable_instrumentation_from_config
+from signaling_url_selector import SignalingUrlSelector
+
+# int16 のフルスケールと、無音の場合に返す値
+_FULL_SCALE = 32768.0
+MIN_DBFS = -127.0
+
+
+class AudioLevel(NamedTuple):
+    """1 フレームの音声のレベル。いずれも dBFS。"""
+
+    rms_dbfs: float
+    peak_dbfs: float
+    # 減衰させながら保持したピーク
+    peak_hold_dbfs: float
+    # RMS を時定数 smoothing_s で平滑化した値。話者の順位付けに使う
+    level_dbfs: float
+
+
+class _TrackState:
+    __slots__ = ("samples", "power", "peak_hold_dbfs", "hold_until", "updated_at", "level")
+
+    def __init__(self) -> None:
+        self.samples = np.empty(0, dtype=np.float32)
+        self.power: float = 0.0
+        self.peak_hold_dbfs: float = MIN_DBFS
+        self.hold_until: float = 0.0
+        self.updated_at: Optional[float] = None
+        self.level = AudioLevel(MIN_DBFS, MIN_DBFS, MIN_DBFS, MIN_DBFS)
+
+
+def _to_dbfs(power: float) -> float:
+    # power はフルスケールで割った振幅の 2 乗
+    return max(MIN_DBFS, 10 * math.log10(power)) if power > 0 else MIN_DBFS
+
+
+class AudioLevelMeter:
+    """
+    トラックごとの音声の RMS とピークを dBFS で求めるクラス。
+
+    VAD よりも軽い処理で、発話中の話者の表示や無音の検知に使います。
+    フレームの ndarray は新たに確保せず、トラックごとに確保した float32 のバッファに並べて求めます。
+    ピークは peak_hold_s の間保持してから peak_decay_db_per_s で下げ、
+    平滑化した RMS で音量の大きいトラックを順位付けします。
+    同じトラックの process() は同時に呼び出さないでください。
+    """
+
+    def __init__(
+        self,
+        peak_hold_s: float = 1.0,
+        peak_decay_db_per_s: float = 20.0,
+        smoothing_s: float = 0.3,
+    ):
+        """
+        AudioLevelMeter インスタンスを初期化します。
+
+        :param peak_hold_s: ピークを下げずに保持する時間（秒）
+        :param peak_decay_db_per_s: 保持した後にピークを下げる速さ（dB/秒）
+        :param smoothing_s: 順位付けに使う RMS を平滑化する時定数（秒）
+        """
+        if peak_hold_s < 0 or peak_decay_db_per_s < 0:
+            raise ValueError("peak_hold_s と peak_decay_db_per_s には 0 以上を指定してください")
+        if smoothing_s <= 0:
+            raise ValueError("smoothing_s には正の値を指定してください")
+        self._peak_hold_s: float = peak_hold_s
+        self._peak_decay_db_per_s: float = peak_decay_db_per_s
+        self._smoothing_s: float = smoothing_s
+        self._lock = threading.Lock()
+        self._tracks: dict[str, _TrackState] = {}
+
+    def process(self, track_id: str, data: np.ndarray, now: Optional[float] = None) -> AudioLevel:
+        """
+        1 フレームの音声のレベルを求めます。
+
+        :param track_id: トラック ID
+        :param data: SoraAudioFrame.data() の (サンプル数, チャンネル数) の int16 の音声
+        :param now: 現在の時刻（time.monotonic() の値）。省略した場合は現在の時刻
+        :return: フレームのレベル
+        """
+        if now is None:
+            now = time.monotonic()
+        state = self._tracks.get(track_id)
+        if state is None:
+            with self._lock:
+                state = self._tracks.setdefault(track_id, _TrackState())
+
+        samples = data.reshape(-1)
+        count = len(samples)
+        if count == 0:
+            return state.level
+        if len(state.samples) < count:
+            state.samples = np.empty(count, dtype=np.float32)
+        # float32 に並べると、int16 で溢れずに内積で 2 乗の和を 1 回で求められる
+        scaled = state.samples[:count]
+        np.copyto(scaled, samples)
+        power = float(scaled.dot(scaled)) / (count * _FULL_SCALE * _FULL_SCALE)
+        np.abs(scaled, out=scaled)
+        peak = float(np.maximum.reduce(scaled))
+        rms_dbfs = _to_dbfs(power)
+        peak_dbfs = max(MIN_DBFS, 20 * math.log10(peak / _FULL_SCALE)) if peak > 0 else MIN_DBFS
+
+        elapsed_s = 0.0 if state.updated_at is None else now - state.updated_at
+        if peak_dbfs >= state.peak_hold_dbfs:
+            state.peak_hold_dbfs = peak_dbfs
+            state.hold_until = now + self._peak_hold_s
+        elif now > state.hold_until:
+            decayed = state.peak_hold_dbfs - self._peak_decay_db_per_s * elapsed_s
+            state.peak_hold_dbfs = max(peak_dbfs, decayed)
+        # 1 - exp(-elapsed_s / smoothing_s) の 1 次近似。フレームの間隔は時定数より十分短い
+        state.power += (power - state.power) * min(1.0, elapsed_s / self._smoothing_s)
+        state.updated_at = now
+
+        state.level = AudioLevel(rms_dbfs, peak_dbfs, state.peak_hold_dbfs, _to_dbfs(state.power))
+        return state.level
+
+    def level(self, track_id: str) -> Optional[AudioLevel]:
+        """
+        トラックの最後のフレームのレベルを返します。
+
+        :param track_id: トラック ID
+        """
+        state = self._tracks.get(track_id)
+        return None if state is None else state.level
+
+    def loudest(self, count: int) -> list[tuple[str, AudioLevel]]:
+        """
+        平滑化した RMS の大きい順にトラックを返します。
+
+        :param count: 返すトラックの数
+        """
+        with self._lock:
+            levels = [(track_id, state.level) for track_id, state in self._tracks.items()]
+        return heapq.nlargest(count, levels, key=lambda item: item[1].level_dbfs)
+
+    def silent_tracks(self, threshold_dbfs: float) -> list[str]:
+        """
+        保持したピークがしきい値を下回っているトラックを返します。
+
+        :param threshold_dbfs: 無音とみなすピークのしきい値（dBFS）
+        """
+        with self._lock:
+            states = list(self._tracks.items())
+        return [
+            track_id for track_id, state in states if state.level.peak_hold_dbfs < threshold_dbfs
+        ]
+
+    def remove_track(self, track_id: str) -> None:
+        """
+        トラックのレベルを破棄します。
+
+        :param track_id: トラック ID
+        """
+        with self._lock:
+            self._tracks.pop(track_id, None)
+
+
+class AudioLevelMonitor(ConnectionManager):
+    """受信したすべての音声トラックのレベルを求め、音量の大きいトラックと無音のトラックを表示するクラス。"""
+
+    def __init__(
+        self,
+        signaling_urls: list[str],
+        channel_id: str,
+        metadata: Optional[dict[str, Any]],
+        silence_dbfs: float = -60.0,
+        top_count: int = 3,
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        sora: Optional[Sora] = None,
+        sink_classes: Optional[SinkClasses] = None,
+    ):
+        """
+        AudioLevelMonitor インスタンスを初期化します。
+
+        :param signaling_urls: Sora シグナリング URL のリスト
+        :param channel_id: 接続するチャンネル ID
+        :param metadata: 接続のためのオプションのメタデータ
+        :param silence_dbfs: 無音とみなすピークのしきい値（dBFS）
+        :param top_count: 表示する音量の大きいトラックの数
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param sora: 利用する Sora インスタンス。省略した場合は新しく作成します
+        :param sink_classes: 受信に使うシンクのクラス。FakeSora の場合は FAKE_SINK_CLASSES
+        """
+        super().__init__(
+            sora or Sora(),
+            signaling_urls,
+            reconnect=reconnect,
+            url_selector=url_selector,
+            sink_classes=sink_classes,
+        )
+        self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._silence_dbfs: float = silence_dbfs
+        self._top_count: int = top_count
+
+        # レベルを求めるだけなので、サンプル数の少ない 16 kHz モノラルで受け取る
+        self._audio_output_frequency: int = 16000
+        self._audio_output_channels: int = 1
+
+        self.meter = AudioLevelMeter()
+        self._sinks_lock = threading.Lock()
+        self._sinks: dict[str, tuple[SoraMediaTrack, Any]] = {}
+        self._notify_dispatcher.on("connection.destroyed", self._on_connection_destroyed)
+
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        # 再接続するとトラックは新しい接続で届き直すので、前の接続のトラックは外す
+        with self._sinks_lock:
+            track_ids = list(self._sinks)
+        for track_id in track_ids:
+            self._remove_track(track_id)
+
+        connection = self._sora.create_connection(
+            signaling_urls=signaling_urls,
+            role="recvonly",
+            channel_id=self._channel_id,
+            metadata=self._metadata,
+            audio=True,
+            video=False,
+        )
+        connection.on_track = self._on_track
+        return connection
+
+    def _on_track(self, track: SoraMediaTrack) -> None:
+        if track.kind != "audio":
+            return
+        sink = self._sink_classes.audio_stream_sink(
+            track, self._audio_output_frequency, self._audio_output_channels
+        )
+        sink.on_frame = lambda frame: self._on_frame(track.id, frame)
+        with self._sinks_lock:
+            self._sinks[track.id] = (track, sink)
+
+    def _on_frame(self, track_id: str, frame: SoraAudioFrame) -> None:
+        started_ns = self._instrumentation.now()
+        # 配信中のフレームが、外したトラックのレベルを作り直さないように
+        # 外すのと同じロックの中で、まだ受信中のトラックか確かめてから処理する
+        with self._sinks_lock:
+            if track_id not in self._sinks:
+                return
+            self.meter.process(track_id, frame.data())
+        self._instrumentation.record("audio_level.process", started_ns)
+        startup_timing.mark("first_frame")
+
+    def _on_connection_destroyed(self, message: dict[str, Any]) -> None:
+        # トラックのストリーム ID は送信元の connection_id
+        connection_id = message.get("connection_id")
+        with self._sinks_lock:
+            track_ids = [
+                track_id
+                for track_id, (track, _) in self._sinks.items()
+                if track.stream_id == connection_id
+            ]
+        for track_id in track_ids:
+            self._remove_track(track_id)
+
+    def _remove_track(self, track_id: str) -> None:
+        with self._sinks_lock:
+            removed = self._sinks.pop(track_id, None)
+        if removed is not None:
+            # 外したあとに届いたフレームでレベルを作り直さない
+            removed[1].on_frame = None
+            self.meter.remove_track(track_id)
+
+    def report(self) -> str:
+        """音量の大きいトラックと無音のトラックを 1 行にまとめて返します。"""
+        loudest = ", ".join(
+            f"{track_id}={level.level_dbfs:.1f}dBFS"
+            for track_id, level in self.meter.loudest(self._top_count)
+        )
+        silent = ", ".join(self.meter.silent_tracks(self._silence_dbfs))
+        return f"Loudest: [{loudest}] Silent: [{silent}]"
+
+    def run(self) -> None:
+        """1 秒ごとにレベルを表示するメインループ。"""
+        self.connect()
+        try:
+            # 再接続を待つ間も含めて、閉じられるまで表示を続ける
+            while not self._closed.wait(1):
+                print(self.report())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.disconnect()
+
+
+def audio_level() -> None:
+    """
+    設定を使用して AudioLevelMonitor インスタンスを設定し実行します。
+
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
+    """
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
+
+    monitor = AudioLevelMonitor(
+        config.signaling_urls,
+        config.channel_id,
+        metadata=config.metadata,
+        silence_dbfs=config.level_silence_dbfs,
+        top_count=config.level_top_count,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+    )
+    monitor.run()
+
+
+if __name__ == "__main__":
+    audio_level()
@@ -0,0 +1,221 @@
+import threading
+from typing import Any, Optional
+
+import numpy as np
+
+from instrumentation import get_instrumentation
+
+_INT16_MAX = 32767
+
+
+class AudioMixer:
+    """
+    複数の音声トラックのシンクから一定の長さずつ読み出して混ぜ、再生用のリングバッファに書き込むクラス。
+
+    読み出しと混合は別スレッドで行い、出力デバイスのコールバックではリングバッファから
+    コピーするだけにします。音声が届いたトラックのブロックだけを事前に確保した float32 の配列に
+    詰めて並べ、ゲインとの内積で 1 回で足してから、ソフトクリップして int16 に戻します。
+    書き込みは混合スレッドの 1 スレッド、読み出しはコールバックの 1 スレッドだけが行います。
+
+    シンクから音声が届いていないトラックはコピーも足し算もせずに無音として扱い、
+    コールバックで再生する音声が足りなかったサンプル数を underflows に数えます。
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int,
+        block_ms: int = 20,
+        buffer_blocks: int = 4,
+        soft_clip_knee: float = 0.75,
+    ):
+        """
+        AudioMixer インスタンスを初期化します。
+
+        :param sample_rate: 出力のサンプリングレート。シンクもこの形式で作成してください
+        :param channels: 出力のチャンネル数
+        :param block_ms: 1 回にシンクから読み出して混ぜる長さ（ms）
+        :param buffer_blocks: 再生用のリングバッファに貯めるブロックの数
+        :param soft_clip_knee: ソフトクリップを始める振幅の最大値に対する割合
+        """
+        if not 0 < soft_clip_knee < 1:
+            raise ValueError("soft_clip_knee には 0 より大きく 1 未満を指定してください")
+        self._channels: int = channels
+        self._block: int = sample_rate * block_ms // 1000
+        self._block_s: float = block_ms / 1000
+        self._knee: int = int(_INT16_MAX * soft_clip_knee)
+
+        # ブロックの境目でリングが折り返すように、容量はブロックの倍数にする
+        self._capacity: int = self._block * buffer_blocks
+        self._playout = np.zeros((self._capacity, channels), dtype=np.int16)
+        self._written: int = 0
+        self._read: int = 0
+        self._writable = threading.Event()
+
+        # 音声が届いたトラックのブロックとゲインを先頭から詰める。トラックが増えたときだけ確保し直す
+        self._blocks = np.zeros((0, self._block, channels), dtype=np.float32)
+        self._active_gains = np.zeros(0, dtype=np.float32)
+        self._mixed = np.zeros((self._block, channels), dtype=np.float32)
+        self._magnitude = np.zeros((self._block, channels), dtype=np.float32)
+
+        self._lock = threading.Lock()
+        self._sinks: dict[str, Any] = {}
+        self._gains: dict[str, float] = {}
+        # 混合スレッドが使うシンクとゲインの一覧。トラックかゲインが変わったら作り直す
+        self._snapshot: Optional[tuple[list[Any], list[float]]] = None
+
+        self.underflows: int = 0
+
+        self._instrumentation = get_instrumentation()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def track_count(self) -> int:
+        """混ぜているトラックの数。"""
+        return len(self._sinks)
+
+    def add_track(self, track_id: str, sink: Any, gain: Optional[float] = None) -> None:
+        """
+        混ぜるトラックを追加します。
+
+        :param track_id: トラック ID
+        :param sink: read(frames, timeout) で音声を返す SoraAudioSink
+        :param gain: ゲイン。省略した場合は set_gain() で指定した値か 1.0
+        """
+        with self._lock:
+            self._sinks[track_id] = sink
+            if gain is not None:
+                self._gains[track_id] = gain
+            self._snapshot = None
+
+    def remove_track(self, track_id: str) -> None:
+        """
+        トラックを混ぜるのをやめます。
+
+        :param track_id: トラック ID
+        """
+        with self._lock:
+            self._sinks.pop(track_id, None)
+            self._gains.pop(track_id, None)
+            self._snapshot = None
+
+    def set_gain(self, track_id: str, gain: float) -> None:
+        """
+        トラックのゲインを変更します。
+
+        :param track_id: トラック ID
+        :param gain: 0 以上 4 以下のゲイン。1.0 でそのままの音量
+        """
+        if not 0 <= gain <= 4:
+            raise ValueError("gain には 0 以上 4 以下を指定してください")
+        with self._lock:
+            self._gains[track_id] = gain
+            self._snapshot = None
+
+    def fill(self) -> int:
+        """
+        再生用のリングバッファが一杯になるまで、シンクから読み出して混ぜます。
+
+        :return: 書き込んだブロックの数
+        """
+        blocks = 0
+        while self._capacity - (self._written - self._read) >= self._block:
+            started_ns = self._instrumentation.now()
+            start = self._written % self._capacity
+            self._mix_block(self._playout[start : start + self._block])
+            self._written += self._block
+            self._instrumentation.record("recvonly.audio_mix", started_ns)
+            blocks += 1
+        return blocks
+
+    def read_into(self, outdata: np.ndarray) -> None:
+        """
+        混ぜた音声を出力バッファにコピーします。出力デバイスのコールバックから呼び出します。
+
+        足りない分は無音にします。
+
+        :param outdata: (サンプル数, チャンネル数) の int16 の出力バッファ
+        """
+        frames = min(len(outdata), self._written - self._read)
+        if frames < len(outdata):
+            self.underflows += len(outdata) - frames
+            outdata[frames:] = 0
+        if frames > 0:
+            start = self._read % self._capacity
+            first = min(frames, self._capacity - start)
+            outdata[:first] = self._playout[start : start + first]
+            outdata[first:frames] = self._playout[: frames - first]
+            self._read += frames
+        self._writable.set()
+
+    def start(self) -> None:
+        """シンクから読み出して混ぜる混合スレッドを開始します。"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """混合スレッドを停止します。"""
+        self._stopped.set()
+        self._writable.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            # 出力デバイスのクロックに合わせて、読み出されて空いた分だけ混ぜる
+            self.fill()
+            self._writable.wait(self._block_s)
+            self._writable.clear()
+
+    def _get_snapshot(self) -> tuple[list[Any], list[float]]:
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = (
+                    list(self._sinks.values()),
+                    [self._gains.get(track_id, 1.0) for track_id in self._sinks],
+                )
+            return self._snapshot
+
+    def _mix_block(self, out: np.ndarray) -> None:
+        sinks, gains = self._get_snapshot()
+        count = len(sinks)
+        if count > len(self._blocks):
+            capacity = max(count, len(self._blocks) * 2)
+            self._blocks = np.zeros((capacity, self._block, self._channels), dtype=np.float32)
+            self._active_gains = np.zeros(capacity, dtype=np.float32)
+        blocks = self._blocks
+        active_gains = self._active_gains
+        frames = self._block
+        active = 0
+        for sink, gain in zip(sinks, gains):
+            # 届いていないトラックを待つと他のトラックが遅れるので、待たずに飛ばす
+            success, data = sink.read(frames, timeout=0)
+            if success and len(data) == frames and gain > 0:
+                blocks[active] = data
+                active_gains[active] = gain
+                active += 1
+        if active == 0:
+            out[:] = 0
+            return
+
+        # (トラック数, サンプル数 x チャンネル数) の 2 次元にして、ゲインとの内積でまとめて足す
+        flat = blocks[:active].reshape(active, -1)
+        mixed = self._mixed
+        np.dot(active_gains[:active], flat, out=mixed.reshape(-1))
+        self._soft_clip(mixed)
+        np.rint(mixed, out=mixed)
+        np.copyto(out, mixed, casting="unsafe")
+
+    def _soft_clip(self, mixed: np.ndarray) -> None:
+        # knee を超えた振幅だけを、最大値に漸近するように圧縮する
+        np.abs(mixed, out=self._magnitude)
+        over = self._magnitude > self._knee
+        if not over.any():
+            return
+        headroom = _INT16_MAX - self._knee
+        excess = self._magnitude[over] - self._knee
+        compressed = self._knee + excess * headroom / (excess + headroom)
+        mixed[over] = np.copysign(compressed, mixed[over])
@@ -0,0 +1,142 @@
+import threading
+from typing import Optional
+
+import numpy as np
+from sora_sdk import SoraAudioSource
+
+from audio_converter import AudioConverter
+from instrumentation import get_instrumentation
+
+
+class AudioRingBuffer:
+    """
+    入力デバイスから受け取った音声を貯め、ちょうど 10 ms ずつ SoraAudioSource に渡すクラス。
+
+    コールバックでは事前に確保したリングバッファにコピーするだけで、
+    on_data の呼び出しは別スレッドで行うので、リアルタイムのコールバックを詰まらせません。
+    書き込みはコールバックの 1 スレッド、読み出しは送信スレッドの 1 スレッドだけが行います。
+    入力デバイスと audio_source の形式が違う場合も、変換は送信スレッドで行います。
+
+    バッファが一杯で捨てたサンプル数を overflows、
+    音声が届かずに送信スレッドが待ちきれなかった回数を underflows に数えます。
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int,
+        capacity_ms: int = 500,
+        chunk_ms: int = 10,
+        converter: Optional[AudioConverter] = None,
+    ):
+        """
+        AudioRingBuffer インスタンスを初期化します。
+
+        :param sample_rate: 書き込む音声のサンプリングレート
+        :param channels: 書き込む音声のチャンネル数
+        :param capacity_ms: 貯めておける長さ（ms）
+        :param chunk_ms: 1 回に on_data に渡す長さ（ms）
+        :param converter: 指定した場合は、読み出した音声を送信スレッドで変換して渡します。
+            サンプリングレートが 100 Hz の倍数であれば、変換後も chunk_ms ずつになります
+        """
+        self._capacity: int = sample_rate * capacity_ms // 1000
+        self._samples_per_chunk: int = sample_rate * chunk_ms // 1000
+        self._chunk_s: float = chunk_ms / 1000
+        self._buffer = np.zeros((self._capacity, channels), dtype=np.int16)
+        # on_data に渡すためのバッファ。on_data の間に書き込みで上書きされないようにコピーする
+        self._chunk = np.zeros((self._samples_per_chunk, channels), dtype=np.int16)
+
+        # これまでに書き込んだサンプル数と読み出したサンプル数。差が貯まっているサンプル数になる
+        self._written: int = 0
+        self._read: int = 0
+        self._readable = threading.Event()
+
+        self.overflows: int = 0
+        self.underflows: int = 0
+
+        self._converter: Optional[AudioConverter] = converter
+        self._instrumentation = get_instrumentation()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def available(self) -> int:
+        """貯まっているサンプル数。"""
+        return self._written - self._read
+
+    def write(self, data: np.ndarray) -> None:
+        """
+        音声をリングバッファにコピーします。入力デバイスのコールバックから呼び出します。
+
+        :param data: (サンプル数, チャンネル数) の int16 の音声
+        """
+        frames = min(len(data), self._capacity - (self._written - self._read))
+        if frames < len(data):
+            self.overflows += len(data) - frames
+        if frames > 0:
+            start = self._written % self._capacity
+            first = min(frames, self._capacity - start)
+            self._buffer[start : start + first] = data[:first]
+            self._buffer[: frames - first] = data[first:frames]
+            self._written += frames
+        if self._written - self._read >= self._samples_per_chunk:
+            self._readable.set()
+
+    def read(self) -> Optional[np.ndarray]:
+        """
+        10 ms 分の音声を読み出します。
+
+        返すバッファは次の呼び出しで上書きされます。
+
+        :return: (samples_per_chunk, チャンネル数) の音声。貯まっていない場合は None
+        """
+        if self._written - self._read < self._samples_per_chunk:
+            return None
+        start = self._read % self._capacity
+        end = start + self._samples_per_chunk
+        if end <= self._capacity:
+            self._chunk[:] = self._buffer[start:end]
+        else:
+            first = self._capacity - start
+            self._chunk[:first] = self._buffer[start:]
+            self._chunk[first:] = self._buffer[: end - self._capacity]
+        self._read += self._samples_per_chunk
+        return self._chunk
+
+    def start(self, audio_source: SoraAudioSource) -> None:
+        """
+        貯まった音声を audio_source に渡す送信スレッドを開始します。
+
+        :param audio_source: 音声を渡す SoraAudioSource
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._feed, args=(audio_source,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """送信スレッドを停止します。"""
+        self._stopped.set()
+        self._readable.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _feed(self, audio_source: SoraAudioSource) -> None:
+        instrumentation = self._instrumentation
+        converter = self._converter
+        while not self._stopped.is_set():
+            # 入力デバイスのクロックに合わせて、書き込まれたら送る
+            if not self._readable.wait(self._chunk_s * 2):
+                self.underflows += 1
+                continue
+            self._readable.clear()
+            while (chunk := self.read()) is not None:
+                if converter is not None:
+                    started_ns = instrumentation.now()
+                    chunk = converter.convert(chunk)
+                    instrumentation.record("sendonly.audio_convert", started_ns)
+                    if len(chunk) == 0:
+                        continue
+                started_ns = instrumentation.now()
+                audio_source.on_data(chunk)
+                instrumentation.record("sendonly.audio_feed", started_ns)
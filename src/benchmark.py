@@ -0,0 +1,634 @@
+import contextlib
+import json
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from audio_level import AudioLevelMeter
+from audio_mixer import AudioMixer
+from config import HIDEFACE_MODES, get_config
+from face_detectors import (
+    FaceBox,
+    FaceDetector,
+    calibrate_face_detectors,
+    create_available_face_detectors,
+)
+from fake_sora import FAKE_SINK_CLASSES, FakeSora, FakeSoraServer
+from hideface_sender import LogoStreamer
+from instrumentation import Histogram
+from media_recvonly import Recvonly
+from media_sendonly import Sendonly
+from messaging import Messaging
+from synthetic_media import SyntheticAudioGenerator, SyntheticVideoGenerator
+from vad import VAD
+
+# FakeSora はネットワークにつながないので、URL は使われない
+SIGNALING_URLS = ["wss://benchmark.invalid/signaling"]
+
+# hideface で重ねる顔の数
+HIDEFACE_FACE_COUNTS = (0, 1, 4, 8)
+
+
+class BenchmarkCapture:
+    """
+    cv2.VideoCapture の代わりに合成映像を返すクラス。
+
+    フレームの先頭 8 画素の青の値にフレーム番号を書き込み、読み出した時刻を記録します。
+    最初の read() から duration_s 秒経つと isOpened() が False になります。
+    """
+
+    def __init__(self, width: int, height: int, duration_s: float):
+        self._generator = SyntheticVideoGenerator(width, height, pattern="testcard")
+        self._duration_s: float = duration_s
+        self._deadline: Optional[float] = None
+        self._released: bool = False
+        # フレーム番号ごとの読み出した時刻
+        self.captured_ns: list[int] = []
+
+    def isOpened(self) -> bool:  # noqa: N802
+        return not self._released and (self._deadline is None or time.monotonic() < self._deadline)
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        if not self.isOpened():
+            return False, None
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self._duration_s
+        frame = self._generator.next_frame()
+        frame[0, :8, 0] = np.frombuffer(len(self.captured_ns).to_bytes(8, "little"), np.uint8)
+        self.captured_ns.append(time.perf_counter_ns())
+        return True, frame
+
+    def release(self) -> None:
+        self._released = True
+
+    @staticmethod
+    def frame_index(frame: np.ndarray) -> int:
+        """read() で書き込んだフレーム番号を読み出します。"""
+        return int.from_bytes(frame[0, :8, 0].tobytes(), "little")
+
+
+def _elapsed_s(started_ns: int, finished_ns: int) -> float:
+    return max(finished_ns - started_ns, 1) / 1e9
+
+
+def _latency_ms(histogram: Histogram, prefix: str) -> dict[str, float]:
+    snapshot = histogram.snapshot(percentiles=(50, 99))
+    if snapshot["count"] == 0:
+        return {}
+    return {
+        f"{prefix}_p50_ms": snapshot["p50_ns"] / 1e6,
+        f"{prefix}_p99_ms": snapshot["p99_ns"] / 1e6,
+    }
+
+
+def benchmark_sendonly(duration_s: float, width: int = 640, height: int = 480) -> dict[str, Any]:
+    """
+    Sendonly.run で送ったフレームが Recvonly の表示待ちのキューから取り出されるまでを計測します。
+
+    :param duration_s: 送信する時間（秒）
+    :param width: 映像の幅
+    :param height: 映像の高さ
+    """
+    server = FakeSoraServer()
+    recvonly = Recvonly(
+        SIGNALING_URLS,
+        "benchmark",
+        sora=FakeSora(server),
+        sink_classes=FAKE_SINK_CLASSES,
+        video_queue_size=30,
+    )
+    capture = BenchmarkCapture(width, height, duration_s)
+    sendonly = Sendonly(
+        SIGNALING_URLS, "benchmark", audio=False, video_capture=capture, sora=FakeSora(server)
+    )
+
+    recvonly.connect()
+    sender = threading.Thread(target=sendonly.run, daemon=True)
+    sender.start()
+    latency = Histogram()
+    received = 0
+    last_received_ns = 0
+    try:
+        while True:
+            if (frame := recvonly.get_video_frame(timeout=0.1)) is None:
+                if not sender.is_alive():
+                    break
+                continue
+            last_received_ns = time.perf_counter_ns()
+            index = BenchmarkCapture.frame_index(frame.data())
+            latency.record(last_received_ns - capture.captured_ns[index])
+            received += 1
+    finally:
+        sender.join(timeout=10)
+        recvonly.disconnect()
+
+    if received == 0:
+        return {"frames_received": 0}
+    elapsed_s = _elapsed_s(capture.captured_ns[0], last_received_ns)
+    return {
+        "frames_per_s": received / elapsed_s,
+        **_latency_ms(latency, "latency"),
+        "frames_captured": len(capture.captured_ns),
+        "frames_received": received,
+        "dropped_frames": recvonly.dropped_frames,
+    }
+
+
+def benchmark_glass_to_glass(
+    duration_s: float, width: int = 640, height: int = 480
+) -> dict[str, Any]:
+    """
+    Sendonly が書き込んだ時刻のバーコードを Recvonly で読み出し、キャプチャしてから
+    受信側でフレームを ndarray にするまでの時間を計測します。
+
+    FakeSora はエンコードもネットワークも通らないので、Python のパイプラインだけの時間になります。
+
+    :param duration_s: 送信する時間（秒）
+    :param width: 映像の幅
+    :param height: 映像の高さ
+    """
+    server = FakeSoraServer()
+    recvonly = Recvonly(
+        SIGNALING_URLS,
+        "benchmark",
+        sora=FakeSora(server),
+        sink_classes=FAKE_SINK_CLASSES,
+        video_queue_size=30,
+        latency_stamp=True,
+    )
+    capture = BenchmarkCapture(width, height, duration_s)
+    sendonly = Sendonly(
+        SIGNALING_URLS,
+        "benchmark",
+        audio=False,
+        video_capture=capture,
+        sora=FakeSora(server),
+        latency_stamp=True,
+    )
+    latency_meter = recvonly.latency_meter
+    assert latency_meter is not None
+
+    recvonly.connect()
+    sender = threading.Thread(target=sendonly.run, daemon=True)
+    sender.start()
+    decode = Histogram()
+    try:
+        while True:
+            if (item := recvonly.get_track_frame(timeout=0.1)) is None:
+                if not sender.is_alive():
+                    break
+                continue
+            data = item.frame.data()
+            started_ns = time.perf_counter_ns()
+            latency_meter.measure(item.stream_id, data)
+            decode.record(time.perf_counter_ns() - started_ns)
+    finally:
+        sender.join(timeout=10)
+        recvonly.disconnect()
+
+    snapshots = list(latency_meter.snapshot().values())
+    if not snapshots:
+        return {"frames_measured": 0}
+    snapshot = snapshots[0]
+    return {
+        "latency_p50_ms": snapshot["p50_ns"] / 1e6,
+        "latency_p99_ms": snapshot["p99_ns"] / 1e6,
+        **_latency_ms(decode, "decode"),
+        "frames_measured": snapshot["count"],
+        "unmeasured_frames": latency_meter.unmeasured_frames,
+    }
+
+
+class _EchoMessaging(Messaging):
+    """受信したメッセージをそのまま送り返す Messaging。"""
+
+    def _on_message(self, label: str, data: bytes):
+        if self._connection is not None:
+            self._connection.send_data_channel(label, data)
+
+
+class _PingMessaging(Messaging):
+    """送り返されたメッセージの往復時間を記録する Messaging。"""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.rtt = Histogram()
+        self.sent_ns: dict[int, int] = {}
+        self.echoed: int = 0
+        self.last_echoed_ns: int = 0
+        self.echo_received = threading.Event()
+
+    def ping(self, sequence: int, size: int) -> None:
+        self.sent_ns[sequence] = time.perf_counter_ns()
+        self.send(sequence.to_bytes(8, "little").ljust(size, b"\0"))
+
+    def _on_message(self, label: str, data: bytes):
+        now_ns = time.perf_counter_ns()
+        self.rtt.record(now_ns - self.sent_ns.pop(int.from_bytes(data[:8], "little")))
+        self.echoed += 1
+        self.last_echoed_ns = now_ns
+        self.echo_received.set()
+
+
+def benchmark_messaging(
+    duration_s: float, message_size: int = 256, ping_count: int = 200, max_in_flight: int = 1000
+) -> dict[str, Any]:
+    """
+    Messaging の往復時間と、送り返されたメッセージの 1 秒あたりの数を計測します。
+
+    往復時間は 1 つずつ送って計測し、スループットは duration_s 秒の間できるだけ速く送って
+    計測します。
+
+    :param duration_s: スループットを計測する時間（秒）
+    :param message_size: メッセージの大きさ（バイト）
+    :param ping_count: 往復時間を計測する回数
+    :param max_in_flight: スループットの計測で送り返されるのを待たずに送るメッセージの数の上限
+    """
+    server = FakeSoraServer()
+    data_channels = [{"label": "#benchmark", "direction": "sendrecv"}]
+    echo = _EchoMessaging(SIGNALING_URLS, "benchmark", data_channels, sora=FakeSora(server))
+    ping = _PingMessaging(SIGNALING_URLS, "benchmark", data_channels, sora=FakeSora(server))
+
+    echo.connect()
+    ping.connect()
+    try:
+        for sequence in range(ping_count):
+            ping.echo_received.clear()
+            ping.ping(sequence, message_size)
+            if not ping.echo_received.wait(5):
+                raise AssertionError("Echo message was not received.")
+        rtt = ping.rtt
+        ping.rtt = Histogram()
+        ping.echoed = 0
+
+        started_ns = time.perf_counter_ns()
+        deadline = time.monotonic() + duration_s
+        sent = 0
+        while time.monotonic() < deadline:
+            # 送り返されていないメッセージが貯まりすぎないようにする
+            if sent - ping.echoed >= max_in_flight:
+                time.sleep(0)
+                continue
+            ping.ping(ping_count + sent, message_size)
+            sent += 1
+        # 送り返されるメッセージを待つ
+        wait_deadline = time.monotonic() + 10
+        while ping.echoed < sent and time.monotonic() < wait_deadline:
+            time.sleep(0.01)
+    finally:
+        ping.disconnect()
+        echo.disconnect()
+
+    return {
+        "messages_per_s": ping.echoed / _elapsed_s(started_ns, ping.last_echoed_ns),
+        **_latency_ms(rtt, "rtt"),
+        "messages_sent": sent,
+        "messages_echoed": ping.echoed,
+    }
+
+
+class _CountingVAD(VAD):
+    """結果を表示せずに解析だけ行い、解析したフレームの数を数える VAD。"""
+
+    frames: int = 0
+
+    def _on_frame(self, frame: Any):
+        self._vad.analyze(frame)
+        self.frames += 1
+
+
+def benchmark_vad(duration_s: float) -> dict[str, Any]:
+    """
+    送信側の 16 kHz の音声を VAD が 24 kHz で受け取って解析する 1 秒あたりのフレーム数を計測します。
+
+    音声はリアルタイムではなく、できるだけ速く送ります。
+
+    :param duration_s: 送信する時間（秒）
+    """
+    server = FakeSoraServer()
+    vad = _CountingVAD(
+        SIGNALING_URLS, "benchmark", None, sora=FakeSora(server), sink_classes=FAKE_SINK_CLASSES
+    )
+    sendonly = Sendonly(SIGNALING_URLS, "benchmark", video=False, sora=FakeSora(server))
+    generator = SyntheticAudioGenerator(16000, 1, pattern="tone")
+
+    vad.connect()
+    sendonly.connect()
+    try:
+        # VAD のトラックが届くまで待つ
+        deadline = time.monotonic() + 5
+        while vad.frames == 0 and time.monotonic() < deadline:
+            sendonly.audio_source.on_data(generator.next_chunk())
+        frames = vad.frames
+        started_ns = time.perf_counter_ns()
+        deadline = time.monotonic() + duration_s
+        while time.monotonic() < deadline:
+            sendonly.audio_source.on_data(generator.next_chunk())
+        finished_ns = time.perf_counter_ns()
+        frames = vad.frames - frames
+    finally:
+        sendonly.disconnect()
+        vad.disconnect()
+
+    return {"frames_per_s": frames / _elapsed_s(started_ns, finished_ns), "frames": frames}
+
+
+class _ToneSink:
+    """いつでも同じ音声のブロックを返す SoraAudioSink の代わり。"""
+
+    def __init__(self, data: np.ndarray):
+        self._data = data
+
+    def read(self, frames: int = 0, timeout: float = 1) -> tuple[bool, np.ndarray]:
+        return True, self._data[:frames]
+
+
+def benchmark_audio_mixer(
+    duration_s: float, track_counts: tuple[int, ...] = (1, 10, 50)
+) -> dict[str, Any]:
+    """
+    トラックの数ごとに、AudioMixer が 48 kHz ステレオの 20 ms のブロックを混ぜる速さを計測します。
+
+    会議のように 2 トラックだけが話していて、残りは小さな雑音のトラックとします。
+    cpu_percent はリアルタイムで再生する場合に混合に使う CPU 時間の割合です。
+
+    :param duration_s: トラックの数ごとに計測する時間（秒）
+    :param track_counts: 計測するトラックの数
+    """
+    speech = SyntheticAudioGenerator(48000, 2, pattern="tone")
+    noise = SyntheticAudioGenerator(48000, 2, pattern="noise")
+    speech_data = np.concatenate([speech.next_chunk() for _ in range(2)])
+    noise_data = np.concatenate([noise.next_chunk() for _ in range(2)]) // 100
+    results: dict[str, Any] = {}
+    for count in track_counts:
+        mixer = AudioMixer(48000, 2, block_ms=20, buffer_blocks=1)
+        for i in range(count):
+            mixer.add_track(str(i), _ToneSink(speech_data if i < 2 else noise_data), gain=0.5)
+        out = np.empty((len(speech_data), 2), dtype=np.int16)
+        blocks = 0
+        started_ns = time.perf_counter_ns()
+        deadline = time.monotonic() + duration_s
+        while time.monotonic() < deadline:
+            blocks += mixer.fill()
+            mixer.read_into(out)
+        elapsed_s = _elapsed_s(started_ns, time.perf_counter_ns())
+        results[f"tracks_{count}_blocks_per_s"] = blocks / elapsed_s
+        # 1 秒の再生には 50 ブロック必要
+        results[f"tracks_{count}_cpu_percent"] = 50 / (blocks / elapsed_s) * 100
+    return results
+
+
+def benchmark_audio_level(
+    duration_s: float, track_counts: tuple[int, ...] = (1, 100, 500)
+) -> dict[str, Any]:
+    """
+    トラックの数ごとに、AudioLevelMeter が 48 kHz ステレオの 10 ms のフレームを処理する速さを
+    計測します。
+
+    cpu_percent はすべてのトラックをリアルタイムで受信する場合に使う CPU 時間の割合です。
+
+    :param duration_s: トラックの数ごとに計測する時間（秒）
+    :param track_counts: 計測するトラックの数
+    """
+    generator = SyntheticAudioGenerator(48000, 2, pattern="tone")
+    frame = generator.next_chunk()[:480]
+    results: dict[str, Any] = {}
+    for count in track_counts:
+        meter = AudioLevelMeter()
+        track_ids = [str(i) for i in range(count)]
+        frames = 0
+        now = 0.0
+        started_ns = time.perf_counter_ns()
+        deadline = time.monotonic() + duration_s
+        while time.monotonic() < deadline:
+            now += 0.01
+            for track_id in track_ids:
+                meter.process(track_id, frame, now)
+            meter.loudest(3)
+            frames += count
+        elapsed_s = _elapsed_s(started_ns, time.perf_counter_ns())
+        results[f"tracks_{count}_frames_per_s"] = frames / elapsed_s
+        # 1 トラックあたり 1 秒に 100 フレーム届く
+        results[f"tracks_{count}_cpu_percent"] = count * 100 / (frames / elapsed_s) * 100
+    return results
+
+
+class _FixedFaceDetector(FaceDetector):
+    """
+    常に同じ数の顔を検出したことにする顔検出。
+
+    顔を含む映像を用意しなくても、重ねる顔の数ごとの処理時間を計測できます。
+    """
+
+    name = "fixed"
+
+    def __init__(self, face_count: int):
+        self._boxes = [
+            FaceBox(0.05 + 0.22 * (i % 4), 0.1 + 0.4 * (i // 4 % 2), 0.15, 0.15)
+            for i in range(face_count)
+        ]
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        return self._boxes
+
+
+def benchmark_hideface(
+    duration_s: float,
+    face_counts: tuple[int, ...] = HIDEFACE_FACE_COUNTS,
+    width: int = 640,
+    height: int = 480,
+) -> dict[str, Any]:
+    """
+    LogoStreamer.run_one_frame の 1 秒あたりのフレーム数を、顔を隠す方法と顔の数ごとに計測します。
+
+    顔検出のモデルの処理時間は含まず、色の変換と顔を隠す処理、送信の処理を計測します。
+    キャプチャの代わりに、毎フレーム元のフレームを作業用のバッファにコピーします。
+
+    :param duration_s: すべての方法と顔の数を合わせた計測時間（秒）
+    :param face_counts: 重ねる顔の数
+    :param width: 映像の幅
+    :param height: 映像の高さ
+    """
+    capture = BenchmarkCapture(width, height, duration_s)
+    _, frame = capture.read()
+    assert frame is not None
+    work = np.empty_like(frame)
+    results: dict[str, Any] = {}
+    for mode in HIDEFACE_MODES:
+        streamer = LogoStreamer(
+            SIGNALING_URLS,
+            "sendonly",
+            "benchmark",
+            None,
+            camera_id=0,
+            video_width=None,
+            video_height=None,
+            video_fps=None,
+            video_fourcc=None,
+            sora=FakeSora(FakeSoraServer()),
+            video_capture=capture,
+            mode=mode,
+        )
+        for face_count in face_counts:
+            face_detector = _FixedFaceDetector(face_count)
+            angle = 0
+            frames = 0
+            started_ns = time.perf_counter_ns()
+            deadline = time.monotonic() + duration_s / len(face_counts) / len(HIDEFACE_MODES)
+            while time.monotonic() < deadline:
+                # ロゴを重ねる場合は run_one_frame が渡したフレームを読み取り専用にする
+                work.flags.writeable = True
+                np.copyto(work, frame)
+                angle = streamer.run_one_frame(face_detector, angle, work)
+                frames += 1
+            finished_ns = time.perf_counter_ns()
+            results[f"{mode}_faces_{face_count}_frames_per_s"] = frames / _elapsed_s(
+                started_ns, finished_ns
+            )
+    return results
+
+
+def benchmark_face_detectors(
+    duration_s: float, frame_count: int = 30, width: int = 640, height: int = 480
+) -> dict[str, Any]:
+    """
+    この環境で使える顔検出のバックエンドごとに 1 フレームあたりの検出時間を計測します。
+
+    設定の SORA_YUNET_MODEL_PATH と SORA_HAAR_CASCADE_PATH を使います。
+
+    :param duration_s: 使わない。他のシナリオと引数をそろえるためのもの
+    :param frame_count: 計測に使うフレーム数
+    :param width: 映像の幅
+    :param height: 映像の高さ
+    """
+    config = get_config()
+    detectors = create_available_face_detectors(
+        yunet_model_path=config.yunet_model_path, haar_cascade_path=config.haar_cascade_path
+    )
+    if not detectors:
+        return {}
+    generator = SyntheticVideoGenerator(width, height, pattern="testcard")
+    frames = [generator.next_frame()[:, :, ::-1].copy() for _ in range(frame_count)]
+    detector, results = calibrate_face_detectors(detectors, frames, min_accuracy=0)
+    detector.close()
+    return {f"{result.name}_detect_p50_ms": result.detect_time_s * 1000 for result in results}
+
+
+# シナリオの名前と計測する関数
+SCENARIOS: dict[str, Callable[[float], dict[str, Any]]] = {
+    "sendonly": benchmark_sendonly,
+    "messaging": benchmark_messaging,
+    "vad": benchmark_vad,
+    "hideface": benchmark_hideface,
+    "face_detectors": benchmark_face_detectors,
+    "audio_mixer": benchmark_audio_mixer,
+    "audio_level": benchmark_audio_level,
+    "glass_to_glass": benchmark_glass_to_glass,
+}
+
+
+def run_benchmarks(scenarios: list[str], duration_s: float) -> dict[str, Any]:
+    """
+    FakeSora に接続してシナリオごとのベンチマークを実行します。
+
+    :param scenarios: 実行するシナリオの名前
+    :param duration_s: シナリオごとの計測時間（秒）
+    :return: 実行環境とシナリオごとの結果
+    :raises ValueError: 不明なシナリオが指定された場合
+    """
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise ValueError(f"シナリオは {tuple(SCENARIOS)} から指定してください: {name}")
+    # 結果を標準出力に書き出せるように、サンプルが表示する接続や切断のログは標準エラー出力に回す
+    with contextlib.redirect_stdout(sys.stderr):
+        results = {name: SCENARIOS[name](duration_s) for name in scenarios}
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "duration_s": duration_s,
+        "results": results,
+    }
+
+
+def compare_with_baseline(
+    report: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """
+    ベースラインと比べて悪化した値を返します。
+
+    名前が _per_s で終わる値は小さくなった場合、_ms で終わる値は大きくなった場合に、
+    その割合が threshold を超えたものを悪化とみなします。それ以外の値は比べません。
+    フレームが届かなくなったシナリオは値を返さないので、ベースラインにあるシナリオと
+    _per_s / _ms の値が結果にない場合も悪化とみなします。
+
+    :param report: run_benchmarks() の結果
+    :param baseline: ベースラインとして保存した run_benchmarks() の結果
+    :param threshold: 許容する悪化の割合。0.1 の場合は 10 % まで
+    :return: 悪化した値の説明
+    """
+    regressions = []
+    for scenario, baseline_metrics in baseline["results"].items():
+        metrics = report["results"].get(scenario)
+        if metrics is None:
+            regressions.append(f"{scenario}: missing from the report")
+            continue
+        for name, baseline_value in baseline_metrics.items():
+            if not name.endswith(("_per_s", "_ms")):
+                continue
+            value = metrics.get(name)
+            if value is None:
+                regressions.append(f"{scenario}.{name}: missing from the report")
+                continue
+            if baseline_value <= 0:
+                continue
+            if name.endswith("_per_s"):
+                change = (baseline_value - value) / baseline_value
+            else:
+                change = (value - baseline_value) / baseline_value
+            if change > threshold:
+                regressions.append(
+                    f"{scenario}.{name}: {baseline_value:.3f} -> {value:.3f} ({change:.1%} worse)"
+                )
+    return regressions
+
+
+def benchmark() -> None:
+    """
+    設定を使用してベンチマークを実行し、結果を JSON で書き出します。
+
+    benchmark_baseline のファイルがあれば比較して、悪化した値があれば終了コード 1 で終了します。
+    ファイルがなければ、今回の結果をベースラインとして保存します。
+
+    :raises ValueError: 設定の値が不正な場合
+    """
+    config = get_config()
+    report = run_benchmarks(config.benchmark_scenarios, config.benchmark_duration_s)
+
+    output = json.dumps(report, indent=2)
+    if config.benchmark_output:
+        Path(config.benchmark_output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+    if not config.benchmark_baseline:
+        return
+    baseline_path = Path(config.benchmark_baseline)
+    if not baseline_path.exists():
+        baseline_path.write_text(output + "\n", encoding="utf-8")
+        print(f"Saved baseline: {baseline_path}", file=sys.stderr)
+        return
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if regressions := compare_with_baseline(report, baseline, config.benchmark_threshold):
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1)
+    print(f"No regressions against {baseline_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,51 @@
+import argparse
+import importlib
+import os
+from typing import Optional
+
+import startup_timing
+
+# サブコマンドと、実行するモジュールと関数
+COMMANDS: dict[str, tuple[str, str]] = {
+    "sendonly": ("media_sendonly", "sendonly"),
+    "recvonly": ("media_recvonly", "recvonly"),
+    "messaging": ("messaging", "sendrecv"),
+    "vad": ("vad", "vad"),
+    "level": ("audio_level", "audio_level"),
+    "hideface": ("hideface_sender", "hideface_sender"),
+    "bridge": ("hideface_bridge", "hideface_bridge"),
+    "load": ("load_generator", "load_generator"),
+    "benchmark": ("benchmark", "benchmark"),
+}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    サンプルを実行するコマンドラインのエントリーポイント。
+
+    サブコマンドのモジュールだけを import するので、他のサンプルのライブラリは読み込みません。
+    import、接続、最初のフレームまでの時間を標準エラー出力に書き出します。
+
+    :param argv: コマンドライン引数。省略した場合は sys.argv
+    """
+    parser = argparse.ArgumentParser(prog="sora-examples", description="Sora Python SDK サンプル")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("--config", help="TOML もしくは JSON の設定ファイル")
+    parser.add_argument(
+        "--no-startup-timing", action="store_true", help="起動時間を出力しないようにします"
+    )
+    args = parser.parse_args(argv)
+
+    if args.config:
+        os.environ["SORA_CONFIG_FILE"] = args.config
+    if not args.no_startup_timing:
+        startup_timing.enable()
+
+    module_name, function_name = COMMANDS[args.command]
+    module = importlib.import_module(module_name)
+    startup_timing.mark("import")
+    getattr(module, function_name)()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import dataclasses
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional, Union, get_args, get_origin
+
+from dotenv import dotenv_values, find_dotenv
+
+# Recvonly の受信キューが一杯のときの扱い
+DROP_POLICIES = ("drop_oldest", "drop_newest")
+
+# hideface_sender.py で使える顔検出のバックエンド
+FACE_DETECTORS = ("mediapipe_short", "mediapipe_full", "yunet", "haar")
+# hideface_sender.py で顔を隠す方法
+HIDEFACE_MODES = ("logo", "blur", "pixelate")
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+_FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def _env(name: str) -> dict[str, Any]:
+    return {"env": name}
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    サンプルの設定。
+
+    値は次の順に読み込み、後から読み込んだ値で上書きします。
+
+    1. 既定値
+    2. SORA_CONFIG_FILE で指定した TOML もしくは JSON のファイル
+    3. .env ファイル
+    4. 環境変数
+
+    ファイルではフィールド名をキーに、環境変数では各フィールドの env に指定した名前で指定します。
+    ファイルの streams には、名前ごとに上書きする値を書けます。
+    """
+
+    # 接続
+    signaling_urls: list[str] = field(default_factory=list, metadata=_env("SORA_SIGNALING_URLS"))
+    channel_id: Optional[str] = field(default=None, metadata=_env("SORA_CHANNEL_ID"))
+    metadata: Optional[dict[str, Any]] = field(default=None, metadata=_env("SORA_METADATA"))
+    messaging_label: Optional[str] = field(default=None, metadata=_env("SORA_MESSAGING_LABEL"))
+    openh264_path: Optional[str] = field(default=None, metadata=_env("OPENH264_PATH"))
+    use_hwa: bool = field(default=True, metadata=_env("USE_HWA"))
+
+    # 映像
+    video_codec_type: str = field(default="VP9", metadata=_env("SORA_VIDEO_CODEC_TYPE"))
+    video_bit_rate: int = field(default=500, metadata=_env("SORA_VIDEO_BIT_RATE"))
+    # 幅、高さ、カメラ ID はサンプルごとに既定値が違うので、省略時は None にする
+    video_width: Optional[int] = field(default=None, metadata=_env("SORA_VIDEO_WIDTH"))
+    video_height: Optional[int] = field(default=None, metadata=_env("SORA_VIDEO_HEIGHT"))
+    video_fps: int = field(default=30, metadata=_env("SORA_VIDEO_FPS"))
+    video_fourcc: str = field(default="MJPG", metadata=_env("SORA_VIDEO_FOURCC"))
+    camera_id: Optional[int] = field(default=None, metadata=_env("SORA_CAMERA_ID"))
+    video_file: Optional[str] = field(default=None, metadata=_env("SORA_VIDEO_FILE"))
+    video_file_loop: bool = field(default=True, metadata=_env("SORA_VIDEO_FILE_LOOP"))
+    adaptive: bool = field(default=False, metadata=_env("SORA_ADAPTIVE"))
+    static_scene_threshold: Optional[float] = field(
+        default=None, metadata=_env("SORA_STATIC_SCENE_THRESHOLD")
+    )
+    static_scene_keepalive_fps: float = field(
+        default=1.0, metadata=_env("SORA_STATIC_SCENE_KEEPALIVE_FPS")
+    )
+    # 送信側でキャプチャした時刻のバーコードを書き込み、受信側で表示するまでの時間を計測する
+    latency_stamp: bool = field(default=False, metadata=_env("SORA_LATENCY_STAMP"))
+
+    # 音声
+    audio_device_sample_rate: Optional[int] = field(
+        default=None, metadata=_env("SORA_AUDIO_DEVICE_SAMPLE_RATE")
+    )
+    audio_device_channels: Optional[int] = field(
+        default=None, metadata=_env("SORA_AUDIO_DEVICE_CHANNELS")
+    )
+
+    # キューの大きさ、推論の解像度、ワーカー数、溢れたときの扱い
+    video_file_buffer_frames: int = field(
+        default=30, metadata=_env("SORA_VIDEO_FILE_BUFFER_FRAMES")
+    )
+    recv_queue_size: int = field(default=4, metadata=_env("SORA_RECV_QUEUE_SIZE"))
+    recv_video_fps_limit: Optional[float] = field(
+        default=None, metadata=_env("SORA_RECV_VIDEO_FPS_LIMIT")
+    )
+    recv_drop_policy: str = field(default="drop_oldest", metadata=_env("SORA_RECV_DROP_POLICY"))
+    inference_width: int = field(default=0, metadata=_env("SORA_INFERENCE_WIDTH"))
+
+    # 顔を隠す方法と顔検出。顔検出が auto の場合は起動時に計測して選ぶ
+    hideface_mode: str = field(default="logo", metadata=_env("SORA_HIDEFACE_MODE"))
+    face_detector: str = field(default="auto", metadata=_env("SORA_FACE_DETECTOR"))
+    face_detector_min_accuracy: float = field(
+        default=0.8, metadata=_env("SORA_FACE_DETECTOR_MIN_ACCURACY")
+    )
+    face_detector_calibration_frames: int = field(
+        default=10, metadata=_env("SORA_FACE_DETECTOR_CALIBRATION_FRAMES")
+    )
+    yunet_model_path: Optional[str] = field(default=None, metadata=_env("SORA_YUNET_MODEL_PATH"))
+    haar_cascade_path: Optional[str] = field(default=None, metadata=_env("SORA_HAAR_CASCADE_PATH"))
+
+    # hideface_bridge.py で受信するチャンネルと、ストリームごとに処理を待つフレームの数
+    bridge_source_channel_id: Optional[str] = field(
+        default=None, metadata=_env("SORA_BRIDGE_SOURCE_CHANNEL_ID")
+    )
+    bridge_queue_size: int = field(default=2, metadata=_env("SORA_BRIDGE_QUEUE_SIZE"))
+
+    # audio_level.py で無音とみなすピークと、表示する音量の大きいトラックの数
+    level_silence_dbfs: float = field(default=-60.0, metadata=_env("SORA_LEVEL_SILENCE_DBFS"))
+    level_top_count: int = field(default=3, metadata=_env("SORA_LEVEL_TOP_COUNT"))
+
+    # messaging.py でファイルを送受信するデータチャネルと、受け取ったファイルを保存するディレクトリ
+    file_transfer_label: Optional[str] = field(
+        default=None, metadata=_env("SORA_FILE_TRANSFER_LABEL")
+    )
+    file_transfer_dir: Optional[str] = field(default=None, metadata=_env("SORA_FILE_TRANSFER_DIR"))
+    file_transfer_chunk_size: int = field(
+        default=64 * 1024, metadata=_env("SORA_FILE_TRANSFER_CHUNK_SIZE")
+    )
+    file_transfer_window: int = field(default=32, metadata=_env("SORA_FILE_TRANSFER_WINDOW"))
+
+    # 統計情報と計測
+    stats_csv: Optional[str] = field(default=None, metadata=_env("SORA_STATS_CSV"))
+    stats_interval_s: float = field(default=1.0, metadata=_env("SORA_STATS_INTERVAL"))
+    instrumentation: bool = field(default=False, metadata=_env("SORA_INSTRUMENTATION"))
+    instrumentation_port: Optional[int] = field(
+        default=None, metadata=_env("SORA_INSTRUMENTATION_PORT")
+    )
+
+    # load_generator.py
+    load_connections: int = field(default=10, metadata=_env("SORA_LOAD_CONNECTIONS"))
+    load_ramp_up_rate: float = field(default=5.0, metadata=_env("SORA_LOAD_RAMP_UP_RATE"))
+    load_connect_concurrency: int = field(
+        default=32, metadata=_env("SORA_LOAD_CONNECT_CONCURRENCY")
+    )
+    load_duration_s: float = field(default=60.0, metadata=_env("SORA_LOAD_DURATION"))
+    load_report_interval_s: float = field(default=5.0, metadata=_env("SORA_LOAD_REPORT_INTERVAL"))
+    load_video_codec_types: list[str] = field(
+        default_factory=lambda: ["VP9"], metadata=_env("SORA_LOAD_VIDEO_CODEC_TYPES")
+    )
+    load_video_bit_rates: list[int] = field(
+        default_factory=lambda: [500], metadata=_env("SORA_LOAD_VIDEO_BIT_RATES")
+    )
+    load_video_pattern: str = field(default="testcard", metadata=_env("SORA_LOAD_VIDEO_PATTERN"))
+    load_audio_pattern: str = field(default="tone", metadata=_env("SORA_LOAD_AUDIO_PATTERN"))
+
+    # benchmark.py
+    benchmark_scenarios: list[str] = field(
+        default_factory=lambda: [
+            "sendonly",
+            "messaging",
+            "vad",
+            "hideface",
+            "face_detectors",
+            "audio_mixer",
+            "audio_level",
+            "glass_to_glass",
+        ],
+        metadata=_env("SORA_BENCHMARK_SCENARIOS"),
+    )
+    benchmark_duration_s: float = field(default=3.0, metadata=_env("SORA_BENCHMARK_DURATION"))
+    benchmark_output: Optional[str] = field(default=None, metadata=_env("SORA_BENCHMARK_OUTPUT"))
+    benchmark_baseline: Optional[str] = field(
+        default=None, metadata=_env("SORA_BENCHMARK_BASELINE")
+    )
+    benchmark_threshold: float = field(default=0.1, metadata=_env("SORA_BENCHMARK_THRESHOLD"))
+
+    # 名前ごとに上書きする値
+    streams: dict[str, dict[str, Any]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for name in (
+            "video_bit_rate",
+            "video_fps",
+            "video_file_buffer_frames",
+            "recv_queue_size",
+            "load_connections",
+            "load_connect_concurrency",
+            "face_detector_calibration_frames",
+            "bridge_queue_size",
+            "file_transfer_chunk_size",
+            "file_transfer_window",
+            "level_top_count",
+        ):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"{name} には 1 以上を指定してください: {getattr(self, name)}")
+        for name in (
+            "stats_interval_s",
+            "load_ramp_up_rate",
+            "load_report_interval_s",
+            "benchmark_duration_s",
+            "static_scene_keepalive_fps",
+        ):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"{name} には正の値を指定してください: {getattr(self, name)}")
+        if not 0 <= self.benchmark_threshold < 1:
+            raise ValueError("benchmark_threshold には 0 以上 1 未満を指定してください")
+        if self.recv_video_fps_limit is not None and self.recv_video_fps_limit <= 0:
+            raise ValueError("recv_video_fps_limit には正の値を指定してください")
+        if self.static_scene_threshold is not None and self.static_scene_threshold < 0:
+            raise ValueError("static_scene_threshold には 0 以上を指定してください")
+        if self.inference_width < 0:
+            raise ValueError("inference_width には 0 以上を指定してください")
+        if self.recv_drop_policy not in DROP_POLICIES:
+            raise ValueError(
+                f"recv_drop_policy は {DROP_POLICIES} のいずれかを指定してください: "
+                f"{self.recv_drop_policy}"
+            )
+        if self.face_detector not in ("auto",) + FACE_DETECTORS:
+            raise ValueError(
+                f"face_detector は auto か {FACE_DETECTORS} のいずれかを指定してください: "
+                f"{self.face_detector}"
+            )
+        if self.hideface_mode not in HIDEFACE_MODES:
+            raise ValueError(
+                f"hideface_mode は {HIDEFACE_MODES} のいずれかを指定してください: "
+                f"{self.hideface_mode}"
+            )
+        if not 0 <= self.face_detector_min_accuracy <= 1:
+            raise ValueError("face_detector_min_accuracy には 0 以上 1 以下を指定してください")
+        if len(self.video_fourcc) != 4:
+            raise ValueError(f"video_fourcc は 4 文字で指定してください: {self.video_fourcc}")
+        for name in self.streams:
+            self.stream(name)
+
+    def require(self, *names: str) -> None:
+        """
+        指定したフィールドが設定されていることを確認します。
+
+        :param names: 確認するフィールド名
+        :raises ValueError: 設定されていないフィールドがある場合
+        """
+        for name in names:
+            if not getattr(self, name):
+                env_name = _FIELDS[name].metadata["env"]
+                raise ValueError(f"環境変数 {env_name} が設定されていません")
+
+    def override(self, **values: Any) -> "Config":
+        """
+        一部の値を上書きした設定を返します。値は検証されます。
+
+        :param values: フィールド名と値。文字列は環境変数と同じように解釈します
+        """
+        return dataclasses.replace(
+            self, **{name: _parse_value(name, value) for name, value in values.items()}
+        )
+
+    def stream(self, name: str) -> "Config":
+        """
+        streams の name の値で上書きした設定を返します。
+
+        :param name: ストリームの名前
+        :raises KeyError: streams に name がない場合
+        """
+        return self.override(streams={}, **self.streams[name])
+
+
+_FIELDS = {f.name: f for f in dataclasses.fields(Config)}
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in _TRUE_VALUES:
+        return True
+    if value.lower() in _FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def _field_type(name: str) -> Any:
+    # Optional[X] の場合は X を返す
+    field_type = _FIELDS[name].type
+    if get_origin(field_type) is Union:
+        field_type = next(arg for arg in get_args(field_type) if arg is not type(None))
+    return field_type
+
+
+def _parse_value(name: str, value: Any) -> Any:
+    """環境変数やファイルの値をフィールドの型に変換します。"""
+    if name not in _FIELDS:
+        raise ValueError(f"不明な設定です: {name}")
+    if value is None or name == "streams":
+        return value
+
+    field_type = _field_type(name)
+    try:
+        if get_origin(field_type) is list:
+            item_type = get_args(field_type)[0]
+            items = value.split(",") if isinstance(value, str) else value
+            return [item_type(item.strip() if isinstance(item, str) else item) for item in items]
+        if get_origin(field_type) is dict:
+            return json.loads(value) if isinstance(value, str) else dict(value)
+        if field_type is bool:
+            # bool("False") が True になるような取り違えを防ぐため、文字列は明示的に解釈する
+            return value if isinstance(value, bool) else _parse_bool(str(value))
+        if field_type is int:
+            if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                raise ValueError(value)
+            return int(value)
+        if field_type is float:
+            return float(value)
+        return str(value)
+    except (TypeError, ValueError) as e:
+        type_name = getattr(field_type, "__name__", str(field_type))
+        raise ValueError(f"{name} の値を {type_name} として解釈できません: {value!r}") from e
+
+
+def _load_file(path: Path) -> dict[str, Any]:
+    """TOML もしくは JSON の設定ファイルを読み込みます。"""
+    if path.suffix == ".json":
+        return json.loads(path.read_text(encoding="utf-8"))
+    if path.suffix != ".toml":
+        raise ValueError(f"設定ファイルは .toml か .json を指定してください: {path}")
+    try:
+        import tomllib  # type: ignore
+    except ImportError:
+        try:
+            import tomli as tomllib  # type: ignore
+        except ImportError:
+            raise ValueError("Python 3.10 で TOML を読み込むには tomli をインストールしてください")
+    with path.open("rb") as f:
+        return tomllib.load(f)
+
+
+def load_config(
+    config_file: Optional[str] = None,
+    dotenv_path: Optional[str] = None,
+    environ: Optional[dict[str, str]] = None,
+) -> Config:
+    """
+    設定を読み込んで検証します。
+
+    :param config_file: TOML もしくは JSON の設定ファイル。省略した場合は SORA_CONFIG_FILE
+    :param dotenv_path: .env ファイルのパス。省略した場合はカレントディレクトリから親へ探す
+    :param environ: 環境変数。省略した場合は os.environ
+    :raises ValueError: 値を解釈できない場合や、検証に失敗した場合
+    """
+    if environ is None:
+        environ = dict(os.environ)
+    env: dict[str, Optional[str]] = {}
+    if dotenv_path is None:
+        dotenv_path = find_dotenv(usecwd=True)
+    if dotenv_path and Path(dotenv_path).exists():
+        env.update(dotenv_values(dotenv_path))
+    env.update(environ)
+
+    values: dict[str, Any] = {}
+    if config_file := config_file or env.get("SORA_CONFIG_FILE"):
+        for name, value in _load_file(Path(config_file)).items():
+            values[name] = _parse_value(name, value)
+
+    for name, f in _FIELDS.items():
+        if "env" not in f.metadata:
+            continue
+        # 空文字列は指定されていないものとして扱う
+        if raw := env.get(f.metadata["env"]):
+            values[name] = _parse_value(name, raw)
+
+    return Config(**values)
+
+
+_config: Optional[Config] = None
+
+
+def get_config() -> Config:
+    """設定を返します。最初に呼び出したときに 1 度だけ読み込みます。"""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
@@ -0,0 +1,419 @@
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from enum import Enum
+from threading import Event
+from typing import Any, Callable, NamedTuple, Optional
+
+import sora_sdk
+from sora_sdk import Sora, SoraConnection, SoraSignalingErrorCode
+
+import startup_timing
+from instrumentation import get_instrumentation
+from notify_dispatcher import NotifyDispatcher
+from signaling_url_selector import SignalingUrlSelector
+
+
+class ConnectionState(Enum):
+    """ConnectionManager の接続状態。"""
+
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+    CLOSED = "closed"
+
+
+class SinkClasses(NamedTuple):
+    """
+    受信に使うシンクと SoraVAD のクラス。
+
+    FakeSora で接続する場合は、fake_sora.FAKE_SINK_CLASSES を ConnectionManager に渡します。
+    """
+
+    audio_sink: Callable[..., Any]
+    audio_stream_sink: Callable[..., Any]
+    video_sink: Callable[..., Any]
+    vad: Callable[..., Any]
+
+
+# sora_sdk のシンクと SoraVAD
+SDK_SINK_CLASSES = SinkClasses(
+    audio_sink=sora_sdk.SoraAudioSink,
+    audio_stream_sink=sora_sdk.SoraAudioStreamSink,
+    video_sink=sora_sdk.SoraVideoSink,
+    vad=sora_sdk.SoraVAD,
+)
+
+
+def backoff_delay(attempt: int, initial_s: float, max_s: float) -> float:
+    """
+    ジッター付きの指数バックオフの待機時間を返します。
+
+    同時に切断された多数のクライアントが同じタイミングで再接続しないように、
+    0 から上限までの一様乱数 (Full Jitter) を利用します。
+
+    :param attempt: 0 始まりの再試行回数
+    :param initial_s: 初回の待機時間の上限（秒）
+    :param max_s: 待機時間の上限（秒）
+    :return: 待機時間（秒）
+    """
+    return random.uniform(0, min(max_s, initial_s * (2**attempt)))
+
+
+class ConnectionManager(ABC):
+    """
+    Sora への接続のライフサイクルを管理する基底クラス。
+
+    offer / notify / switched / disconnect の処理を共通化し、
+    タイムアウト付きの接続と、切断時のジッター付き指数バックオフでの再接続を提供します。
+
+    再接続のたびに SoraConnection は作り直しますが、サブクラスが保持している
+    SoraVideoSource や SoraAudioSource、カメラなどのキャプチャはそのまま使い回すため、
+    再接続でキャプチャを初期化し直す必要はありません。
+
+    サブクラスは _create_connection() で create_connection() の呼び出しと
+    on_track などの固有のコールバックの設定を行います。
+    """
+
+    def __init__(
+        self,
+        sora: Sora,
+        signaling_urls: list[str],
+        connection_timeout_s: float = 10.0,
+        reconnect: bool = False,
+        max_reconnect_attempts: int = 10,
+        reconnect_backoff_initial_s: float = 0.5,
+        reconnect_backoff_max_s: float = 30.0,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        url_connection_timeout_s: Optional[float] = None,
+        sink_classes: Optional[SinkClasses] = None,
+    ):
+        """
+        ConnectionManager インスタンスを初期化します。
+
+        :param sora: 接続の作成に利用する Sora インスタンス
+        :param signaling_urls: Sora シグナリング URL のリスト
+        :param connection_timeout_s: 1 回の接続試行のタイムアウト（秒）
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param max_reconnect_attempts: 再接続を諦めるまでの試行回数
+        :param reconnect_backoff_initial_s: 再接続の初回の待機時間の上限（秒）
+        :param reconnect_backoff_max_s: 再接続の待機時間の上限（秒）
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param url_connection_timeout_s: url_selector がある場合に、1 つの URL に接続を試す
+            タイムアウト（秒）。省略した場合は connection_timeout_s を URL の数で割った時間
+        :param sink_classes: 受信に使うシンクと SoraVAD のクラス。省略した場合は sora_sdk のクラス
+        """
+        self._sora: Sora = sora
+        self._sink_classes: SinkClasses = sink_classes or SDK_SINK_CLASSES
+        self._signaling_urls: list[str] = signaling_urls
+
+        self._connection: Optional[SoraConnection] = None
+        self._connection_id: Optional[str] = None
+        # 古い接続から遅れて届いたコールバックを無視するための世代番号
+        self._generation: int = 0
+
+        self._connected: Event = Event()
+        self._switched: bool = False
+        self._closed: Event = Event()
+        self._default_connection_timeout_s: float = connection_timeout_s
+
+        self._reconnect: bool = reconnect
+        self._max_reconnect_attempts: int = max_reconnect_attempts
+        self._reconnect_backoff_initial_s: float = reconnect_backoff_initial_s
+        self._reconnect_backoff_max_s: float = reconnect_backoff_max_s
+        self._reconnect_thread: Optional[threading.Thread] = None
+        self._url_selector: Optional[SignalingUrlSelector] = url_selector
+        self._url_connection_timeout_s: Optional[float] = url_connection_timeout_s
+
+        # 接続試行の結果 (connection.created か切断) が出たら set する
+        self._attempt_finished: Event = Event()
+        # 直前の接続試行が、接続完了も切断もないままタイムアウトしたかどうか
+        self._attempt_timed_out: bool = False
+        # disconnect() が呼ばれたら set する
+        self._disconnect_requested: Event = Event()
+
+        self._state: ConnectionState = ConnectionState.CLOSED
+        self._state_lock = threading.Lock()
+
+        # 計測が無効な場合は何もしない計測になる
+        self._instrumentation = get_instrumentation()
+
+        # notify は購読している event_type だけをパースしてハンドラーに振り分ける
+        self._notify_dispatcher = NotifyDispatcher()
+        self._notify_dispatcher.on("connection.created", self._on_connection_created)
+
+        # 接続状態が変わったときに呼ばれるコールバック
+        self.on_state_change: Optional[Callable[[ConnectionState], None]] = None
+
+    @abstractmethod
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        """
+        SoraConnection を作成します。サブクラスで実装してください。
+
+        on_set_offer / on_switched / on_notify / on_disconnect は基底クラスで設定するため、
+        それ以外に必要なコールバック（on_track など）をここで設定します。
+
+        :param signaling_urls: この接続試行で利用するシグナリング URL のリスト
+        :return: 作成した SoraConnection
+        """
+
+    def _on_close(self) -> None:
+        """接続が完全に閉じられたときに 1 度だけ呼ばれます。必要に応じてサブクラスで実装します。"""
+
+    def connect(self) -> None:
+        """
+        Sora への接続を確立します。
+
+        再接続が有効な場合は、接続に失敗してもバックオフしながら再試行します。
+
+        :raises AssertionError: タイムアウト期間内に接続が確立できなかった場合
+        """
+        self._disconnect_requested.clear()
+        self._closed.clear()
+        self._set_state(ConnectionState.CONNECTING)
+
+        attempts = self._max_reconnect_attempts if self._reconnect else 1
+        for attempt in range(attempts):
+            if attempt > 0:
+                delay = backoff_delay(
+                    attempt - 1, self._reconnect_backoff_initial_s, self._reconnect_backoff_max_s
+                )
+                if self._disconnect_requested.wait(delay):
+                    break
+            if self._connect_once(attempt):
+                return
+
+        self._close()
+        raise AssertionError("Could not connect to Sora.")
+
+    def disconnect(self) -> None:
+        """Sora から切断します。"""
+        self._disconnect_requested.set()
+        # 接続試行中であれば待機を打ち切る
+        self._attempt_finished.set()
+        if self._connection is not None and self._connected.is_set():
+            self._connection.disconnect()
+        else:
+            # 再接続の待機中などは on_disconnect が呼ばれないので、ここで閉じる
+            self._close()
+
+    def get_stats(self):
+        if (raw_stats := self.get_raw_stats()) is None:
+            return []
+        return json.loads(raw_stats)
+
+    def get_raw_stats(self) -> Optional[str]:
+        """パースしていない統計情報の JSON 文字列を返します。未接続の場合は None を返します。"""
+        if self._connection is None or not self._connected.is_set():
+            return None
+        return self._connection.get_stats()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    @property
+    def switched(self) -> bool:
+        """データチャネルシグナリングへの切り替えが完了しているかどうかを示すブール値。"""
+        return self._switched
+
+    @property
+    def closed(self) -> bool:
+        """接続が閉じられているかどうかを示すブール値。"""
+        return self._closed.is_set()
+
+    @property
+    def notify_dispatcher(self) -> NotifyDispatcher:
+        """notify を event_type ごとに受け取るハンドラーを登録するためのディスパッチャー。"""
+        return self._notify_dispatcher
+
+    @property
+    def state(self) -> ConnectionState:
+        """現在の接続状態。"""
+        return self._state
+
+    def _set_state(self, state: ConnectionState) -> None:
+        with self._state_lock:
+            if self._state == state:
+                return
+            self._state = state
+        if self.on_state_change is not None:
+            self.on_state_change(state)
+
+    def _close(self) -> None:
+        with self._state_lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+        self._connected.clear()
+        self._set_state(ConnectionState.CLOSED)
+        self._on_close()
+
+    def _connect_once(self, attempt: int) -> bool:
+        """
+        接続を 1 回試行します。
+
+        URL セレクターがない場合は、すべてのシグナリング URL を SDK に渡して 1 度に接続します。
+        SDK はどの URL に接続したかを返さないので、URL セレクターがある場合は
+        スコアの良い順に URL を 1 つずつ短いタイムアウトで試し、URL ごとの接続時間を記録します。
+        タイムアウトした URL は失敗として記録し、認証の失敗などによる切断は記録せずに
+        次の URL を試します。
+
+        :param attempt: 0 始まりの試行回数。シグナリング URL の先頭をずらすのに利用します
+        :return: 接続できた場合は True
+        """
+        if self._url_selector is None:
+            # 試行ごとに先頭の URL をずらして、落ちている URL に偏らないようにする
+            offset = attempt % len(self._signaling_urls)
+            return self._try_connect(
+                self._signaling_urls[offset:] + self._signaling_urls[:offset],
+                self._default_connection_timeout_s,
+            )
+
+        signaling_urls = self._url_selector.ordered()
+        url_timeout_s = self._url_connection_timeout_s or (
+            self._default_connection_timeout_s / len(signaling_urls)
+        )
+        # すべての URL を試しても 1 回の試行は connection_timeout_s に収める
+        deadline = time.monotonic() + self._default_connection_timeout_s
+        for index, url in enumerate(signaling_urls):
+            remaining_s = deadline - time.monotonic()
+            if remaining_s <= 0 or self._disconnect_requested.is_set():
+                break
+            # 最後の URL には残りの時間をすべて使う
+            if index < len(signaling_urls) - 1:
+                remaining_s = min(url_timeout_s, remaining_s)
+            started_at = time.perf_counter()
+            if self._try_connect([url], remaining_s):
+                self._url_selector.record_success(url, time.perf_counter() - started_at)
+                return True
+            if self._attempt_timed_out and not self._disconnect_requested.is_set():
+                self._url_selector.record_failure(url)
+        return False
+
+    def _try_connect(self, signaling_urls: list[str], timeout_s: float) -> bool:
+        """
+        指定したシグナリング URL で接続を試行し、接続完了かタイムアウトまで待ちます。
+
+        :param signaling_urls: この接続試行で利用するシグナリング URL のリスト
+        :param timeout_s: 接続完了を待つ時間（秒）
+        :return: 接続できた場合は True
+        """
+        self._generation += 1
+        generation = self._generation
+        self._connection_id = None
+        self._switched = False
+        self._attempt_finished.clear()
+
+        connection = self._create_connection(signaling_urls)
+        connection.on_set_offer = self._on_set_offer
+        connection.on_switched = self._on_switched
+        connection.on_notify = self._on_notify
+        connection.on_disconnect = lambda error_code, message: self._handle_disconnect(
+            generation, error_code, message
+        )
+        self._connection = connection
+        connection.connect()
+
+        self._attempt_timed_out = not self._attempt_finished.wait(timeout_s)
+        if self._connected.is_set() and not self._disconnect_requested.is_set():
+            self._set_state(ConnectionState.CONNECTED)
+            return True
+
+        # タイムアウトか切断。この接続からのコールバックは以降無視する
+        self._generation += 1
+        self._connected.clear()
+        connection.disconnect()
+        return False
+
+    def _reconnect_loop(self) -> None:
+        """バックオフしながら再接続を試みます。"""
+        for attempt in range(self._max_reconnect_attempts):
+            delay = backoff_delay(
+                attempt, self._reconnect_backoff_initial_s, self._reconnect_backoff_max_s
+            )
+            print(f"Reconnecting to Sora in {delay:.2f}s: attempt={attempt + 1}")
+            if self._disconnect_requested.wait(delay):
+                break
+            if self._connect_once(attempt + 1):
+                return
+        self._close()
+
+    def _handle_disconnect(
+        self, generation: int, error_code: SoraSignalingErrorCode, message: str
+    ) -> None:
+        if generation != self._generation:
+            return
+        self._on_disconnect(error_code, message)
+
+    def _on_set_offer(self, raw_message: str) -> None:
+        """
+        オファー設定イベントを処理します。
+
+        :param raw_message: オファーを含む生のメッセージ
+        """
+        message: dict[str, Any] = json.loads(raw_message)
+        if message["type"] == "offer":
+            # "type": "offer" に入ってくる自分の connection_id を保存する
+            self._connection_id = message["connection_id"]
+
+    def _on_switched(self, raw_message: str) -> None:
+        """
+        スイッチイベントを処理します。
+
+        :param raw_message: 生のスイッチメッセージ
+        """
+        message: dict[str, Any] = json.loads(raw_message)
+        if message["type"] == "switched":
+            print(f"Switched to DataChannel Signaling: connection_id={self._connection_id}")
+            self._switched = True
+
+    def _on_notify(self, raw_message: str) -> None:
+        """
+        Sora からの通知イベントを処理します。
+
+        :param raw_message: 生の通知メッセージ
+        """
+        self._notify_dispatcher.dispatch(raw_message)
+
+    def _on_connection_created(self, message: dict[str, Any]) -> None:
+        """
+        connection.created の通知を処理します。
+
+        :param message: パース済みの通知メッセージ
+        """
+        # "type": "notify" の "connection.created" で通知される connection_id が
+        # 自分の connection_id と一致する場合に接続完了とする
+        if message["connection_id"] == self._connection_id:
+            print(f"Connected Sora: connection_id={self._connection_id}")
+            startup_timing.mark("connected")
+            self._connected.set()
+            self._attempt_finished.set()
+
+    def _on_disconnect(self, error_code: SoraSignalingErrorCode, message: str) -> None:
+        """
+        切断イベントを処理します。
+
+        意図しない切断で再接続が有効な場合は、別スレッドで再接続を開始します。
+
+        :param error_code: 切断のエラーコード
+        :param message: 切断メッセージ
+        """
+        print(f"Disconnected Sora: error_code='{error_code}' message='{message}'")
+        was_connected = self._connected.is_set()
+        self._connected.clear()
+        self._attempt_finished.set()
+
+        if not was_connected:
+            # 接続試行中の失敗は _connect_once() 側で扱う
+            return
+
+        if self._reconnect and not self._disconnect_requested.is_set():
+            self._set_state(ConnectionState.RECONNECTING)
+            # SDK のコールバックスレッドをブロックしないように別スレッドで再接続する
+            self._reconnect_thread = threading.Thread(target=self._reconnect_loop, daemon=True)
+            self._reconnect_thread.start()
+        else:
+            self._close()
@@ -0,0 +1,74 @@
+from typing import Optional
+
+import cv2  # type: ignore
+import numpy as np
+
+from config import HIDEFACE_MODES
+
+
+class FaceAnonymizer:
+    """
+    フレームの顔の領域だけを、その場でぼかすかモザイクにするクラス。
+
+    顔の領域は ndarray のビューとして扱い、フレーム全体の変換やコピーは行いません。
+    作業用のバッファはフレームと同じ大きさで 1 度だけ確保して使い回すので、
+    処理は顔の面積に比例し、顔がなければほとんど何もしません。
+    """
+
+    def __init__(self, mode: str, pixelate_blocks: int = 10, blur_divisor: int = 3):
+        """
+        FaceAnonymizer インスタンスを初期化します。
+
+        :param mode: "blur" か "pixelate"
+        :param pixelate_blocks: モザイクにするときの顔の幅あたりのブロック数
+        :param blur_divisor: ぼかすときの顔の大きさに対するカーネルの大きさの割合の逆数
+        :raises ValueError: mode が不正な場合
+        """
+        if mode not in HIDEFACE_MODES or mode == "logo":
+            raise ValueError(f"mode は blur か pixelate を指定してください: {mode}")
+        self._pixelate: bool = mode == "pixelate"
+        self._pixelate_blocks: int = pixelate_blocks
+        self._blur_divisor: int = blur_divisor
+        self._scratch: Optional[np.ndarray] = None
+
+    def apply(self, frame: np.ndarray, boxes: list[tuple[int, int, int, int]]) -> None:
+        """
+        フレームの指定した領域をその場でぼかすかモザイクにします。
+
+        :param frame: (高さ, 幅, 3) のフレーム。書き換えます
+        :param boxes: ピクセル単位の (x, y, 幅, 高さ) の領域。フレームからはみ出した部分は無視します
+        """
+        if not boxes:
+            return
+        if self._scratch is None or self._scratch.shape != frame.shape:
+            self._scratch = np.empty_like(frame)
+        frame_height, frame_width = frame.shape[:2]
+        for x, y, width, height in boxes:
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(frame_width, x + width), min(frame_height, y + height)
+            if x1 - x0 < 2 or y1 - y0 < 2:
+                continue
+            roi = frame[y0:y1, x0:x1]
+            # ブロックやカーネルの大きさは、はみ出した部分も含めた顔の大きさで決める
+            if self._pixelate:
+                self._pixelate_roi(roi, max(1, width // self._pixelate_blocks))
+            else:
+                self._blur_roi(roi, max(3, min(width, height) // self._blur_divisor))
+
+    def _pixelate_roi(self, roi: np.ndarray, block: int) -> None:
+        assert self._scratch is not None
+        height, width = roi.shape[:2]
+        # 縮小してから最近傍で拡大し直すと、ブロックごとの平均色になる
+        small_width = -(-width // block)
+        small_height = -(-height // block)
+        small = self._scratch[:small_height, :small_width]
+        cv2.resize(roi, (small_width, small_height), dst=small, interpolation=cv2.INTER_AREA)
+        cv2.resize(small, (width, height), dst=roi, interpolation=cv2.INTER_NEAREST)
+
+    def _blur_roi(self, roi: np.ndarray, kernel: int) -> None:
+        assert self._scratch is not None
+        height, width = roi.shape[:2]
+        # ボックスフィルターはカーネルの大きさによらず面積に比例した時間で処理できる
+        blurred = self._scratch[:height, :width]
+        cv2.blur(roi, (kernel, kernel), dst=blurred)
+        np.copyto(roi, blurred)
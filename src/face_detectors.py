@@ -0,0 +1,326 @@
+import os
+import statistics
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, NamedTuple, Optional
+
+import cv2  # type: ignore
+import numpy as np
+
+from config import FACE_DETECTORS
+
+
+class FaceBox(NamedTuple):
+    """画像の幅と高さで正規化した顔の領域。"""
+
+    xmin: float
+    ymin: float
+    width: float
+    height: float
+
+
+def box_iou(a: FaceBox, b: FaceBox) -> float:
+    """2 つの領域の IoU (Intersection over Union) を返します。"""
+    width = min(a.xmin + a.width, b.xmin + b.width) - max(a.xmin, b.xmin)
+    height = min(a.ymin + a.height, b.ymin + b.height) - max(a.ymin, b.ymin)
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (a.width * a.height + b.width * b.height - intersection)
+
+
+class FaceDetector(ABC):
+    """
+    顔検出のバックエンドの基底クラス。
+
+    detect() は RGB の画像を受け取り、検出した顔の正規化した領域を返します。
+    with 文で使うと、抜けるときに close() を呼びます。
+    """
+
+    name: str = ""
+    # 精度のおおよその目安。バックエンドの順位付けと、比較の基準が顔を検出できなかった場合に使う
+    nominal_accuracy: float = 0.0
+
+    @abstractmethod
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        """
+        顔を検出します。
+
+        :param frame: (高さ, 幅, 3) の RGB の画像
+        :return: 検出した顔の領域
+        """
+
+    def close(self) -> None:
+        """モデルなどのリソースを解放します。"""
+
+    def __enter__(self) -> "FaceDetector":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class MediaPipeFaceDetector(FaceDetector):
+    """
+    MediaPipe の FaceDetection を使うバックエンド。
+
+    model_selection が 0 の場合はカメラから 2 m 以内向けの short range、
+    1 の場合は 5 m 以内向けの full range のモデルを使います。
+    """
+
+    def __init__(self, model_selection: int = 0, min_detection_confidence: float = 0.5):
+        # MediaPipe は import に時間がかかるので、使うときに読み込む
+        import mediapipe as mp  # type: ignore
+
+        self.name = ("mediapipe_short", "mediapipe_full")[model_selection]
+        self.nominal_accuracy = (0.85, 0.9)[model_selection]
+        self._face_detection = mp.solutions.face_detection.FaceDetection(  # type: ignore
+            model_selection=model_selection, min_detection_confidence=min_detection_confidence
+        )
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        results = self._face_detection.process(frame)
+        boxes = []
+        for detection in results.detections or ():
+            location = detection.location_data
+            if not location.HasField("relative_bounding_box"):
+                continue
+            bb = location.relative_bounding_box
+            boxes.append(FaceBox(bb.xmin, bb.ymin, bb.width, bb.height))
+        return boxes
+
+    def close(self) -> None:
+        self._face_detection.close()
+
+
+class YuNetFaceDetector(FaceDetector):
+    """
+    OpenCV の DNN を使う YuNet (cv2.FaceDetectorYN) のバックエンド。
+
+    モデルは OpenCV Zoo の face_detection_yunet_2023mar.onnx などを指定します。
+    """
+
+    name = "yunet"
+    nominal_accuracy = 0.9
+
+    def __init__(self, model_path: Optional[str], score_threshold: float = 0.6):
+        """
+        YuNetFaceDetector インスタンスを初期化します。
+
+        :param model_path: YuNet の ONNX モデルのパス
+        :param score_threshold: 顔とみなすスコアの下限
+        :raises ValueError: model_path が指定されていない場合
+        """
+        if not model_path:
+            raise ValueError("YuNet を使うには SORA_YUNET_MODEL_PATH でモデルを指定してください")
+        self._input_size: tuple[int, int] = (320, 320)
+        self._detector = cv2.FaceDetectorYN.create(
+            model_path, "", self._input_size, score_threshold
+        )
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        height, width = frame.shape[:2]
+        if (width, height) != self._input_size:
+            self._input_size = (width, height)
+            self._detector.setInputSize(self._input_size)
+        _, faces = self._detector.detect(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        if faces is None:
+            return []
+        return [
+            FaceBox(x / width, y / height, w / width, h / height)
+            for x, y, w, h in faces[:, :4].tolist()
+        ]
+
+
+class HaarFaceDetector(FaceDetector):
+    """
+    OpenCV の Haar cascade を使うバックエンド。
+
+    精度は低いものの追加のモデルが不要で、他のバックエンドが使えない場合の代わりになります。
+    """
+
+    name = "haar"
+    nominal_accuracy = 0.6
+
+    def __init__(self, cascade_path: Optional[str] = None, min_neighbors: int = 5):
+        """
+        HaarFaceDetector インスタンスを初期化します。
+
+        :param cascade_path: cascade の XML のパス。省略した場合は OpenCV に同梱されたもの
+        :param min_neighbors: 顔とみなすために必要な近傍の検出数
+        :raises ValueError: cascade を読み込めない場合
+        """
+        # OpenCV 5 では Haar cascade が本体から外れている
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise ValueError(f"OpenCV {cv2.__version__} には CascadeClassifier がありません")
+        if cascade_path is None:
+            cascade_path = os.path.join(
+                cv2.data.haarcascades, "haarcascade_frontalface_default.xml"
+            )
+        self._classifier = cv2.CascadeClassifier(cascade_path)
+        if self._classifier.empty():
+            raise ValueError(f"Haar cascade を読み込めません: {cascade_path}")
+        self._min_neighbors: int = min_neighbors
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        height, width = gray.shape
+        min_size = max(16, min(width, height) // 20)
+        faces = self._classifier.detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=self._min_neighbors, minSize=(min_size, min_size)
+        )
+        return [
+            FaceBox(x / width, y / height, w / width, h / height)
+            for x, y, w, h in np.asarray(faces).reshape(-1, 4).tolist()
+        ]
+
+
+def create_face_detector(
+    name: str,
+    yunet_model_path: Optional[str] = None,
+    haar_cascade_path: Optional[str] = None,
+) -> FaceDetector:
+    """
+    名前を指定して顔検出のバックエンドを作成します。
+
+    :param name: FACE_DETECTORS のいずれか
+    :param yunet_model_path: YuNet の ONNX モデルのパス
+    :param haar_cascade_path: Haar cascade の XML のパス
+    :raises ValueError: 不明な名前の場合や、バックエンドの準備に失敗した場合
+    """
+    if name == "mediapipe_short":
+        return MediaPipeFaceDetector(model_selection=0)
+    if name == "mediapipe_full":
+        return MediaPipeFaceDetector(model_selection=1)
+    if name == "yunet":
+        return YuNetFaceDetector(yunet_model_path)
+    if name == "haar":
+        return HaarFaceDetector(haar_cascade_path)
+    raise ValueError(f"顔検出は {FACE_DETECTORS} のいずれかを指定してください: {name}")
+
+
+def create_available_face_detectors(
+    names: tuple[str, ...] = FACE_DETECTORS, **options: Any
+) -> list[FaceDetector]:
+    """
+    指定したバックエンドのうち、この環境で使えるものを作成します。
+
+    ライブラリやモデルがないバックエンドは理由を表示して飛ばします。
+
+    :param names: 作成するバックエンドの名前
+    :param options: create_face_detector() に渡す引数
+    """
+    detectors = []
+    for name in names:
+        try:
+            detectors.append(create_face_detector(name, **options))
+        except (ImportError, ValueError, cv2.error) as e:
+            print(f"Face detector {name} is unavailable: {e}")
+    return detectors
+
+
+@dataclass
+class CalibrationResult:
+    """キャリブレーションで計測したバックエンドごとの結果。"""
+
+    name: str
+    # 1 フレームあたりの検出時間の中央値（秒）
+    detect_time_s: float
+    # 基準のバックエンドとの一致度から求めた精度。基準と比べられない場合は nominal_accuracy
+    accuracy: float
+
+
+def _f1_score(
+    detections: list[list[FaceBox]], references: list[list[FaceBox]], iou_threshold: float
+) -> float:
+    # フレームごとに IoU が大きい順に基準の領域と対応づけ、F 値を求める
+    matched = detected = expected = 0
+    for boxes, reference_boxes in zip(detections, references):
+        detected += len(boxes)
+        expected += len(reference_boxes)
+        pairs = sorted(
+            (
+                (box_iou(box, reference), i, j)
+                for i, box in enumerate(boxes)
+                for j, reference in enumerate(reference_boxes)
+            ),
+            reverse=True,
+        )
+        used_boxes: set[int] = set()
+        used_references: set[int] = set()
+        for iou, i, j in pairs:
+            if iou < iou_threshold:
+                break
+            if i in used_boxes or j in used_references:
+                continue
+            used_boxes.add(i)
+            used_references.add(j)
+            matched += 1
+    if detected + expected == 0:
+        return 1.0
+    return 2 * matched / (detected + expected)
+
+
+def calibrate_face_detectors(
+    detectors: list[FaceDetector],
+    frames: list[np.ndarray],
+    min_accuracy: float,
+    iou_threshold: float = 0.5,
+) -> tuple[FaceDetector, list[CalibrationResult]]:
+    """
+    サンプルのフレームで各バックエンドの検出時間と精度を計測し、使うバックエンドを選びます。
+
+    精度は、nominal_accuracy が最も高いバックエンドを基準にした検出結果の F 値に、
+    基準の nominal_accuracy を掛けたものです。基準が顔を 1 つも検出しなかった場合は
+    比べられないので、各バックエンドの nominal_accuracy を使います。
+    精度が min_accuracy 以上のうち最も速いバックエンドを選び、
+    1 つもない場合は最も精度の高いバックエンドを選びます。選ばなかったバックエンドは閉じます。
+
+    :param detectors: 候補のバックエンド
+    :param frames: (高さ, 幅, 3) の RGB のサンプルのフレーム
+    :param min_accuracy: 精度の下限
+    :param iou_threshold: 基準と同じ顔とみなす IoU の下限
+    :return: 選んだバックエンドと、バックエンドごとの結果
+    :raises ValueError: バックエンドやフレームがない場合
+    """
+    if not detectors:
+        raise ValueError("利用できる顔検出のバックエンドがありません")
+    if not frames:
+        raise ValueError("キャリブレーションに使うフレームがありません")
+
+    detections: dict[str, list[list[FaceBox]]] = {}
+    detect_times: dict[str, float] = {}
+    for detector in detectors:
+        # 初回はモデルの初期化などで遅いので計測しない
+        detector.detect(frames[0])
+        durations = []
+        boxes = []
+        for frame in frames:
+            started_at = time.perf_counter()
+            boxes.append(detector.detect(frame))
+            durations.append(time.perf_counter() - started_at)
+        detections[detector.name] = boxes
+        detect_times[detector.name] = statistics.median(durations)
+
+    reference = max(detectors, key=lambda detector: detector.nominal_accuracy)
+    reference_detections = detections[reference.name]
+    comparable = any(reference_detections)
+    results = []
+    for detector in detectors:
+        accuracy = detector.nominal_accuracy
+        if comparable and detector is not reference:
+            f1 = _f1_score(detections[detector.name], reference_detections, iou_threshold)
+            accuracy = f1 * reference.nominal_accuracy
+        results.append(CalibrationResult(detector.name, detect_times[detector.name], accuracy))
+
+    candidates = [result for result in results if result.accuracy >= min_accuracy]
+    if candidates:
+        chosen = min(candidates, key=lambda result: result.detect_time_s)
+    else:
+        chosen = max(results, key=lambda result: result.accuracy)
+    selected = next(detector for detector in detectors if detector.name == chosen.name)
+    for detector in detectors:
+        if detector is not selected:
+            detector.close()
+    return selected, results
@@ -0,0 +1,508 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from audio_converter import AudioConverter
+from connection_manager import SinkClasses
+
+
+class FakeSoraServer:
+    """
+    FakeSora の接続をチャンネルごとにまとめる、プロセス内の Sora の代わり。
+
+    同じサーバーの同じチャンネルに接続した FakeConnection 同士で、
+    notify、トラック、メディア、データチャネルのメッセージをやりとりします。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels: dict[str, list["FakeConnection"]] = {}
+
+    def join(self, connection: "FakeConnection") -> list["FakeConnection"]:
+        """接続をチャンネルに加え、すでにいた接続を返します。"""
+        with self._lock:
+            members = self._channels.setdefault(connection._channel_id, [])
+            peers = list(members)
+            members.append(connection)
+        return peers
+
+    def leave(self, connection: "FakeConnection") -> list["FakeConnection"]:
+        """接続をチャンネルから外し、残った接続を返します。"""
+        with self._lock:
+            members = self._channels.get(connection._channel_id, [])
+            if connection in members:
+                members.remove(connection)
+            return list(members)
+
+    def members(self, channel_id: str) -> list["FakeConnection"]:
+        """チャンネルに接続している接続を返します。"""
+        with self._lock:
+            return list(self._channels.get(channel_id, []))
+
+
+# 特に指定しない場合に FakeSora が共有するサーバー
+default_server = FakeSoraServer()
+
+
+class FakeMediaTrack:
+    """SoraMediaTrack の代わり。送信側のソースから受信側のシンクにメディアを渡します。"""
+
+    def __init__(self, kind: str, stream_id: str, source: "FakeVideoSource | FakeAudioSource"):
+        self.kind: str = kind
+        self.id: str = str(uuid.uuid4())
+        self.stream_id: str = stream_id
+        self.state: str = "live"
+        self._source = source
+
+    def end(self) -> None:
+        self.state = "ended"
+        self._source.remove_track(self)
+
+
+class FakeVideoFrame:
+    """SoraVideoFrame の代わり。"""
+
+    def __init__(self, data: np.ndarray):
+        self._data = data
+
+    def data(self) -> np.ndarray:
+        return self._data
+
+
+class FakeAudioFrame:
+    """SoraAudioFrame の代わり。"""
+
+    def __init__(self, data: np.ndarray, sample_rate_hz: int, timestamp_ms: Optional[int]):
+        self._data = data
+        self.samples_per_channel: int = data.shape[0]
+        self.num_channels: int = data.shape[1]
+        self.sample_rate_hz: int = sample_rate_hz
+        self.absolute_capture_timestamp_ms: Optional[int] = timestamp_ms
+
+    def data(self) -> np.ndarray:
+        return self._data
+
+
+class FakeVideoSource:
+    """
+    SoraVideoSource の代わり。
+
+    on_captured() に渡されたフレームをコピーして、購読しているシンクに渡します。
+    実際の SDK と同じく、呼び出し元は戻ってきた後にバッファを使い回せます。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sinks: tuple["FakeVideoSink", ...] = ()
+        self.frames_captured: int = 0
+        self.bytes_captured: int = 0
+
+    def on_captured(self, frame: np.ndarray, timestamp: Any = None) -> None:
+        self.frames_captured += 1
+        self.bytes_captured += frame.nbytes
+        if not (sinks := self._sinks):
+            return
+        video_frame = FakeVideoFrame(frame.copy())
+        for sink in sinks:
+            sink.deliver(video_frame)
+
+    def add_sink(self, sink: "FakeVideoSink") -> None:
+        with self._lock:
+            self._sinks += (sink,)
+
+    def remove_track(self, track: FakeMediaTrack) -> None:
+        with self._lock:
+            self._sinks = tuple(sink for sink in self._sinks if sink.track is not track)
+
+
+class FakeAudioSource:
+    """SoraAudioSource の代わり。on_data() に渡された音声を購読しているシンクに渡します。"""
+
+    def __init__(self, channels: int, sample_rate: int):
+        self.channels: int = channels
+        self.sample_rate: int = sample_rate
+        self._lock = threading.Lock()
+        self._sinks: tuple["FakeAudioSink | FakeAudioStreamSink", ...] = ()
+        self.samples_captured: int = 0
+
+    def on_data(self, data: np.ndarray, timestamp: Any = None) -> None:
+        self.samples_captured += len(data)
+        timestamp_ms = int(timestamp * 1000) if isinstance(timestamp, float) else None
+        for sink in self._sinks:
+            sink.deliver(data, self.sample_rate, timestamp_ms)
+
+    def add_sink(self, sink: "FakeAudioSink | FakeAudioStreamSink") -> None:
+        with self._lock:
+            self._sinks += (sink,)
+
+    def remove_track(self, track: FakeMediaTrack) -> None:
+        with self._lock:
+            self._sinks = tuple(sink for sink in self._sinks if sink.track is not track)
+
+
+class FakeVideoSink:
+    """SoraVideoSink の代わり。on_frame は送信側の on_captured() を呼んだスレッドで呼ばれます。"""
+
+    def __init__(self, track: FakeMediaTrack):
+        self.track = track
+        self.on_frame: Optional[Callable[[FakeVideoFrame], None]] = None
+        track._source.add_sink(self)  # type: ignore[arg-type]
+
+    def deliver(self, frame: FakeVideoFrame) -> None:
+        if (on_frame := self.on_frame) is not None:
+            on_frame(frame)
+
+
+class _AudioSinkBase:
+    def __init__(self, track: FakeMediaTrack, output_frequency: int, output_channels: int):
+        self.track = track
+        self._output_frequency: int = output_frequency
+        self._output_channels: int = output_channels
+        self._converter: Optional[AudioConverter] = None
+        source = track._source
+        assert isinstance(source, FakeAudioSource)
+        if (source.sample_rate, source.channels) != (output_frequency, output_channels):
+            self._converter = AudioConverter(
+                source.sample_rate, source.channels, output_frequency, output_channels
+            )
+        source.add_sink(self)  # type: ignore[arg-type]
+
+    def _convert(self, data: np.ndarray) -> np.ndarray:
+        if self._converter is None:
+            return data
+        return self._converter.convert(data)
+
+
+class FakeAudioSink(_AudioSinkBase):
+    """SoraAudioSink の代わり。受け取った音声を貯めて read() で返します。"""
+
+    def __init__(self, track: FakeMediaTrack, output_frequency: int, output_channels: int):
+        super().__init__(track, output_frequency, output_channels)
+        self._condition = threading.Condition()
+        self._chunks: deque[np.ndarray] = deque()
+        self._buffered: int = 0
+
+    def deliver(self, data: np.ndarray, sample_rate: int, timestamp_ms: Optional[int]) -> None:
+        converted = self._convert(data).copy()
+        with self._condition:
+            self._chunks.append(converted)
+            self._buffered += len(converted)
+            self._condition.notify_all()
+
+    def read(self, frames: int = 0, timeout: float = 1) -> tuple[bool, Optional[np.ndarray]]:
+        """
+        音声を frames サンプル読み出します。
+
+        :param frames: 読み出すサンプル数。0 の場合は貯まっているすべて
+        :param timeout: 貯まるまで待つ時間（秒）
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._buffered >= max(frames, 1), timeout=timeout
+            ):
+                return False, None
+            data = np.concatenate(self._chunks)
+            frames = frames or len(data)
+            self._chunks.clear()
+            if frames < len(data):
+                self._chunks.append(data[frames:])
+            self._buffered = len(data) - frames
+            return True, data[:frames]
+
+
+class FakeAudioStreamSink(_AudioSinkBase):
+    """SoraAudioStreamSink の代わり。受け取った音声をそのまま on_frame に渡します。"""
+
+    def __init__(self, track: FakeMediaTrack, output_frequency: int, output_channels: int):
+        super().__init__(track, output_frequency, output_channels)
+        self.on_frame: Optional[Callable[[FakeAudioFrame], None]] = None
+
+    def deliver(self, data: np.ndarray, sample_rate: int, timestamp_ms: Optional[int]) -> None:
+        converted = self._convert(data)
+        if (on_frame := self.on_frame) is not None and len(converted) > 0:
+            on_frame(FakeAudioFrame(converted, self._output_frequency, timestamp_ms))
+
+
+class FakeVAD:
+    """SoraVAD の代わり。音声の RMS から音声らしさを求めます。"""
+
+    def __init__(self, threshold_rms: float = 1000.0):
+        self._threshold_rms: float = threshold_rms
+
+    def analyze(self, frame: FakeAudioFrame) -> float:
+        rms = float(np.sqrt(np.mean(np.square(frame.data(), dtype=np.float64))))
+        return min(1.0, rms / self._threshold_rms)
+
+
+class FakeConnection:
+    """
+    SoraConnection の代わり。
+
+    実際の SoraConnection と同じく、公開しているのは connect()、disconnect()、
+    send_data_channel()、get_stats() と on_* のコールバックだけです。
+    connect() すると、実際の SDK と同じく別スレッドから on_set_offer、on_notify
+    (connection.created)、on_track、on_switched、on_data_channel を順に呼びます。
+    """
+
+    def __init__(
+        self,
+        server: FakeSoraServer,
+        signaling_delay_s: float,
+        switch_delay_s: float,
+        role: str,
+        channel_id: str,
+        audio: Optional[bool] = None,
+        video: Optional[bool] = None,
+        audio_source: Optional[FakeAudioSource] = None,
+        video_source: Optional[FakeVideoSource] = None,
+        data_channel_signaling: Optional[bool] = None,
+        data_channels: Optional[list[dict[str, Any]]] = None,
+        **kwargs: Any,
+    ):
+        self.on_set_offer: Optional[Callable[[str], None]] = None
+        self.on_disconnect: Optional[Callable[[Any, str], None]] = None
+        self.on_notify: Optional[Callable[[str], None]] = None
+        self.on_push: Optional[Callable[[str], None]] = None
+        self.on_message: Optional[Callable[[str, bytes], None]] = None
+        self.on_switched: Optional[Callable[[str], None]] = None
+        self.on_track: Optional[Callable[[FakeMediaTrack], None]] = None
+        self.on_data_channel: Optional[Callable[[str], None]] = None
+
+        self._server = server
+        self._signaling_delay_s: float = signaling_delay_s
+        self._switch_delay_s: float = switch_delay_s
+        self._role: str = role
+        self._channel_id: str = channel_id
+        self._connection_id: str = str(uuid.uuid4())
+        self._audio: bool = audio is not False
+        self._video: bool = video is not False
+        self._audio_source = audio_source
+        self._video_source = video_source
+        self._data_channel_signaling: bool = bool(data_channel_signaling or data_channels)
+        self._data_channels: list[dict[str, Any]] = data_channels or []
+        self._options: dict[str, Any] = kwargs
+
+        # 送信したトラック。切断したら受信側から外す
+        self._tracks: list[FakeMediaTrack] = []
+        self._joined: bool = False
+        self._connected_at: Optional[float] = None
+        self._messages_sent: int = 0
+        self._bytes_sent: int = 0
+        self._messages_received: int = 0
+        self._bytes_received: int = 0
+
+        # コールバックは SDK と同じく呼び出し元とは別のスレッドから呼ぶ
+        self._events: queue.Queue[Optional[Callable[[], None]]] = queue.Queue()
+        self._event_thread = threading.Thread(target=self._run_events, daemon=True)
+        self._event_thread.start()
+
+    @property
+    def _sends_media(self) -> bool:
+        return self._role in ("sendonly", "sendrecv")
+
+    @property
+    def _receives_media(self) -> bool:
+        return self._role in ("recvonly", "sendrecv")
+
+    def connect(self) -> None:
+        self._events.put(self._handshake)
+
+    def disconnect(self) -> None:
+        self._events.put(lambda: self._close("CLOSE_SUCCEEDED", "disconnected"))
+
+    def send_data_channel(self, label: str, data: bytes) -> bool:
+        if not self._joined or label not in {dc["label"] for dc in self._data_channels}:
+            return False
+        self._messages_sent += 1
+        self._bytes_sent += len(data)
+        for peer in self._server.members(self._channel_id):
+            if peer is not self:
+                peer._receive_message(label, data)
+        return True
+
+    def get_stats(self) -> str:
+        stats: list[dict[str, Any]] = []
+        elapsed_s = time.monotonic() - self._connected_at if self._connected_at else 0.0
+        if self._video_source is not None:
+            frames = self._video_source.frames_captured
+            stats.append(
+                {
+                    "type": "outbound-rtp",
+                    "kind": "video",
+                    # 実際の送信量の代わりに、未圧縮の 1/100 を送ったことにする
+                    "bytesSent": self._video_source.bytes_captured // 100,
+                    "framesEncoded": frames,
+                    "totalEncodeTime": frames * 0.001,
+                    "framesPerSecond": frames / elapsed_s if elapsed_s > 0 else 0,
+                    "encoderImplementation": "fake",
+                    "qualityLimitationReason": "none",
+                }
+            )
+        if self._audio_source is not None:
+            stats.append(
+                {
+                    "type": "outbound-rtp",
+                    "kind": "audio",
+                    "bytesSent": self._audio_source.samples_captured * 2 // 10,
+                }
+            )
+        stats.append(
+            {
+                "type": "data-channel",
+                "messagesSent": self._messages_sent,
+                "bytesSent": self._bytes_sent,
+                "messagesReceived": self._messages_received,
+                "bytesReceived": self._bytes_received,
+            }
+        )
+        stats.append(
+            {
+                "type": "candidate-pair",
+                "nominated": True,
+                "state": "succeeded",
+                "currentRoundTripTime": self._signaling_delay_s * 2,
+            }
+        )
+        return json.dumps(stats)
+
+    def _run_events(self) -> None:
+        while (event := self._events.get()) is not None:
+            event()
+
+    def _call(self, callback: Optional[Callable[..., None]], *args: Any) -> None:
+        if callback is not None:
+            callback(*args)
+
+    def _handshake(self) -> None:
+        time.sleep(self._signaling_delay_s)
+        offer = {"type": "offer", "connection_id": self._connection_id, "role": self._role}
+        self._call(self.on_set_offer, json.dumps(offer))
+
+        peers = self._server.join(self)
+        self._joined = True
+        self._connected_at = time.monotonic()
+        created = {
+            "type": "notify",
+            "event_type": "connection.created",
+            "role": self._role,
+            "channel_id": self._channel_id,
+            "connection_id": self._connection_id,
+        }
+        self._call(self.on_notify, json.dumps(created))
+        for peer in peers:
+            peer._events.put(lambda peer=peer: peer._call(peer.on_notify, json.dumps(created)))
+
+        # 送信側のトラックを受信側に届ける
+        if self._sends_media:
+            for peer in peers:
+                if peer._receives_media:
+                    self._publish_to(peer)
+        if self._receives_media:
+            for peer in peers:
+                if peer._sends_media:
+                    peer._publish_to(self)
+
+        if self._data_channel_signaling:
+            time.sleep(self._switch_delay_s)
+            self._call(self.on_switched, json.dumps({"type": "switched"}))
+            for data_channel in self._data_channels:
+                self._call(self.on_data_channel, data_channel["label"])
+
+    def _publish_to(self, receiver: "FakeConnection") -> None:
+        sources: list[tuple[str, Any]] = []
+        if self._audio and receiver._audio and self._audio_source is not None:
+            sources.append(("audio", self._audio_source))
+        if self._video and receiver._video and self._video_source is not None:
+            sources.append(("video", self._video_source))
+        for kind, source in sources:
+            track = FakeMediaTrack(kind, self._connection_id, source)
+            self._tracks.append(track)
+            receiver._events.put(lambda track=track: receiver._call(receiver.on_track, track))
+
+    def _receive_message(self, label: str, data: bytes) -> None:
+        self._messages_received += 1
+        self._bytes_received += len(data)
+        self._events.put(lambda: self._call(self.on_message, label, data))
+
+    def _close(self, error_code: str, message: str) -> None:
+        if self._joined:
+            self._joined = False
+            for track in self._tracks:
+                track.end()
+            self._tracks.clear()
+            destroyed = {
+                "type": "notify",
+                "event_type": "connection.destroyed",
+                "channel_id": self._channel_id,
+                "connection_id": self._connection_id,
+            }
+            for peer in self._server.leave(self):
+                peer._events.put(
+                    lambda peer=peer: peer._call(peer.on_notify, json.dumps(destroyed))
+                )
+        self._call(self.on_disconnect, error_code, message)
+        self._events.put(None)
+
+
+class FakeSora:
+    """
+    ネットワークにつながずにサンプルを動かすための Sora の代わり。
+
+    Sendonly などの sora 引数に渡すと、同じ FakeSoraServer のチャンネルに接続した
+    他の接続との間で、送信したメディアやメッセージがそのまま折り返されます。
+    受信する場合は、Recvonly などの sink_classes に FAKE_SINK_CLASSES も渡してください。
+    """
+
+    def __init__(
+        self,
+        server: Optional[FakeSoraServer] = None,
+        signaling_delay_s: float = 0.01,
+        switch_delay_s: float = 0.01,
+        **kwargs: Any,
+    ):
+        """
+        FakeSora インスタンスを初期化します。
+
+        :param server: 接続先のサーバー。省略した場合は default_server
+        :param signaling_delay_s: connect() から offer が届くまでの時間（秒）
+        :param switch_delay_s: 接続してからデータチャネルシグナリングに切り替わるまでの時間（秒）
+        """
+        self._server: FakeSoraServer = server or default_server
+        self._signaling_delay_s: float = signaling_delay_s
+        self._switch_delay_s: float = switch_delay_s
+
+    def create_connection(self, **kwargs: Any) -> FakeConnection:
+        return FakeConnection(self._server, self._signaling_delay_s, self._switch_delay_s, **kwargs)
+
+    def create_audio_source(self, channels: int, sample_rate: int) -> FakeAudioSource:
+        return FakeAudioSource(channels, sample_rate)
+
+    def create_video_source(self) -> FakeVideoSource:
+        return FakeVideoSource()
+
+
+def drop_connection(connection: FakeConnection, message: str = "connection lost") -> None:
+    """
+    FakeSora の接続に意図しない切断を起こします。再接続のテストに利用します。
+
+    実際の SoraConnection にない操作なので、FakeConnection のメソッドにはしていません。
+
+    :param connection: 切断する FakeConnection
+    :param message: on_disconnect に渡すメッセージ
+    """
+    connection._events.put(lambda: connection._close("WEBSOCKET_ONCLOSE", message))
+
+
+# FakeSora で受信する場合に、Recvonly などの sink_classes に渡すシンクと SoraVAD のクラス
+FAKE_SINK_CLASSES = SinkClasses(
+    audio_sink=FakeAudioSink,
+    audio_stream_sink=FakeAudioStreamSink,
+    video_sink=FakeVideoSink,
+    vad=FakeVAD,
+)
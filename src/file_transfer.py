@@ -0,0 +1,332 @@
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+# メッセージの種類
+_OFFER, _ACCEPT, _DATA, _ACK, _NACK = range(1, 6)
+
+# 種類、転送 ID、値 (大きさ、チャンクの番号、次に受け取るチャンクの番号)
+_HEADER = struct.Struct("!BIQ")
+# OFFER はチャンクの大きさとファイル名、DATA は CRC32 と中身が続く
+_OFFER_HEADER = struct.Struct("!BIQI")
+_DATA_HEADER = struct.Struct("!BIQI")
+# 受信の進み具合のファイルの中身。大きさ、チャンクの大きさ、次に受け取るチャンクの番号
+_PROGRESS = struct.Struct("!QIQ")
+# 受け取り終えた転送を覚えておく数。最後の確認応答が失われて届いた送り直しに応答を返す
+_FINISHED_TRANSFERS = 64
+
+
+@dataclass
+class TransferStats:
+    """1 回の送信の結果。"""
+
+    name: str
+    size: int
+    # 再開した位置から送ったバイト数
+    bytes_sent: int
+    elapsed_s: float
+    # 確認応答が届かずに送り直したチャンクの数
+    retransmitted_chunks: int
+
+    @property
+    def throughput_bps(self) -> float:
+        """1 秒あたりに送ったビット数。"""
+        return self.bytes_sent * 8 / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+
+class _Receiving:
+    """
+    受信中のファイル。事前に大きさを確保したファイルを mmap して、チャンクを直接書き込む。
+
+    次に受け取るチャンクの番号は .part の隣の .part.progress にも書き込み、
+    受信側を起動し直しても同じ大きさとチャンクの大きさであれば続きから受け取る。
+    """
+
+    def __init__(self, part_path: Path, size: int, chunk_size: int):
+        self.part_path = part_path
+        self.progress_path = part_path.with_name(f"{part_path.name}.progress")
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = -(-size // chunk_size)
+        self.next_chunk = self._load_progress() if part_path.exists() else 0
+        # NACK を送ったチャンクの番号。送り直しが届くまで同じ NACK を繰り返さない
+        self.nacked_chunk = -1
+        self._file = open(part_path, "r+b" if part_path.exists() else "w+b")
+        self._file.truncate(size)
+        # 大きさ 0 のファイルは mmap できない
+        self._mmap = mmap.mmap(self._file.fileno(), size) if size > 0 else None
+        # チャンクごとに書き直すので、バッファせずに開いたままにする
+        self._progress = open(self.progress_path, "wb", buffering=0)
+        self._save_progress()
+
+    def _load_progress(self) -> int:
+        try:
+            data = self.progress_path.read_bytes()
+        except OSError:
+            return 0
+        if len(data) != _PROGRESS.size:
+            return 0
+        size, chunk_size, next_chunk = _PROGRESS.unpack(data)
+        # 別の大きさのファイルを受け取っていた .part は始めから書き直す
+        if (size, chunk_size) != (self.size, self.chunk_size):
+            return 0
+        return min(next_chunk, self.chunk_count)
+
+    def _save_progress(self) -> None:
+        self._progress.seek(0)
+        self._progress.write(_PROGRESS.pack(self.size, self.chunk_size, self.next_chunk))
+
+    def write(self, index: int, data: bytes) -> None:
+        assert self._mmap is not None
+        offset = index * self.chunk_size
+        self._mmap[offset : offset + len(data)] = data
+        # チャンクを書き込んでから進み具合を書き込み、受け取っていないチャンクを飛ばさない
+        self.next_chunk = index + 1
+        self._save_progress()
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+        self._progress.close()
+
+
+class FileTransfer:
+    """
+    データチャネルでファイルを送受信するクラス。
+
+    ファイルは mmap で読み出して固定長のチャンクに分け、チャンクごとに CRC32 を付けて送ります。
+    確認応答を待たずに送るチャンクの数を window までに制限するので、
+    ファイルの大きさによらずメモリの使用量は window x chunk_size 程度に収まります。
+    確認応答は次に受け取るチャンクの番号で返し、届かないチャンクや壊れたチャンクがあれば
+    そこから送り直します。
+
+    受信側は大きさを確保した .part のファイルにチャンクを直接書き込み、
+    すべて受け取ったら名前を変えます。同じ名前と大きさのファイルを再び受け取る場合は、
+    受け取り済みのチャンクの続きから再開します。受け取り済みのチャンクの数は
+    .part.progress のファイルに書き込むので、受信側を起動し直しても再開できます。
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], Any],
+        receive_dir: Optional[Union[str, Path]] = None,
+        chunk_size: int = 64 * 1024,
+        window: int = 32,
+        ack_timeout_s: float = 5.0,
+        max_retries: int = 5,
+    ):
+        """
+        FileTransfer インスタンスを初期化します。
+
+        :param send: データチャネルにメッセージを送る関数
+        :param receive_dir: 受け取ったファイルを保存するディレクトリ。省略した場合は受け取りません
+        :param chunk_size: 1 つのメッセージで送るチャンクの大きさ（バイト）
+        :param window: 確認応答を待たずに送るチャンクの数の上限
+        :param ack_timeout_s: 確認応答が届かない場合に送り直すまでの時間（秒）
+        :param max_retries: 確認応答が届かないまま送り直す回数の上限
+        """
+        if chunk_size <= 0 or window <= 0:
+            raise ValueError("chunk_size と window には 1 以上を指定してください")
+        self._send: Callable[[bytes], Any] = send
+        self._receive_dir: Optional[Path] = Path(receive_dir) if receive_dir else None
+        self._chunk_size: int = chunk_size
+        self._window: int = window
+        self._ack_timeout_s: float = ack_timeout_s
+        self._max_retries: int = max_retries
+
+        # 送信中の転送 ID ごとの、受け取り済みと確認されたチャンクの数と、NACK を受けた転送 ID
+        self._condition = threading.Condition()
+        self._acked: dict[int, int] = {}
+        self._nacked: set[int] = set()
+
+        # 受信中のファイル。転送 ID と、再開のための名前と大きさで引く
+        self._receiving: dict[int, _Receiving] = {}
+        self._partial: dict[tuple[str, int, int], _Receiving] = {}
+        # 受け取り終えた転送 ID ごとのチャンクの数。古いものから忘れる
+        self._finished: dict[int, int] = {}
+
+        # ファイルを受け取り終えたときに呼ばれるコールバック
+        self.on_file_received: Optional[Callable[[Path], None]] = None
+
+    def send_file(self, path: Union[str, Path], name: Optional[str] = None) -> TransferStats:
+        """
+        ファイルを送ります。受信側がすべてのチャンクを受け取るまで戻りません。
+
+        :param path: 送るファイルのパス
+        :param name: 受信側で保存する名前。省略した場合はファイル名
+        :raises TimeoutError: 確認応答が届かない場合
+        """
+        path = Path(path)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return self.send_bytes(b"", name or path.name)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    return self.send_bytes(view, name or path.name)
+
+    def send_bytes(self, data: Union[bytes, memoryview], name: str) -> TransferStats:
+        """
+        バイト列をファイルとして送ります。受信側がすべてのチャンクを受け取るまで戻りません。
+
+        :param data: 送るデータ
+        :param name: 受信側で保存する名前
+        :raises TimeoutError: 確認応答が届かない場合
+        """
+        view = memoryview(data).cast("B")
+        size = len(view)
+        chunk_size = self._chunk_size
+        chunk_count = -(-size // chunk_size)
+        transfer_id = random.getrandbits(32)
+        with self._condition:
+            self._acked[transfer_id] = -1
+
+        try:
+            # 受信側が再開する位置を返すまで待つ
+            offer = _OFFER_HEADER.pack(_OFFER, transfer_id, size, chunk_size)
+            self._send(offer + name.encode("utf-8"))
+            start = self._wait_for_ack(transfer_id, -1)
+            if start is None:
+                raise TimeoutError(f"受信側が応答しません: {name}")
+
+            started_at = time.perf_counter()
+            acked = next_chunk = start
+            retransmitted = retries = 0
+            while acked < chunk_count:
+                # ウィンドウに空きがある間は確認応答を待たずに送る
+                while next_chunk < chunk_count and next_chunk - acked < self._window:
+                    offset = next_chunk * chunk_size
+                    chunk = view[offset : offset + chunk_size]
+                    header = _DATA_HEADER.pack(_DATA, transfer_id, next_chunk, zlib.crc32(chunk))
+                    self._send(b"".join((header, chunk)))
+                    next_chunk += 1
+
+                progress = self._wait_for_ack(transfer_id, acked)
+                with self._condition:
+                    nacked = transfer_id in self._nacked
+                    self._nacked.discard(transfer_id)
+                if progress is None or nacked:
+                    # 届いていないか壊れていたチャンクから送り直す
+                    retries = retries + 1 if progress is None else 0
+                    if retries > self._max_retries:
+                        raise TimeoutError(f"確認応答が届きません: {name}")
+                    current = self._acked[transfer_id]
+                    retransmitted += next_chunk - max(acked, current)
+                    acked = next_chunk = max(acked, current)
+                    continue
+                retries = 0
+                acked = progress
+            elapsed_s = time.perf_counter() - started_at
+        finally:
+            view.release()
+            with self._condition:
+                self._acked.pop(transfer_id, None)
+                self._nacked.discard(transfer_id)
+
+        return TransferStats(
+            name=name,
+            size=size,
+            bytes_sent=size - min(size, start * chunk_size),
+            elapsed_s=elapsed_s,
+            retransmitted_chunks=retransmitted,
+        )
+
+    def _wait_for_ack(self, transfer_id: int, acked: int) -> Optional[int]:
+        # acked より先まで確認応答が進むか、NACK を受けるまで待つ
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._acked[transfer_id] > acked or transfer_id in self._nacked,
+                timeout=self._ack_timeout_s,
+            ):
+                return None
+            return self._acked[transfer_id]
+
+    def handle_message(self, data: bytes) -> None:
+        """
+        データチャネルで受け取ったメッセージを処理します。
+
+        :param data: 受け取ったメッセージ
+        """
+        kind, transfer_id, value = _HEADER.unpack_from(data)
+        if kind in (_ACCEPT, _ACK, _NACK):
+            with self._condition:
+                if transfer_id not in self._acked:
+                    return
+                self._acked[transfer_id] = max(self._acked[transfer_id], value)
+                if kind == _NACK:
+                    self._nacked.add(transfer_id)
+                self._condition.notify_all()
+        elif kind == _OFFER:
+            self._on_offer(transfer_id, value, data)
+        elif kind == _DATA:
+            self._on_data(transfer_id, value, data)
+
+    def _on_offer(self, transfer_id: int, size: int, data: bytes) -> None:
+        if self._receive_dir is None:
+            return
+        _, _, _, chunk_size = _OFFER_HEADER.unpack_from(data)
+        # 受け取ったファイル名にディレクトリが含まれていても receive_dir の外には書かない
+        name = os.path.basename(data[_OFFER_HEADER.size :].decode("utf-8"))
+        if name in ("", ".", ".."):
+            return
+        key = (name, size, chunk_size)
+        receiving = self._partial.get(key)
+        if receiving is None:
+            receiving = _Receiving(self._receive_dir / f"{name}.part", size, chunk_size)
+            self._partial[key] = receiving
+        self._receiving[transfer_id] = receiving
+        self._send(_HEADER.pack(_ACCEPT, transfer_id, receiving.next_chunk))
+        if receiving.next_chunk >= receiving.chunk_count:
+            self._finish(transfer_id, key)
+
+    def _on_data(self, transfer_id: int, index: int, data: bytes) -> None:
+        receiving = self._receiving.get(transfer_id)
+        if receiving is None:
+            # 受け取り終えた後に届いた送り直しは、確認応答が失われたものとして応答し直す
+            if (chunk_count := self._finished.get(transfer_id)) is not None:
+                self._send(_HEADER.pack(_ACK, transfer_id, chunk_count))
+            return
+        if index != receiving.next_chunk:
+            # 送り直しの前に届いていた分などは捨てて、次に受け取るチャンクを伝え直す
+            if index > receiving.next_chunk:
+                self._send_nack(transfer_id, receiving)
+            else:
+                # 受け取り済みのチャンクが届いたのは確認応答が失われたため
+                self._send(_HEADER.pack(_ACK, transfer_id, receiving.next_chunk))
+            return
+        _, _, _, crc = _DATA_HEADER.unpack_from(data)
+        payload = memoryview(data)[_DATA_HEADER.size :]
+        if zlib.crc32(payload) != crc:
+            self._send_nack(transfer_id, receiving)
+            return
+        receiving.write(index, payload)
+        self._send(_HEADER.pack(_ACK, transfer_id, receiving.next_chunk))
+        if receiving.next_chunk == receiving.chunk_count:
+            name = receiving.part_path.name.removesuffix(".part")
+            self._finish(transfer_id, (name, receiving.size, receiving.chunk_size))
+
+    def _send_nack(self, transfer_id: int, receiving: _Receiving) -> None:
+        if receiving.nacked_chunk != receiving.next_chunk:
+            receiving.nacked_chunk = receiving.next_chunk
+            self._send(_HEADER.pack(_NACK, transfer_id, receiving.next_chunk))
+
+    def _finish(self, transfer_id: int, key: tuple[str, int, int]) -> None:
+        receiving = self._receiving.pop(transfer_id)
+        self._partial.pop(key, None)
+        self._finished[transfer_id] = receiving.chunk_count
+        if len(self._finished) > _FINISHED_TRANSFERS:
+            del self._finished[next(iter(self._finished))]
+        receiving.close()
+        path = receiving.part_path.with_name(key[0])
+        os.replace(receiving.part_path, path)
+        receiving.progress_path.unlink(missing_ok=True)
+        if self.on_file_received is not None:
+            self.on_file_received(path)
@@ -0,0 +1,266 @@
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+# 共有メモリの先頭に置く値の位置
+_WRITE_SEQ, _SLOT_COUNT, _SLOT_SIZE, _MAX_READERS = range(4)
+_HEADER_FIELDS = 8
+_ALIGNMENT = 64
+
+# スロットごとのヘッダー。書き込みの前に begin、後に end へ同じシーケンス番号を書く
+_SLOT_HEADER = np.dtype(
+    [
+        ("begin", "<i8"),
+        ("end", "<i8"),
+        ("timestamp_ns", "<i8"),
+        ("height", "<i4"),
+        ("width", "<i4"),
+        ("channels", "<i4"),
+        ("stream_id", "S64"),
+    ]
+)
+
+
+class BusFrame(NamedTuple):
+    """FrameBus から読み出したフレーム。"""
+
+    seq: int
+    stream_id: str
+    timestamp_ns: int
+    data: np.ndarray
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class _Layout:
+    """共有メモリの中のヘッダー、読み出し位置、スロットのヘッダーとデータの ndarray のビュー。"""
+
+    def __init__(self, buffer: memoryview, slot_count: int, slot_size: int, max_readers: int):
+        cursors_offset, slots_offset, data_offset, _ = self.offsets(
+            slot_count, slot_size, max_readers
+        )
+        self.header = np.ndarray((_HEADER_FIELDS,), dtype="<i8", buffer=buffer)
+        self.cursors = np.ndarray((max_readers,), dtype="<i8", buffer=buffer, offset=cursors_offset)
+        self.slots = np.ndarray(
+            (slot_count,), dtype=_SLOT_HEADER, buffer=buffer, offset=slots_offset
+        )
+        self.data = np.ndarray(
+            (slot_count, slot_size), dtype=np.uint8, buffer=buffer, offset=data_offset
+        )
+
+    @staticmethod
+    def offsets(slot_count: int, slot_size: int, max_readers: int) -> tuple[int, int, int, int]:
+        """読み出し位置、スロットのヘッダー、スロットのデータの位置と、全体の大きさを返します。"""
+        cursors_offset = _align(_HEADER_FIELDS * 8)
+        slots_offset = _align(cursors_offset + max_readers * 8)
+        data_offset = _align(slots_offset + slot_count * _SLOT_HEADER.itemsize)
+        return cursors_offset, slots_offset, data_offset, data_offset + slot_count * slot_size
+
+
+class FrameBus:
+    """
+    受信した映像のフレームを、共有メモリのリングバッファで別のプロセスに配るクラス。
+
+    フレームは固定長のスロットに 1 度だけコピーし、読み出す側のプロセスは
+    FrameBusReader で同じ共有メモリを開いて、pickle せずに読み出します。
+    書き込みは読み出しを待たないので、遅れた読み出し側はスロットが一周した分のフレームを飛ばします。
+    publish() は複数のトラックの受信スレッドから呼び出せます。
+
+    with 文で使うと、抜けるときに共有メモリを閉じて削除します。
+    """
+
+    def __init__(
+        self,
+        slot_count: int,
+        slot_size: int,
+        max_readers: int = 8,
+        name: Optional[str] = None,
+    ):
+        """
+        FrameBus インスタンスを初期化し、共有メモリを作成します。
+
+        :param slot_count: スロットの数
+        :param slot_size: 1 スロットの大きさ（バイト）。最も大きいフレームの大きさ以上にしてください
+        :param max_readers: 読み出し位置を記録する読み出し側の数の上限
+        :param name: 共有メモリの名前。省略した場合は自動で決めます
+        """
+        if slot_count <= 0 or slot_size <= 0 or max_readers <= 0:
+            raise ValueError("slot_count、slot_size、max_readers には 1 以上を指定してください")
+        size = _Layout.offsets(slot_count, slot_size, max_readers)[3]
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._layout = _Layout(self._shm.buf, slot_count, slot_size, max_readers)
+        self._layout.header[:] = 0
+        self._layout.header[_SLOT_COUNT] = slot_count
+        self._layout.header[_SLOT_SIZE] = slot_size
+        self._layout.header[_MAX_READERS] = max_readers
+        self._layout.cursors[:] = 0
+        self._layout.slots["begin"] = 0
+        self._layout.slots["end"] = 0
+        self._slot_count: int = slot_count
+        self._slot_size: int = slot_size
+        self._seq: int = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """FrameBusReader に渡す共有メモリの名前。"""
+        return self._shm.name
+
+    @property
+    def seq(self) -> int:
+        """最後に書き込んだフレームのシーケンス番号。"""
+        return self._seq
+
+    def publish(
+        self, data: np.ndarray, stream_id: str = "", timestamp_ns: Optional[int] = None
+    ) -> int:
+        """
+        フレームを次のスロットにコピーします。
+
+        :param data: (高さ, 幅, チャンネル数) の uint8 のフレーム
+        :param stream_id: 送信元のストリーム ID。64 バイトまで
+        :param timestamp_ns: フレームの時刻。省略した場合は time.monotonic_ns() の値
+        :return: 書き込んだフレームのシーケンス番号
+        :raises ValueError: フレームがスロットに収まらない場合
+        """
+        if data.nbytes > self._slot_size:
+            raise ValueError(f"フレームがスロットに収まりません: {data.nbytes} > {self._slot_size}")
+        height, width = data.shape[:2]
+        channels = data.shape[2] if data.ndim == 3 else 1
+
+        with self._lock:
+            seq = self._seq + 1
+            index = seq % self._slot_count
+            layout = self._layout
+            slot = layout.slots[index]
+            # 読み出し側は begin と end が一致していることで、書き込み中でないことを確かめる
+            slot["begin"] = seq
+            np.copyto(layout.data[index, : data.nbytes].reshape(data.shape), data)
+            slot["timestamp_ns"] = time.monotonic_ns() if timestamp_ns is None else timestamp_ns
+            slot["height"] = height
+            slot["width"] = width
+            slot["channels"] = channels
+            slot["stream_id"] = stream_id.encode()
+            slot["end"] = seq
+            layout.header[_WRITE_SEQ] = seq
+            self._seq = seq
+        return seq
+
+    def reader_lags(self) -> list[int]:
+        """読み出し側ごとの、書き込んだフレームから遅れているフレームの数。"""
+        return [self._seq - int(cursor) for cursor in self._layout.cursors]
+
+    def close(self) -> None:
+        """共有メモリを閉じて削除します。"""
+        # ビューが残っていると共有メモリを閉じられない
+        del self._layout
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self) -> "FrameBus":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class FrameBusReader:
+    """
+    FrameBus の共有メモリを開いてフレームを読み出すクラス。
+
+    読み出し側のプロセスは multiprocessing で起動してください。
+    Python 3.12 までは開いた共有メモリも resource_tracker に登録されるため、
+    resource_tracker を共有しない無関係のプロセスから開くと、終了時に削除されてしまいます。
+
+    読み出したフレームは、このインスタンスが確保したバッファにコピーしてから
+    書き込みで上書きされていないことを確かめるので、途中で書き換わったフレームは返しません。
+    返すフレームの data は次の read() で上書きされます。
+    """
+
+    def __init__(self, name: str, reader_index: int = 0, poll_interval_s: float = 0.001):
+        """
+        FrameBusReader インスタンスを初期化し、共有メモリを開きます。
+
+        :param name: FrameBus.name
+        :param reader_index: 読み出し位置を記録する位置。読み出し側ごとに別の値を指定してください
+        :param poll_interval_s: 新しいフレームを待つときに確認する間隔（秒）
+        """
+        self._shm = shared_memory.SharedMemory(name=name)
+        header = np.ndarray((_HEADER_FIELDS,), dtype="<i8", buffer=self._shm.buf)
+        slot_count = int(header[_SLOT_COUNT])
+        max_readers = int(header[_MAX_READERS])
+        if not 0 <= reader_index < max_readers:
+            raise ValueError(f"reader_index には 0 以上 {max_readers} 未満を指定してください")
+        self._layout = _Layout(self._shm.buf, slot_count, int(header[_SLOT_SIZE]), max_readers)
+        self._slot_count: int = slot_count
+        self._reader_index: int = reader_index
+        self._poll_interval_s: float = poll_interval_s
+        # 開いた時点の最新のフレームから読み出す
+        self._cursor: int = int(self._layout.header[_WRITE_SEQ])
+        self._buffer = np.empty(0, dtype=np.uint8)
+
+        # 遅れて飛ばしたフレームの数
+        self.skipped: int = 0
+
+    def read(self, timeout: float) -> Optional[BusFrame]:
+        """
+        次のフレームを読み出します。
+
+        :param timeout: 新しいフレームが届くまで待つ時間（秒）
+        :return: 読み出したフレーム。届かなかった場合は None
+        """
+        layout = self._layout
+        deadline = time.monotonic() + timeout
+        while True:
+            latest = int(layout.header[_WRITE_SEQ])
+            if latest > self._cursor:
+                # 一周以上遅れていたら、上書きされていない最も古いフレームまで飛ばす
+                oldest = latest - self._slot_count + 1
+                if self._cursor + 1 < oldest:
+                    self.skipped += oldest - self._cursor - 1
+                    self._cursor = oldest - 1
+                seq = self._cursor + 1
+                frame = self._copy_slot(seq)
+                self._cursor = seq
+                layout.cursors[self._reader_index] = seq
+                if frame is not None:
+                    return frame
+                # コピーしている間に上書きされたので、次のフレームを読む
+                self.skipped += 1
+                continue
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self._poll_interval_s)
+
+    def _copy_slot(self, seq: int) -> Optional[BusFrame]:
+        index = seq % self._slot_count
+        slot = self._layout.slots[index]
+        if slot["end"] != seq:
+            return None
+        shape = (int(slot["height"]), int(slot["width"]), int(slot["channels"]))
+        timestamp_ns = int(slot["timestamp_ns"])
+        stream_id = bytes(slot["stream_id"]).decode()
+        nbytes = shape[0] * shape[1] * shape[2]
+        if self._buffer.nbytes < nbytes:
+            self._buffer = np.empty(nbytes, dtype=np.uint8)
+        np.copyto(self._buffer[:nbytes], self._layout.data[index, :nbytes])
+        # コピーしている間に書き込みが始まっていたら使わない
+        if slot["begin"] != seq:
+            return None
+        return BusFrame(seq, stream_id, timestamp_ns, self._buffer[:nbytes].reshape(shape))
+
+    def close(self) -> None:
+        """共有メモリを閉じます。"""
+        del self._layout
+        self._shm.close()
+
+    def __enter__(self) -> "FrameBusReader":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
@@ -0,0 +1,271 @@
+import queue
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+from sora_sdk import Sora, SoraMediaTrack, SoraVideoFrame
+
+from config import get_config
+from connection_manager import SinkClasses
+from face_detectors import FaceDetector
+from hideface_sender import LogoStreamer
+from instrumentation import Histogram, enable_instrumentation_from_config
+from media_recvonly import Recvonly
+from signaling_url_selector import SignalingUrlSelector
+
+
+class _FrameQueueCapture:
+    """
+    LogoStreamer にカメラの代わりに渡す、受信したフレームのキュー。
+
+    キューが一杯の場合は古いフレームを捨てて、処理が追いつかなくても遅延が溜まらないようにします。
+    SoraVideoFrame.data() による変換は、受信スレッドではなく read() を呼ぶワーカーで行います。
+    """
+
+    def __init__(self, size: int):
+        self._queue: queue.Queue[tuple[SoraVideoFrame, int]] = queue.Queue(size)
+        self._opened: bool = True
+        # 最後に read() で返したフレームを受信した time.monotonic_ns() の値
+        self.received_ns: int = 0
+        # キューが一杯で捨てたフレームの数
+        self.dropped_frames: int = 0
+
+    def put(self, frame: SoraVideoFrame, received_ns: int) -> None:
+        item = (frame, received_ns)
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            self.dropped_frames += 1
+        try:
+            self._queue.get_nowait()
+            self._queue.put_nowait(item)
+        except (queue.Empty, queue.Full):
+            pass
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        try:
+            frame, self.received_ns = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return False, None
+        return True, frame.data()
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def release(self) -> None:
+        self._opened = False
+
+
+class _BridgeStreamer(LogoStreamer):
+    """受信したフレームの顔を隠して送り直し、受信から送信までの時間を記録する LogoStreamer。"""
+
+    def __init__(self, capture: _FrameQueueCapture, **kwargs: Any):
+        super().__init__(
+            camera_id=0,
+            video_width=None,
+            video_height=None,
+            video_fps=None,
+            video_fourcc=None,
+            video_capture=capture,  # type: ignore[arg-type]
+            **kwargs,
+        )
+        self._capture: _FrameQueueCapture = capture
+        self.latency = Histogram()
+
+    def run_one_frame(self, face_detector: FaceDetector, angle: int, frame: Any) -> int:
+        angle = super().run_one_frame(face_detector, angle, frame)
+        latency_ns = time.monotonic_ns() - self._capture.received_ns
+        self.latency.record(latency_ns)
+        self._instrumentation.record_value("bridge.end_to_end", latency_ns)
+        return angle
+
+
+class HidefaceBridge:
+    """
+    チャンネルの映像を受信し、顔を隠して別のチャンネルに送り直すクラス。
+
+    受信は 1 つの Recvonly で行い、送信元のストリームごとにワーカーのスレッドと
+    送信用の接続を作ります。ワーカーは LogoStreamer の処理をそのまま使い、
+    キューの大きさを超えて溜まったフレームは古いものから捨てます。
+    送信元が切断するとワーカーと送信用の接続を閉じます。
+    """
+
+    def __init__(
+        self,
+        signaling_urls: list[str],
+        source_channel_id: str,
+        output_channel_id: str,
+        metadata: Optional[dict[str, Any]] = None,
+        queue_size: int = 2,
+        video_fps_limit: Optional[float] = None,
+        sora: Optional[Sora] = None,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        sink_classes: Optional[SinkClasses] = None,
+        **streamer_options: Any,
+    ):
+        """
+        HidefaceBridge インスタンスを初期化します。
+
+        :param signaling_urls: Sora シグナリング URL のリスト
+        :param source_channel_id: 受信するチャンネル ID
+        :param output_channel_id: 顔を隠した映像を送信するチャンネル ID
+        :param metadata: 接続のためのオプションのメタデータ
+        :param queue_size: ストリームごとに処理を待つフレームの数
+        :param video_fps_limit: ストリームごとに処理するフレームレートの上限
+        :param sora: 受信と送信の接続で共有する Sora インスタンス。省略した場合は新しく作成します
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param sink_classes: 受信に使うシンクのクラス。FakeSora の場合は FAKE_SINK_CLASSES
+        :param streamer_options: LogoStreamer に渡す mode や face_detector などの引数
+        """
+        if queue_size <= 0:
+            raise ValueError("queue_size には 1 以上を指定してください")
+        self._sora: Sora = sora or Sora(openh264=None)
+        self._signaling_urls: list[str] = signaling_urls
+        self._output_channel_id: str = output_channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._queue_size: int = queue_size
+        self._url_selector: Optional[SignalingUrlSelector] = url_selector
+        self._streamer_options: dict[str, Any] = streamer_options
+
+        self._recvonly = Recvonly(
+            signaling_urls,
+            source_channel_id,
+            metadata=metadata,
+            reconnect=True,
+            url_selector=url_selector,
+            video_queue_size=64,
+            video_fps_limit=video_fps_limit,
+            sora=self._sora,
+            sink_classes=sink_classes,
+            # 送り直すのは映像だけなので、音声は受信しない
+            audio=False,
+        )
+        self._recvonly.on_track_added = self._on_track_added
+        self._recvonly.on_track_removed = self._on_track_removed
+
+        # 送信元のストリーム ID ごとのワーカー
+        self._workers_lock = threading.Lock()
+        self._workers: dict[str, tuple[_FrameQueueCapture, _BridgeStreamer, threading.Thread]] = {}
+
+    @property
+    def stream_ids(self) -> list[str]:
+        """顔を隠して送信しているストリームの送信元のストリーム ID。"""
+        with self._workers_lock:
+            return list(self._workers)
+
+    def latency_snapshot(self) -> dict[str, dict[str, Any]]:
+        """ストリームごとの、受信してから送信するまでの時間の統計。"""
+        with self._workers_lock:
+            workers = dict(self._workers)
+        return {
+            stream_id: {
+                **streamer.latency.snapshot(percentiles=(50, 99)),
+                "dropped_frames": capture.dropped_frames,
+            }
+            for stream_id, (capture, streamer, _) in workers.items()
+        }
+
+    def _on_track_added(self, track: SoraMediaTrack) -> None:
+        if track.kind != "video":
+            return
+        capture = _FrameQueueCapture(self._queue_size)
+        streamer = _BridgeStreamer(
+            capture,
+            signaling_urls=self._signaling_urls,
+            role="sendonly",
+            channel_id=self._output_channel_id,
+            metadata=self._metadata,
+            reconnect=True,
+            url_selector=self._url_selector,
+            sora=self._sora,
+            **self._streamer_options,
+        )
+        # 接続と顔検出の準備には時間がかかるので、受信スレッドを止めないように別スレッドで行う
+        thread = threading.Thread(target=streamer.run, daemon=True)
+        with self._workers_lock:
+            self._workers[track.stream_id] = (capture, streamer, thread)
+        thread.start()
+        print(f"Started hideface bridge: stream_id={track.stream_id}")
+
+    def _on_track_removed(self, track: SoraMediaTrack) -> None:
+        if track.kind != "video":
+            return
+        with self._workers_lock:
+            worker = self._workers.pop(track.stream_id, None)
+        if worker is not None:
+            self._stop_worker(track.stream_id, *worker)
+
+    def _stop_worker(
+        self,
+        stream_id: str,
+        capture: _FrameQueueCapture,
+        streamer: _BridgeStreamer,
+        thread: threading.Thread,
+    ) -> None:
+        # キャプチャを閉じると LogoStreamer.run() のループを抜けて切断する
+        capture.release()
+        latency = streamer.latency.snapshot(percentiles=(50, 99))
+        print(f"Stopped hideface bridge: stream_id={stream_id} latency={latency}")
+
+    def run(self) -> None:
+        """受信したフレームを送信元のストリームごとのワーカーに振り分けるメインループ。"""
+        self._recvonly.connect()
+        try:
+            while not self._recvonly.closed:
+                if (item := self._recvonly.get_track_frame(timeout=1)) is None:
+                    continue
+                with self._workers_lock:
+                    worker = self._workers.get(item.stream_id)
+                if worker is not None:
+                    worker[0].put(item.frame, item.received_ns)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.disconnect()
+
+    def disconnect(self) -> None:
+        """受信用の接続と、すべての送信用の接続を閉じます。"""
+        self._recvonly.disconnect()
+        with self._workers_lock:
+            workers = list(self._workers.items())
+            self._workers.clear()
+        for stream_id, worker in workers:
+            self._stop_worker(stream_id, *worker)
+        for _, (_, _, thread) in workers:
+            thread.join(timeout=10)
+
+
+def hideface_bridge() -> None:
+    """
+    設定を使用して HidefaceBridge インスタンスを設定し実行します。
+
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
+    """
+    config = get_config()
+    config.require("signaling_urls", "channel_id", "bridge_source_channel_id")
+    enable_instrumentation_from_config(config)
+
+    assert config.bridge_source_channel_id is not None
+    bridge = HidefaceBridge(
+        config.signaling_urls,
+        config.bridge_source_channel_id,
+        config.channel_id,
+        metadata=config.metadata,
+        queue_size=config.bridge_queue_size,
+        video_fps_limit=config.recv_video_fps_limit,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+        inference_width=config.inference_width,
+        face_detector=config.face_detector,
+        face_detector_min_accuracy=config.face_detector_min_accuracy,
+        calibration_frames=config.face_detector_calibration_frames,
+        yunet_model_path=config.yunet_model_path,
+        haar_cascade_path=config.haar_cascade_path,
+        mode=config.hideface_mode,
+    )
+    bridge.run()
+
+
+if __name__ == "__main__":
+    hideface_bridge()
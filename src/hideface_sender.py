@@ -1,22 +1,32 @@
-import json
 import math
-import os
 import platform
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from threading import Event
 from typing import Any, Optional
 
 import cv2  # type: ignore
-import mediapipe as mp  # type: ignore
 import numpy as np
 from cv2.typing import MatLike  # type: ignore
-from dotenv import load_dotenv
 from PIL import Image
-from sora_sdk import Sora, SoraSignalingErrorCode, SoraVideoSource
-
-
-class LogoStreamer:
-    """顔検出を行い、検出された顔にロゴを重ねて Sora に送信するクラス。"""
+from sora_sdk import Sora, SoraConnection, SoraVideoSource
+
+import startup_timing
+from config import HIDEFACE_MODES, get_config
+from connection_manager import ConnectionManager
+from face_anonymizer import FaceAnonymizer
+from face_detectors import (
+    FaceBox,
+    FaceDetector,
+    calibrate_face_detectors,
+    create_available_face_detectors,
+    create_face_detector,
+)
+from instrumentation import enable_instrumentation_from_config
+from signaling_url_selector import SignalingUrlSelector
+
+
+class LogoStreamer(ConnectionManager):
+    """顔検出を行い、検出された顔にロゴを重ねるか、ぼかすかモザイクにして Sora に送信するクラス。"""
 
     def __init__(
         self,
@@ -29,6 +39,17 @@ class LogoStreamer:
         video_height: Optional[int],
         video_fps: Optional[int],
         video_fourcc: Optional[str],
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        inference_width: int = 0,
+        sora: Optional[Sora] = None,
+        video_capture: Optional[cv2.VideoCapture] = None,
+        face_detector: str = "mediapipe_short",
+        face_detector_min_accuracy: float = 0.8,
+        calibration_frames: int = 10,
+        yunet_model_path: Optional[str] = None,
+        haar_cascade_path: Optional[str] = None,
+        mode: str = "logo",
     ):
         """
         LogoStreamer インスタンスを初期化します。
@@ -45,34 +66,65 @@ class LogoStreamer:
         :param video_height: ビデオの高さ
         :param video_fps: ビデオのフレームレート
         :param video_fourcc: ビデオの FOURCC コード
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param inference_width: 顔検出に渡す前に縮小する幅。0 の場合は縮小しない
+        :param sora: 利用する Sora インスタンス。省略した場合は新しく作成します
+        :param video_capture: カメラの代わりに使うビデオキャプチャ。省略した場合はカメラを開きます
+        :param face_detector: 顔検出のバックエンド。"auto" の場合は起動時に計測して選びます
+        :param face_detector_min_accuracy: "auto" で選ぶバックエンドの精度の下限
+        :param calibration_frames: "auto" で計測に使うフレーム数
+        :param yunet_model_path: YuNet の ONNX モデルのパス
+        :param haar_cascade_path: Haar cascade の XML のパス
+        :param mode: 顔を隠す方法。"logo"、"blur"、"pixelate" のいずれか
         """
-        self.mp_face_detection = mp.solutions.face_detection  # type: ignore
+        if mode not in HIDEFACE_MODES:
+            raise ValueError(f"mode は {HIDEFACE_MODES} のいずれかを指定してください: {mode}")
+        super().__init__(
+            sora or Sora(openh264=None),
+            signaling_urls,
+            reconnect=reconnect,
+            url_selector=url_selector,
+        )
+        self._role: str = role
+        self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._inference_width: int = inference_width
+        self._face_detector: str = face_detector
+        self._face_detector_min_accuracy: float = face_detector_min_accuracy
+        self._calibration_frames: int = calibration_frames
+        self._face_detector_options: dict[str, Any] = {
+            "yunet_model_path": yunet_model_path,
+            "haar_cascade_path": haar_cascade_path,
+        }
+        # ロゴを重ねる場合は None
+        self._anonymizer: Optional[FaceAnonymizer] = None
+        if mode != "logo":
+            self._anonymizer = FaceAnonymizer(mode)
+        # 顔検出に渡す画像のバッファ。ぼかしとモザイクの場合だけ使う
+        self._resized_frame: Optional[np.ndarray] = None
+        self._detection_frame: Optional[np.ndarray] = None
 
-        self._sora = Sora(openh264=None)
         self._video_source: SoraVideoSource = self._sora.create_video_source()
-        self._connection = self._sora.create_connection(
+
+        if video_capture is not None:
+            self._video_capture = video_capture
+        else:
+            self._setup_video_capture(camera_id, video_width, video_height, video_fps, video_fourcc)
+
+        # ロゴを読み込む
+        self._logo = Image.open(Path(__file__).parent.joinpath("shiguremaru.png"))
+
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        return self._sora.create_connection(
             signaling_urls=signaling_urls,
-            role=role,
-            channel_id=channel_id,
-            metadata=metadata,
+            role=self._role,
+            channel_id=self._channel_id,
+            metadata=self._metadata,
             video_codec_type=None,
             video_bit_rate=500,
             video_source=self._video_source,
         )
-        self._connection_id: Optional[str] = None
-
-        self._connected: Event = Event()
-        self._closed: bool = False
-        self._default_connection_timeout_s: float = 10.0
-
-        self._connection.on_set_offer = self._on_set_offer
-        self._connection.on_notify = self._on_notify
-        self._connection.on_disconnect = self._on_disconnect
-
-        self._setup_video_capture(camera_id, video_width, video_height, video_fps, video_fourcc)
-
-        # ロゴを読み込む
-        self._logo = Image.open(Path(__file__).parent.joinpath("shiguremaru.png"))
 
     def _setup_video_capture(
         self,
@@ -118,73 +170,97 @@ class LogoStreamer:
             if video_fps != int(self._video_capture.get(cv2.CAP_PROP_FPS)):
                 self._video_capture.set(cv2.CAP_PROP_FPS, video_fps)
 
-    def connect(self) -> None:
-        """
-        Sora への接続を確立します。
-
-        :raises AssertionError: タイムアウト期間内に接続が確立できなかった場合
-        """
-        self._connection.connect()
-
-        assert self._connected.wait(
-            timeout=self._default_connection_timeout_s
-        ), "接続に失敗しました"
-
-    def disconnect(self) -> None:
-        """Sora から切断します。"""
-        self._connection.disconnect()
-
-    def _on_disconnect(self, error_code: SoraSignalingErrorCode, message: str) -> None:
-        """
-        切断イベントを処理します。
-
-        :param error_code: 切断のエラーコード
-        :param message: 切断メッセージ
-        """
-        print(f"Sora から切断されました: error_code='{error_code}' message='{message}'")
-        self._connected.clear()
-        self._closed = True
-
-    def _on_set_offer(self, raw_message: str) -> None:
-        """
-        オファー設定イベントを処理します。
-
-        :param raw_message: オファーを含む生のメッセージ
-        """
-        message = json.loads(raw_message)
-        if message["type"] == "offer":
-            self._connection_id = message["connection_id"]
-
-    def _on_notify(self, raw_message: str) -> None:
+    def _load_face_detector(self) -> FaceDetector:
+        # モデルの読み込みや計測には時間がかかるので、シグナリングと並行して行う
+        if self._face_detector != "auto":
+            detector = create_face_detector(self._face_detector, **self._face_detector_options)
+        else:
+            frames = []
+            while len(frames) < self._calibration_frames and self._video_capture.isOpened():
+                success, frame = self._video_capture.read()
+                if success:
+                    frames.append(self._inference_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            detector, results = calibrate_face_detectors(
+                create_available_face_detectors(**self._face_detector_options),
+                frames,
+                self._face_detector_min_accuracy,
+            )
+            for result in results:
+                print(
+                    f"Face detector {result.name}: "
+                    f"detect_time={result.detect_time_s * 1000:.2f}ms "
+                    f"accuracy={result.accuracy:.2f}"
+                )
+        print(f"Using face detector: {detector.name}")
+        startup_timing.mark("model_loaded")
+        return detector
+
+    def _inference_frame(self, frame: MatLike) -> MatLike:  # type: ignore
+        # 座標は正規化されているので、縮小した画像で検出してもよい
+        if 0 < self._inference_width < frame.shape[1]:
+            inference_height = frame.shape[0] * self._inference_width // frame.shape[1]
+            return cv2.resize(
+                frame, (self._inference_width, inference_height), interpolation=cv2.INTER_AREA
+            )
+        return frame
+
+    def _prepare_detection_frame(self, frame: np.ndarray) -> np.ndarray:
+        # 縮小してから色の順序を変え、フレーム全体は変換しない。バッファは使い回す
+        if 0 < self._inference_width < frame.shape[1]:
+            size = (self._inference_width, frame.shape[0] * self._inference_width // frame.shape[1])
+            if self._resized_frame is None or self._resized_frame.shape[1::-1] != size:
+                self._resized_frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            frame = cv2.resize(frame, size, dst=self._resized_frame, interpolation=cv2.INTER_AREA)
+        if self._detection_frame is None or self._detection_frame.shape != frame.shape:
+            self._detection_frame = np.empty_like(frame)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._detection_frame)
+
+    @staticmethod
+    def _expand_face_box(
+        face: FaceBox, frame_width: int, frame_height: int
+    ) -> tuple[int, int, int, int]:
         """
-        Sora からの通知イベントを処理します。
+        検出した顔の領域を、頭全体が隠れるように広げたピクセル単位の領域を返します。
 
-        :param raw_message: 生の通知メッセージ
+        :param face: 正規化した顔の領域
+        :param frame_width: フレームの幅
+        :param frame_height: フレームの高さ
+        :return: (x, y, 幅, 高さ)
         """
-        message = json.loads(raw_message)
-        if (
-            message["type"] == "notify"
-            and message["event_type"] == "connection.created"
-            and message["connection_id"] == self._connection_id
-        ):
-            print("Sora に接続しました")
-            self._connected.set()
+        # 正規化されているので逆正規化を行う
+        w_px = math.floor(face.width * frame_width)
+        h_px = math.floor(face.height * frame_height)
+        x_px = min(math.floor(face.xmin * frame_width), frame_width - 1)
+        y_px = min(math.floor(face.ymin * frame_height), frame_height - 1)
+
+        # 検出領域は顔に対して小さいため、顔全体が覆われるように検出領域を大きくする
+        fixed_w_px = math.floor(w_px * 1.6)
+        fixed_h_px = math.floor(h_px * 1.6)
+        # 大きくした分、座標がずれてしまうため顔の中心になるように座標を補正する
+        fixed_x_px = max(0, math.floor(x_px - (fixed_w_px - w_px) / 2))
+        # 検出領域は顔であり頭が入っていないため、上寄りになるように座標を補正する
+        fixed_y_px = max(0, math.floor(y_px - (fixed_h_px - h_px)))
+        return fixed_x_px, fixed_y_px, fixed_w_px, fixed_h_px
 
     def run(self) -> None:
         """ビデオフレームの処理と送信を行うメインループ。"""
-        self.connect()
+        executor = ThreadPoolExecutor(max_workers=1)
+        face_detector_future = executor.submit(self._load_face_detector)
+        executor.shutdown(wait=False)
         try:
-            # 顔検出を用意する
-            with self.mp_face_detection.FaceDetection(
-                model_selection=0, min_detection_confidence=0.5
-            ) as face_detection:
+            # 接続に失敗してもカメラを解放して、顔検出の準備のスレッドの読み出しを止める
+            self.connect()
+            # 顔検出の準備ができるまで待つ
+            with face_detector_future.result() as face_detector:
                 angle = 0
-                while self._connected.is_set() and self._video_capture.isOpened():
+                while not self._closed.is_set() and self._video_capture.isOpened():
                     # フレームを取得する
+                    started_ns = self._instrumentation.now()
                     success, frame = self._video_capture.read()
                     if not success:
                         continue
-                    angle = self.run_one_frame(face_detection, angle, frame)
+                    self._instrumentation.record("hideface.capture", started_ns)
+                    angle = self.run_one_frame(face_detector, angle, frame)
         except KeyboardInterrupt:
             pass
         finally:
@@ -193,25 +269,33 @@ class LogoStreamer:
 
     def run_one_frame(
         self,
-        face_detection: mp.solutions.face_detection.FaceDetection,  # type: ignore
+        face_detector: FaceDetector,
         angle: int,
         frame: MatLike,  # type: ignore
     ) -> int:
         """
         1フレームの処理を行います。
 
-        :param face_detection: 顔検出オブジェクト
+        :param face_detector: 顔検出のバックエンド
         :param angle: ロゴの回転角度
         :param frame: 処理するフレーム
         :return: 更新されたロゴの回転角度
         """
+        if self._anonymizer is not None:
+            self._anonymize_one_frame(face_detector, self._anonymizer, frame)
+            return angle
+
+        instrumentation = self._instrumentation
+        started_ns = instrumentation.now()
+
         # 高速化の呪文
         frame.flags.writeable = False
-        # mediapipe や PIL で処理できるように色の順序を変える
+        # 顔検出や PIL で処理できるように色の順序を変える
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-        # mediapipe で顔を検出する
-        results = face_detection.process(frame)
+        faces = face_detector.detect(self._inference_frame(frame))
+        instrumentation.record("hideface.detect", started_ns)
+        started_ns = instrumentation.now()
 
         frame_height, frame_width, _ = frame.shape
         # PIL で処理できるように画像を変換する
@@ -223,30 +307,11 @@ class LogoStreamer:
         if angle >= 360:
             angle = 0
 
-        if results.detections:
-            for detection in results.detections:
-                location = detection.location_data
-                if not location.HasField("relative_bounding_box"):
-                    continue
-                bb = location.relative_bounding_box
-
-                # 正規化されているので逆正規化を行う
-                w_px = math.floor(bb.width * frame_width)
-                h_px = math.floor(bb.height * frame_height)
-                x_px = min(math.floor(bb.xmin * frame_width), frame_width - 1)
-                y_px = min(math.floor(bb.ymin * frame_height), frame_height - 1)
-
-                # 検出領域は顔に対して小さいため、顔全体が覆われるように検出領域を大きくする
-                fixed_w_px = math.floor(w_px * 1.6)
-                fixed_h_px = math.floor(h_px * 1.6)
-                # 大きくした分、座標がずれてしまうため顔の中心になるように座標を補正する
-                fixed_x_px = max(0, math.floor(x_px - (fixed_w_px - w_px) / 2))
-                # 検出領域は顔であり頭が入っていないため、上寄りになるように座標を補正する
-                fixed_y_px = max(0, math.floor(y_px - (fixed_h_px - h_px)))
-
-                # ロゴをリサイズする
-                resized_logo = rotated_logo.resize((fixed_w_px, fixed_h_px))
-                pil_image.paste(resized_logo, (fixed_x_px, fixed_y_px), resized_logo)
+        for face in faces:
+            x_px, y_px, w_px, h_px = self._expand_face_box(face, frame_width, frame_height)
+            # ロゴをリサイズする
+            resized_logo = rotated_logo.resize((w_px, h_px))
+            pil_image.paste(resized_logo, (x_px, y_px), resized_logo)
 
         frame.flags.writeable = True
         # PIL から numpy に画像を戻す
@@ -254,50 +319,76 @@ class LogoStreamer:
         # 色の順序をもとに戻す
         frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
 
+        instrumentation.record("hideface.overlay", started_ns)
+
         # WebRTC に渡す
+        started_ns = instrumentation.now()
         self._video_source.on_captured(frame)
+        instrumentation.record("hideface.on_captured", started_ns)
+        startup_timing.mark("first_frame")
         return angle
 
+    def _anonymize_one_frame(
+        self,
+        face_detector: FaceDetector,
+        anonymizer: FaceAnonymizer,
+        frame: np.ndarray,
+    ) -> None:
+        """
+        1 フレームの顔をその場でぼかすかモザイクにして送信します。
 
-def hideface_sender() -> None:
-    """
-    環境変数を使用して LogoStreamer インスタンスを設定し実行します。
-
-    :raises ValueError: 必要な環境変数が設定されていない場合
-    """
-    # .env ファイルを読み込む
-    load_dotenv()
-
-    # 必須引数
-    if not (raw_signaling_urls := os.getenv("SORA_SIGNALING_URLS")):
-        raise ValueError("環境変数 SORA_SIGNALING_URLS が設定されていません")
-    signaling_urls = raw_signaling_urls.split(",")
+        :param face_detector: 顔検出のバックエンド
+        :param anonymizer: 顔の領域を書き換える FaceAnonymizer
+        :param frame: 処理する BGR のフレーム。書き換えます
+        """
+        instrumentation = self._instrumentation
+        started_ns = instrumentation.now()
+        faces = face_detector.detect(self._prepare_detection_frame(frame))
+        instrumentation.record("hideface.detect", started_ns)
+
+        started_ns = instrumentation.now()
+        frame_height, frame_width = frame.shape[:2]
+        anonymizer.apply(
+            frame, [self._expand_face_box(face, frame_width, frame_height) for face in faces]
+        )
+        instrumentation.record("hideface.anonymize", started_ns)
 
-    if not (channel_id := os.getenv("SORA_CHANNEL_ID")):
-        raise ValueError("環境変数 SORA_CHANNEL_ID が設定されていません")
+        started_ns = instrumentation.now()
+        self._video_source.on_captured(frame)
+        instrumentation.record("hideface.on_captured", started_ns)
+        startup_timing.mark("first_frame")
 
-    # オプション引数
-    metadata = None
-    if raw_metadata := os.getenv("SORA_METADATA"):
-        metadata = json.loads(raw_metadata)
 
-    video_width = int(os.getenv("SORA_VIDEO_WIDTH", "640"))
-    video_height = int(os.getenv("SORA_VIDEO_HEIGHT", "360"))
-    video_fps = int(os.getenv("SORA_VIDEO_FPS", "30"))
-    video_fourcc = os.getenv("SORA_VIDEO_FOURCC", "MJPG")
+def hideface_sender() -> None:
+    """
+    設定を使用して LogoStreamer インスタンスを設定し実行します。
 
-    camera_id = int(os.getenv("SORA_CAMERA_ID", "1"))
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
+    """
+    # .env ファイルや環境変数から設定を読み込む
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
 
     streamer = LogoStreamer(
-        signaling_urls=signaling_urls,
+        signaling_urls=config.signaling_urls,
         role="sendonly",
-        channel_id=channel_id,
-        metadata=metadata,
-        camera_id=camera_id,
-        video_height=video_height,
-        video_width=video_width,
-        video_fps=video_fps,
-        video_fourcc=video_fourcc,
+        channel_id=config.channel_id,
+        metadata=config.metadata,
+        camera_id=config.camera_id if config.camera_id is not None else 1,
+        video_height=config.video_height or 360,
+        video_width=config.video_width or 640,
+        video_fps=config.video_fps,
+        video_fourcc=config.video_fourcc,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+        inference_width=config.inference_width,
+        face_detector=config.face_detector,
+        face_detector_min_accuracy=config.face_detector_min_accuracy,
+        calibration_frames=config.face_detector_calibration_frames,
+        yunet_model_path=config.yunet_model_path,
+        haar_cascade_path=config.haar_cascade_path,
+        mode=config.hideface_mode,
     )
     streamer.run()
 
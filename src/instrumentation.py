@@ -0,0 +1,245 @@
+import json
+import signal
+import sys
+import threading
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from typing import TYPE_CHECKING, Any, Optional
+
+from config import Config
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# HDR Histogram と同じく、2 のべき乗ごとに SUB_BUCKET_HALF 個のバケットに分ける。
+# 相対誤差はおよそ 1 / SUB_BUCKET_HALF (約 6%) になる
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+# 2 ** (SUB_BUCKET_BITS + MAX_SHIFT) ns (約 9.7 時間) までを記録できる
+MAX_SHIFT = 40
+BUCKET_COUNT = SUB_BUCKET_COUNT + MAX_SHIFT * SUB_BUCKET_HALF
+
+
+def _bucket_lower_bounds() -> list[int]:
+    # 起動を速くするため、NumPy を使わずに求める
+    lower_bounds = list(range(SUB_BUCKET_COUNT))
+    for index in range(SUB_BUCKET_COUNT, BUCKET_COUNT):
+        shift = (index - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+        mantissa = (index - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF
+        lower_bounds.append(mantissa << shift)
+    return lower_bounds
+
+
+class Histogram:
+    """
+    0 以上の整数値（主にナノ秒）を対数線形のバケットに数える、事前確保済みの HDR 風のヒストグラム。
+
+    record() はリストの要素を 1 つ増やすだけなので、ホットパスから呼んでも負荷は小さいです。
+    複数のスレッドから同じヒストグラムに記録すると、まれにカウントが失われることがあります。
+    """
+
+    __slots__ = ("_counts",)
+
+    _lower_bounds = _bucket_lower_bounds()
+
+    def __init__(self):
+        self._counts: list[int] = [0] * BUCKET_COUNT
+
+    def record(self, value_ns: int) -> None:
+        """
+        値を記録します。
+
+        :param value_ns: 記録する値（ナノ秒）
+        """
+        if value_ns < SUB_BUCKET_COUNT:
+            index = value_ns if value_ns > 0 else 0
+        else:
+            shift = value_ns.bit_length() - SUB_BUCKET_BITS
+            index = SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF
+            index += (value_ns >> shift) - SUB_BUCKET_HALF
+            if index >= BUCKET_COUNT:
+                index = BUCKET_COUNT - 1
+        self._counts[index] += 1
+
+    def reset(self) -> None:
+        """記録した値をすべて消します。"""
+        self._counts[:] = [0] * BUCKET_COUNT
+
+    def snapshot(
+        self, percentiles: tuple[float, ...] = (50, 90, 99, 99.9), unit: str = "ns"
+    ) -> dict[str, Any]:
+        """
+        記録した値の件数、最小値、最大値、平均値とパーセンタイルを返します。
+
+        値はバケットの下限で近似した値です。
+
+        :param percentiles: 求めるパーセンタイル
+        :param unit: キーの末尾に付ける単位。ナノ秒以外の値を記録した場合に指定します
+        """
+        counts = list(self._counts)
+        cumulative = list(accumulate(counts))
+        total = cumulative[-1]
+        if total == 0:
+            return {"count": 0}
+        nonzero = [index for index, count in enumerate(counts) if count]
+        result: dict[str, Any] = {
+            "count": total,
+            f"min_{unit}": self._lower_bounds[nonzero[0]],
+            f"max_{unit}": self._lower_bounds[nonzero[-1]],
+            f"mean_{unit}": sum(counts[i] * self._lower_bounds[i] for i in nonzero) / total,
+        }
+        for percentile in percentiles:
+            index = bisect_left(cumulative, total * percentile / 100)
+            result[f"p{percentile:g}_{unit}"] = self._lower_bounds[min(index, BUCKET_COUNT - 1)]
+        return result
+
+
+class NullInstrumentation:
+    """計測が無効なときに使う、何もしない計測。"""
+
+    enabled = False
+
+    def now(self) -> int:
+        return 0
+
+    def record(self, stage: str, started_ns: int) -> None:
+        pass
+
+    def record_value(self, stage: str, value_ns: int) -> None:
+        pass
+
+    def snapshot(self) -> dict[str, Any]:
+        return {}
+
+
+class Instrumentation(NullInstrumentation):
+    """
+    パイプラインの処理段ごとの所要時間をヒストグラムに記録するクラス。
+
+    計測する側は次のように使います::
+
+        started_ns = instrumentation.now()
+        ...
+        instrumentation.record("sendonly.on_captured", started_ns)
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+
+    def now(self) -> int:
+        return time.perf_counter_ns()
+
+    def record(self, stage: str, started_ns: int) -> None:
+        """
+        started_ns から現在までの経過時間を記録します。
+
+        :param stage: 処理段の名前
+        :param started_ns: now() で取得した開始時刻
+        """
+        self.record_value(stage, time.perf_counter_ns() - started_ns)
+
+    def record_value(self, stage: str, value_ns: int) -> None:
+        """
+        値をそのまま記録します。
+
+        :param stage: 処理段の名前
+        :param value_ns: 記録する値（ナノ秒）
+        """
+        if (histogram := self._histograms.get(stage)) is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram())
+        histogram.record(value_ns)
+
+    def snapshot(self) -> dict[str, Any]:
+        """処理段ごとの統計値を返します。"""
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {
+            "uptime_s": time.time() - self._started_at,
+            "stages": {stage: histogram.snapshot() for stage, histogram in histograms.items()},
+        }
+
+    def install_signal_handler(self, signum: Optional[int] = None) -> bool:
+        """
+        シグナルを受けたら標準エラー出力にスナップショットを書き出すようにします。
+
+        :param signum: シグナル番号。省略した場合は SIGUSR1
+        :return: 設定できた場合は True。Windows など SIGUSR1 がない環境では False
+        """
+        if signum is None:
+            if not hasattr(signal, "SIGUSR1"):
+                return False
+            signum = signal.SIGUSR1
+
+        def handler(_signum, _frame):
+            print(json.dumps(self.snapshot()), file=sys.stderr, flush=True)
+
+        signal.signal(signum, handler)
+        return True
+
+    def serve_http(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        """
+        スナップショットを JSON で返す HTTP サーバーを別スレッドで起動します。
+
+        :param port: 待ち受けるポート番号
+        :param host: 待ち受けるアドレス。デフォルトはローカルホストのみ
+        :return: 起動した HTTP サーバー
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        instrumentation = self
+
+        class SnapshotHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(instrumentation.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), SnapshotHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_instrumentation: NullInstrumentation = NullInstrumentation()
+
+
+def get_instrumentation() -> NullInstrumentation:
+    """現在有効な計測を返します。計測が無効な場合は何もしない計測を返します。"""
+    return _instrumentation
+
+
+def enable_instrumentation() -> Instrumentation:
+    """計測を有効にします。有効にした後に作成したインスタンスから計測されます。"""
+    global _instrumentation
+    if not isinstance(_instrumentation, Instrumentation):
+        _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def enable_instrumentation_from_config(config: Config) -> None:
+    """
+    設定に応じて計測を有効にします。
+
+    instrumentation が有効な場合は SIGUSR1 でスナップショットを書き出し、
+    instrumentation_port が指定されている場合は HTTP でもスナップショットを返します。
+
+    :param config: 設定
+    """
+    if not config.instrumentation and config.instrumentation_port is None:
+        return
+    instrumentation = enable_instrumentation()
+    instrumentation.install_signal_handler()
+    if config.instrumentation_port is not None:
+        instrumentation.serve_http(config.instrumentation_port)
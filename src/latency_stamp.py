@@ -0,0 +1,146 @@
+import time
+import zlib
+from typing import Any, Optional
+
+import numpy as np
+
+from instrumentation import Histogram
+
+# バーコードのマスの並び。先頭の 2 マスは白と黒の基準で、続けて時刻 40 ビットと CRC 8 ビットを置く
+_ROWS = 3
+_COLUMNS = 17
+_TIMESTAMP_BITS = 40
+_TIMESTAMP_MASK = (1 << _TIMESTAMP_BITS) - 1
+_CELLS = 2 + _TIMESTAMP_BITS + 8
+# 白と黒の基準の差がこれより小さければ、バーコードがないとみなす
+_MIN_CONTRAST = 64
+_MIN_BLOCK_SIZE = 4
+
+
+def _block_size(height: int) -> int:
+    # 送信側で解像度を落としてもマスの数が変わらないように、1 マスの大きさは高さから決める
+    return max(_MIN_BLOCK_SIZE, height // 40)
+
+
+def _crc8(timestamp_us: int) -> int:
+    return zlib.crc32(timestamp_us.to_bytes(5, "big")) & 0xFF
+
+
+def now_us() -> int:
+    """バーコードに書き込む時刻。送信側と受信側で比べられるように time.time_ns() を使います。"""
+    return time.time_ns() // 1000
+
+
+def stamp_frame(frame: np.ndarray, timestamp_us: Optional[int] = None) -> bool:
+    """
+    フレームの左上に、時刻を表す白黒のマスのバーコードを書き込みます。
+
+    マスはコーデックで崩れにくいように、フレームの高さの 1/40 の大きさにします。
+
+    :param frame: (高さ, 幅, 3) の uint8 のフレーム。その場で書き換えます
+    :param timestamp_us: 書き込む時刻（マイクロ秒）。省略した場合は now_us() の値
+    :return: フレームが小さすぎて書き込めなかった場合は False
+    """
+    height, width = frame.shape[:2]
+    block = _block_size(height)
+    if height < _ROWS * block or width < _COLUMNS * block:
+        return False
+    value = (timestamp_us if timestamp_us is not None else now_us()) & _TIMESTAMP_MASK
+    payload = (value << 8 | _crc8(value)).to_bytes(6, "big")
+
+    cells = np.zeros(_ROWS * _COLUMNS, dtype=np.uint8)
+    cells[0] = 1
+    cells[2:_CELLS] = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+    cells *= 255
+    # マスを 1 マスの大きさと 3 チャンネルに広げた連続したバッファを作ってから、まとめて書き込む
+    shape = (_ROWS, block, _COLUMNS, block, 3)
+    pattern = np.broadcast_to(cells.reshape(_ROWS, 1, _COLUMNS, 1, 1), shape)
+    frame[: _ROWS * block, : _COLUMNS * block] = pattern.reshape(_ROWS * block, -1, 3)
+    return True
+
+
+def read_stamp(frame: np.ndarray) -> Optional[int]:
+    """
+    stamp_frame() で書き込んだ時刻を読み出します。
+
+    マスの境目はコーデックで崩れるので、マスの中央の平均を白と黒の基準の中間と比べます。
+
+    :param frame: 受信した (高さ, 幅, 3) の uint8 のフレーム
+    :return: 書き込まれた時刻の下位 40 ビット（マイクロ秒）。読み出せなかった場合は None
+    """
+    height, width = frame.shape[:2]
+    block = _block_size(height)
+    if height < _ROWS * block or width < _COLUMNS * block:
+        return None
+    # 緑は輝度に近く、色差の間引きの影響を受けにくい
+    roi = frame[: _ROWS * block, : _COLUMNS * block, 1]
+    margin = block // 4
+    cells = (
+        roi.reshape(_ROWS, block, _COLUMNS, block)[
+            :, margin : block - margin, :, margin : block - margin
+        ]
+        .mean(axis=(1, 3))
+        .reshape(-1)
+    )
+    white, black = float(cells[0]), float(cells[1])
+    if white - black < _MIN_CONTRAST:
+        return None
+    bits = cells[2:_CELLS] > (white + black) / 2
+    payload = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    value = payload >> 8
+    if payload & 0xFF != _crc8(value):
+        return None
+    return value
+
+
+class LatencyMeter:
+    """
+    受信したフレームのバーコードから、キャプチャしてから表示するまでの時間をストリームごとに記録するクラス。
+
+    時刻は time.time_ns() で比べるので、別のマシンから送信する場合は NTP などで時計を合わせます。
+    同じマシンでループバックする場合はそのまま比べられます。
+    """
+
+    def __init__(self) -> None:
+        self._histograms: dict[str, Histogram] = {}
+        # バーコードを読み出せなかったか、送信側の時計が進んでいて時間を求められなかったフレームの数
+        self.unmeasured_frames: int = 0
+
+    def measure(
+        self, stream_id: str, frame: np.ndarray, received_us: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        フレームのバーコードを読み出して、キャプチャしてからの時間を記録します。
+
+        :param stream_id: 送信元のストリーム ID
+        :param frame: 受信した (高さ, 幅, 3) の uint8 のフレーム
+        :param received_us: 表示した時刻（マイクロ秒）。省略した場合は now_us() の値
+        :return: キャプチャしてからの時間（ナノ秒）。読み出せなかった場合は None
+        """
+        if received_us is None:
+            received_us = now_us()
+        if (stamp := read_stamp(frame)) is None:
+            self.unmeasured_frames += 1
+            return None
+        # 書き込んだのは下位 40 ビットなので、差も 40 ビットで求める
+        elapsed_us = (received_us - stamp) & _TIMESTAMP_MASK
+        if elapsed_us > _TIMESTAMP_MASK >> 1:
+            # 送信側の時計が進んでいて差が負になった場合
+            self.unmeasured_frames += 1
+            return None
+        latency_ns = elapsed_us * 1000
+        if (histogram := self._histograms.get(stream_id)) is None:
+            histogram = self._histograms.setdefault(stream_id, Histogram())
+        histogram.record(latency_ns)
+        return latency_ns
+
+    def snapshot(self, percentiles: tuple[float, ...] = (50, 99)) -> dict[str, dict[str, Any]]:
+        """
+        ストリームごとのキャプチャから表示までの時間の統計を返します。
+
+        :param percentiles: 求めるパーセンタイル
+        """
+        return {
+            stream_id: histogram.snapshot(percentiles=percentiles)
+            for stream_id, histogram in list(self._histograms.items())
+        }
@@ -0,0 +1,270 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from sora_sdk import Sora, SoraAudioSource, SoraVideoSource
+
+from config import get_config
+from instrumentation import Histogram, enable_instrumentation_from_config
+from media_sendonly import Sendonly
+from stats_collector import StatsCollector
+from synthetic_media import DeadlinePacer, SyntheticAudioGenerator, SyntheticVideoGenerator
+
+
+class LoadGenerator:
+    """
+    1 つのプロセスから同じチャンネルに N 本の送信専用の接続を張る負荷試験用のクラス。
+
+    Sora インスタンスと合成映像・合成音声の生成は全接続で共有し、
+    1 つのスレッドが生成したフレームをすべての接続のソースに配ります。
+    接続時間と、接続ごとの送信ビットレートとフレームレートをヒストグラムに集計します。
+    """
+
+    def __init__(
+        self,
+        signaling_urls: list[str],
+        channel_id: str,
+        metadata: Optional[dict[str, Any]],
+        connections: int,
+        ramp_up_rate: float,
+        video_codec_types: list[str],
+        video_bit_rates: list[int],
+        video_generator: SyntheticVideoGenerator,
+        audio_generator: SyntheticAudioGenerator,
+        openh264_path: Optional[str] = None,
+        use_hwa: bool = False,
+        connect_concurrency: int = 32,
+        sora: Optional[Sora] = None,
+    ):
+        """
+        LoadGenerator インスタンスを初期化します。
+
+        :param signaling_urls: Sora シグナリング URL のリスト
+        :param channel_id: 接続するチャンネル ID
+        :param metadata: 接続のためのオプションのメタデータ
+        :param connections: 張る接続の数
+        :param ramp_up_rate: 1 秒あたりに開始する接続の数
+        :param video_codec_types: 接続ごとに順番に割り当てるビデオコーデックの種類
+        :param video_bit_rates: 接続ごとに順番に割り当てるビデオのビットレート
+        :param video_generator: 全接続で共有する合成映像
+        :param audio_generator: 全接続で共有する合成音声
+        :param openh264_path: OpenH264 ライブラリへのパス
+        :param use_hwa: ハードウェアエンコーダーを利用するかどうか
+        :param connect_concurrency: 同時に接続処理を行う数と、統計情報を同時に取得する数の上限
+        :param sora: 全接続で共有する Sora インスタンス。省略した場合は新しく作成します
+        """
+        self._signaling_urls: list[str] = signaling_urls
+        self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._connections: int = connections
+        self._ramp_up_rate: float = ramp_up_rate
+        self._video_codec_types: list[str] = video_codec_types
+        self._video_bit_rates: list[int] = video_bit_rates
+        self._video_generator = video_generator
+        self._audio_generator = audio_generator
+        self._connect_concurrency: int = connect_concurrency
+
+        self._sora = sora or Sora(openh264=openh264_path, use_hardware_encoder=use_hwa)
+
+        self._lock = threading.Lock()
+        self._sendonlys: list[Sendonly] = []
+        self._stats_collectors: list[StatsCollector] = []
+        # 合成メディアを配る先。接続処理中のソースも含む
+        self._video_sources: tuple[SoraVideoSource, ...] = ()
+        self._audio_sources: tuple[SoraAudioSource, ...] = ()
+        self._failed: int = 0
+
+        self._connect_time = Histogram()
+        self._stop = threading.Event()
+
+    def run(self, duration_s: float, report_interval_s: float = 5.0) -> None:
+        """
+        接続を順に開始し、duration_s 秒経過したらすべて切断します。
+
+        :param duration_s: 負荷をかける時間（秒）
+        :param report_interval_s: 集計結果を出力する間隔（秒）
+        """
+        pump_threads = [
+            threading.Thread(target=self._pump_video, daemon=True),
+            threading.Thread(target=self._pump_audio, daemon=True),
+        ]
+        for thread in pump_threads:
+            thread.start()
+
+        started_at = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=self._connect_concurrency)
+        ramp_up_thread = threading.Thread(target=self._ramp_up, args=(executor,), daemon=True)
+        ramp_up_thread.start()
+        try:
+            report_pacer = DeadlinePacer(1 / report_interval_s)
+            while report_pacer.wait(self._stop):
+                print(json.dumps(self.report(time.monotonic() - started_at)), flush=True)
+                if time.monotonic() - started_at >= duration_s:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop.set()
+            # shutdown() の後に submit() すると RuntimeError になるので、先に接続の開始を止める
+            ramp_up_thread.join()
+            executor.shutdown(wait=True, cancel_futures=True)
+            with self._lock:
+                sendonlys = list(self._sendonlys)
+            for sendonly in sendonlys:
+                sendonly.disconnect()
+            for thread in pump_threads:
+                thread.join(timeout=10)
+            print(json.dumps(self.report(time.monotonic() - started_at)), flush=True)
+
+    def report(self, elapsed_s: float) -> dict[str, Any]:
+        """
+        現在の集計結果を返します。
+
+        送信ビットレートとフレームレートは、呼び出した時点の接続ごとの値の分布です。
+        接続が多くても時間がかからないように、統計情報は connect_concurrency 並列で取得します。
+        """
+        with self._lock:
+            stats_collectors = list(self._stats_collectors)
+            connected = sum(1 for sendonly in self._sendonlys if sendonly.connected)
+            failed = self._failed
+
+        with ThreadPoolExecutor(max_workers=self._connect_concurrency) as executor:
+            sampled = list(executor.map(StatsCollector.sample, stats_collectors))
+
+        bitrate = Histogram()
+        fps = Histogram()
+        for stats_collector, success in zip(stats_collectors, sampled):
+            if not success:
+                continue
+            latest = stats_collector.latest()
+            if not math.isnan(latest["outbound_bitrate_bps"]):
+                bitrate.record(int(latest["outbound_bitrate_bps"]))
+            if not math.isnan(latest["outbound_fps"]):
+                fps.record(int(latest["outbound_fps"]))
+
+        return {
+            "elapsed_s": round(elapsed_s, 3),
+            "connected": connected,
+            "failed": failed,
+            "connect_time": self._connect_time.snapshot(unit="ns"),
+            "outbound_bitrate": bitrate.snapshot(unit="bps"),
+            "outbound_fps": fps.snapshot(unit="fps"),
+        }
+
+    def _ramp_up(self, executor: ThreadPoolExecutor) -> None:
+        pacer = DeadlinePacer(self._ramp_up_rate)
+        for index in range(self._connections):
+            if not pacer.wait(self._stop):
+                break
+            executor.submit(self._connect, index)
+
+    def _connect(self, index: int) -> None:
+        if self._stop.is_set():
+            return
+        sendonly: Optional[Sendonly] = None
+        try:
+            sendonly = Sendonly(
+                self._signaling_urls,
+                self._channel_id,
+                metadata=self._metadata,
+                video_codec_type=self._video_codec_types[index % len(self._video_codec_types)],
+                video_bit_rate=self._video_bit_rates[index % len(self._video_bit_rates)],
+                audio_channels=self._audio_generator.channels,
+                audio_sample_rate=self._audio_generator.sample_rate,
+                sora=self._sora,
+            )
+            # ネゴシエーション中もフレームが届くように、接続前から配る
+            with self._lock:
+                self._video_sources += (sendonly.video_source,)
+                self._audio_sources += (sendonly.audio_source,)
+            started_ns = time.perf_counter_ns()
+            sendonly.connect()
+        except Exception as e:
+            # Future に例外が残ったまま捨てられないように、接続できなかった理由を出力する
+            if not isinstance(e, AssertionError):
+                print(f"Failed to connect: index={index} error={e!r}")
+            with self._lock:
+                self._failed += 1
+                if sendonly is not None:
+                    video_source, audio_source = sendonly.video_source, sendonly.audio_source
+                    self._video_sources = tuple(
+                        source for source in self._video_sources if source is not video_source
+                    )
+                    self._audio_sources = tuple(
+                        source for source in self._audio_sources if source is not audio_source
+                    )
+            return
+        connect_time_ns = time.perf_counter_ns() - started_ns
+
+        with self._lock:
+            self._connect_time.record(connect_time_ns)
+            self._sendonlys.append(sendonly)
+            self._stats_collectors.append(StatsCollector(sendonly.get_raw_stats, capacity=2))
+        if self._stop.is_set():
+            sendonly.disconnect()
+
+    def _pump_video(self) -> None:
+        pacer = DeadlinePacer(self._video_generator.fps)
+        while pacer.wait(self._stop):
+            frame = self._video_generator.next_frame()
+            for video_source in self._video_sources:
+                video_source.on_captured(frame)
+
+    def _pump_audio(self) -> None:
+        pacer = DeadlinePacer(1000 / self._audio_generator.chunk_ms)
+        while pacer.wait(self._stop):
+            chunk = self._audio_generator.next_chunk()
+            for audio_source in self._audio_sources:
+                audio_source.on_data(chunk)
+
+
+def load_generator() -> None:
+    """
+    設定を使用して LoadGenerator インスタンスを設定し実行します。
+
+    設定ファイルに streams がある場合は、各ストリームの video_codec_type と video_bit_rate を
+    接続ごとに順番に割り当てます。
+
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
+    """
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
+
+    video_codec_types = config.load_video_codec_types
+    video_bit_rates = config.load_video_bit_rates
+    if config.streams:
+        streams = [config.stream(name) for name in config.streams]
+        video_codec_types = [stream.video_codec_type for stream in streams]
+        video_bit_rates = [stream.video_bit_rate for stream in streams]
+
+    video_generator = SyntheticVideoGenerator(
+        width=config.video_width or 320,
+        height=config.video_height or 240,
+        fps=config.video_fps,
+        pattern=config.load_video_pattern,
+    )
+    audio_generator = SyntheticAudioGenerator(pattern=config.load_audio_pattern)
+
+    generator = LoadGenerator(
+        config.signaling_urls,
+        config.channel_id,
+        config.metadata,
+        connections=config.load_connections,
+        ramp_up_rate=config.load_ramp_up_rate,
+        video_codec_types=video_codec_types,
+        video_bit_rates=video_bit_rates,
+        video_generator=video_generator,
+        audio_generator=audio_generator,
+        openh264_path=config.openh264_path,
+        use_hwa=config.use_hwa,
+        connect_concurrency=config.load_connect_concurrency,
+    )
+    generator.run(config.load_duration_s, config.load_report_interval_s)
+
+
+if __name__ == "__main__":
+    load_generator()
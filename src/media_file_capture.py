@@ -0,0 +1,230 @@
+import queue
+import threading
+import time
+from typing import Optional
+
+import cv2  # type: ignore
+import numpy as np
+from sora_sdk import SoraAudioSource
+
+
+class MediaFileCapture:
+    """
+    メディアファイルやネットワーク上のストリーム (RTSP など) を再生するキャプチャ。
+
+    cv2.VideoCapture と同じ read() / isOpened() / release() を持つので、
+    Sendonly の video_capture としてカメラの代わりに渡せます。
+
+    デコードは別スレッドで先読みして上限付きのキューに貯め、
+    read() はフレームのタイムスタンプ (PTS) に合わせて返します。
+    PyAV (av パッケージ) がインストールされていれば、
+    同じファイルの音声も SoraAudioSource に送れます。
+    音声は最初の read() から送り始め、映像と同じ再生開始時刻を基準に音声の PTS に合わせて送ります。
+    """
+
+    def __init__(
+        self,
+        source: str,
+        loop: bool = True,
+        buffer_frames: int = 30,
+        max_lag_s: float = 0.5,
+    ):
+        """
+        MediaFileCapture インスタンスを初期化し、デコードを開始します。
+
+        :param source: ファイルのパスか URL
+        :param loop: 最後まで再生したら先頭に戻るかどうか
+        :param buffer_frames: 先読みしておくフレーム数の上限
+        :param max_lag_s: これ以上遅れたら再生位置を今に合わせ直す遅れ（秒）
+        """
+        self._source: str = source
+        self._loop: bool = loop
+        self._max_lag_s: float = max_lag_s
+        self._is_network: bool = "://" in source
+
+        self._video_capture = cv2.VideoCapture(source)
+        if not self._video_capture.isOpened():
+            raise ValueError(f"{source} を開けませんでした")
+        fps = self._video_capture.get(cv2.CAP_PROP_FPS)
+        self._frame_interval_s: float = 1 / fps if fps > 0 else 1 / 30
+
+        # 要素は (再生開始からの PTS 秒, フレーム)。None は再生の終わり
+        self._queue: queue.Queue[Optional[tuple[float, np.ndarray]]] = queue.Queue(buffer_frames)
+        # PTS 0 に対応する perf_counter の値。映像と音声で共有する
+        self._origin: Optional[float] = None
+        self._origin_lock = threading.Lock()
+        # 最初の read() で set する。音声はそれまで送らない
+        self._playing = threading.Event()
+        self._opened: bool = True
+        self._stopped = threading.Event()
+
+        self._decode_thread = threading.Thread(target=self._decode_video, daemon=True)
+        self._decode_thread.start()
+        self._audio_thread: Optional[threading.Thread] = None
+
+    def isOpened(self) -> bool:  # noqa: N802 cv2.VideoCapture に合わせる
+        return self._opened
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        """
+        次のフレームを、その PTS になるまで待ってから返します。
+
+        :return: cv2.VideoCapture.read() と同じく (成功したかどうか, フレーム)
+        """
+        try:
+            item = self._queue.get(timeout=1)
+        except queue.Empty:
+            return False, None
+        if item is None:
+            self._opened = False
+            return False, None
+
+        pts_s, frame = item
+        self._pace(pts_s)
+        self._playing.set()
+        return True, frame
+
+    def release(self) -> None:
+        """デコードを止めてファイルを閉じます。"""
+        self._stopped.set()
+        self._opened = False
+        # デコードスレッドがキューの空きを待っていれば解放する
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._decode_thread.join(timeout=10)
+        if self._audio_thread is not None:
+            self._audio_thread.join(timeout=10)
+
+    def start_audio(self, audio_source: SoraAudioSource, sample_rate: int, channels: int) -> bool:
+        """
+        同じファイルの音声を 10 ms ずつ audio_source に送り始めます。
+
+        :param audio_source: 音声を送る SoraAudioSource
+        :param sample_rate: audio_source のサンプリングレート
+        :param channels: audio_source のチャンネル数
+        :return: 音声を送り始めた場合は True。PyAV がない場合や音声がない場合は False
+        """
+        try:
+            import av  # type: ignore
+        except ImportError:
+            print("PyAV (av) がインストールされていないため、ファイルの音声は送信しません")
+            return False
+
+        container = av.open(self._source)
+        if not container.streams.audio:
+            container.close()
+            return False
+
+        self._audio_thread = threading.Thread(
+            target=self._decode_audio,
+            args=(av, container, audio_source, sample_rate, channels),
+            daemon=True,
+        )
+        self._audio_thread.start()
+        return True
+
+    def _pace(self, pts_s: float) -> bool:
+        """
+        再生開始時刻から pts_s 秒後まで待ちます。
+
+        再生開始時刻は最初に呼ばれたときに決め、映像と音声で共有します。
+
+        :param pts_s: 再生開始からの PTS（秒）
+        :return: release() で打ち切られた場合は False
+        """
+        with self._origin_lock:
+            now = time.perf_counter()
+            if self._origin is None:
+                self._origin = now - pts_s
+            delay_s = self._origin + pts_s - now
+            if -delay_s > self._max_lag_s:
+                # 送信側が詰まって大きく遅れたら、まとめて送らずに今から再生し直す
+                self._origin = now - pts_s
+        if delay_s > 0:
+            return not self._stopped.wait(delay_s)
+        return not self._stopped.is_set()
+
+    def _put(self, item: Optional[tuple[float, np.ndarray]]) -> bool:
+        # キューが空くまで待つが、release() されたら諦める
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode_video(self) -> None:
+        # ループした回数に応じて PTS に足す値
+        offset_s = 0.0
+        last_pts_s = 0.0
+        frames_in_loop = 0
+        while not self._stopped.is_set():
+            success, frame = self._video_capture.read()
+            if not success:
+                if not self._loop or frames_in_loop == 0:
+                    self._put(None)
+                    break
+                offset_s = last_pts_s + self._frame_interval_s
+                frames_in_loop = 0
+                if self._is_network:
+                    # ネットワークのストリームは途切れたら開き直す
+                    self._video_capture.release()
+                    self._video_capture = cv2.VideoCapture(self._source)
+                else:
+                    self._video_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+
+            pts_s = self._video_capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if pts_s <= 0 and frames_in_loop > 0:
+                # PTS が取れないバックエンドではフレームレートから求める
+                pts_s = frames_in_loop * self._frame_interval_s
+            last_pts_s = offset_s + pts_s
+            frames_in_loop += 1
+            if not self._put((last_pts_s, frame)):
+                break
+        self._video_capture.release()
+
+    def _decode_audio(
+        self, av, container, audio_source: SoraAudioSource, sample_rate: int, channels: int
+    ) -> None:
+        resampler = av.AudioResampler(
+            format="s16", layout="mono" if channels == 1 else "stereo", rate=sample_rate
+        )
+        samples_per_chunk = sample_rate // 100
+        # デコード結果を貯めておくバッファ。10 ms ずつ取り出す
+        pending = np.zeros((sample_rate, channels), dtype=np.int16)
+        pending_samples = 0
+        # 送った音声のサンプル数。ループしても数え続け、音声の PTS にする
+        sent_samples = 0
+        try:
+            # start_audio() は接続前に呼ばれるので、映像の再生が始まるまで送らない
+            while not self._playing.wait(0.1):
+                if self._stopped.is_set():
+                    return
+            while not self._stopped.is_set():
+                for decoded in container.decode(audio=0):
+                    for resampled in resampler.resample(decoded):
+                        # s16 はインターリーブされているので (サンプル数, チャンネル数) にする
+                        data = resampled.to_ndarray().reshape(-1, channels)
+                        if pending_samples + len(data) > len(pending):
+                            pending = np.resize(pending, (pending_samples + len(data), channels))
+                        pending[pending_samples : pending_samples + len(data)] = data
+                        pending_samples += len(data)
+
+                        offset = 0
+                        while pending_samples - offset >= samples_per_chunk:
+                            if not self._pace(sent_samples / sample_rate):
+                                return
+                            chunk = pending[offset : offset + samples_per_chunk]
+                            audio_source.on_data(chunk)
+                            offset += samples_per_chunk
+                            sent_samples += samples_per_chunk
+                        # 送りきれなかった端数を先頭に詰める
+                        pending[: pending_samples - offset] = pending[offset:pending_samples]
+                        pending_samples -= offset
+                if not self._loop:
+                    break
+                container.seek(0)
+        finally:
+            container.close()
@@ -1,26 +1,77 @@
-import json
-import os
+import contextlib
 import queue
-from threading import Event
-from typing import Any, Optional
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, NamedTuple, Optional
 
-import cv2  # type: ignore
-import sounddevice  # type: ignore
-from dotenv import load_dotenv
 from numpy import ndarray
 from sora_sdk import (
     Sora,
     SoraAudioSink,
     SoraConnection,
     SoraMediaTrack,
-    SoraSignalingErrorCode,
     SoraVideoFrame,
     SoraVideoSink,
 )
 
+import startup_timing
+from audio_mixer import AudioMixer
+from config import DROP_POLICIES, get_config
+from connection_manager import ConnectionManager, SinkClasses
+from frame_bus import FrameBus
+from instrumentation import enable_instrumentation_from_config
+from latency_stamp import LatencyMeter
+from signaling_url_selector import SignalingUrlSelector
+from stats_collector import StatsCollector
 
-class Recvonly:
-    """Sora からビデオと音声ストリームを受信するためのクラス。"""
+if TYPE_CHECKING:
+    import sounddevice  # type: ignore
+
+
+class TrackFrame(NamedTuple):
+    """受信したビデオフレームと、その送信元のストリームとトラック。"""
+
+    stream_id: str
+    track_id: str
+    frame: SoraVideoFrame
+    # 受信したときの time.monotonic_ns() の値
+    received_ns: int
+
+
+class _VideoTrack:
+    """受信中のビデオトラックと、そのシンクとフレームレートの制限。"""
+
+    def __init__(self, track: SoraMediaTrack, sink: SoraVideoSink, fps_limit: Optional[float]):
+        self.track = track
+        self.sink = sink
+        self.min_interval_ns: int = 0
+        self.next_frame_ns: int = 0
+        self.set_fps_limit(fps_limit)
+
+    def set_fps_limit(self, fps_limit: Optional[float]) -> None:
+        self.min_interval_ns = int(1e9 / fps_limit) if fps_limit else 0
+
+    def accept(self, now_ns: int) -> bool:
+        """制限したフレームレートに収まるフレームであれば True を返します。"""
+        if now_ns < self.next_frame_ns:
+            return False
+        # 受け取る間隔が揺らいでも平均が制限に近づくように、前回の予定時刻から進める
+        if now_ns - self.next_frame_ns < self.min_interval_ns:
+            self.next_frame_ns += self.min_interval_ns
+        else:
+            self.next_frame_ns = now_ns + self.min_interval_ns
+        return True
+
+
+class Recvonly(ConnectionManager):
+    """
+    Sora からビデオと音声ストリームを受信するためのクラス。
+
+    受信したトラックごとにシンクを作成し、トラック ID で管理します。
+    ビデオのフレームは送信元のストリーム ID とトラック ID を添えてキューに入れます。
+    ストリームごとにフレームレートを制限でき、制限を超えたフレームは
+    SoraVideoFrame.data() で ndarray にする前に捨てます。
+    """
 
     def __init__(
         self,
@@ -32,6 +83,16 @@ class Recvonly:
         use_hwa: Optional[bool] = False,
         output_frequency: int = 16000,
         output_channels: int = 1,
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        video_queue_size: int = 0,
+        drop_policy: str = "drop_oldest",
+        sora: Optional[Sora] = None,
+        video_fps_limit: Optional[float] = None,
+        frame_bus: Optional[FrameBus] = None,
+        latency_stamp: bool = False,
+        sink_classes: Optional[SinkClasses] = None,
+        audio: bool = True,
     ):
         """
         Recvonly インスタンスを初期化します。
@@ -45,137 +106,240 @@ class Recvonly:
         :param openh264: OpenH264 ライブラリへのパス
         :param output_frequency: 音声出力周波数（Hz）、デフォルトは 16000
         :param output_channels: 音声出力チャンネル数、デフォルトは 1
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param video_queue_size: 表示待ちのフレームを貯めるキューの大きさ。0 の場合は上限なし
+        :param drop_policy: キューが一杯のときに古いフレームと新しいフレームのどちらを捨てるか。
+            "drop_oldest" か "drop_newest"
+        :param sora: 利用する Sora インスタンス。省略した場合は新しく作成します
+        :param video_fps_limit: ストリームごとに受け取るフレームレートの上限の既定値。
+            省略した場合は制限しません。set_video_fps_limit() でストリームごとに変更できます
+        :param frame_bus: 受信したフレームを別のプロセスに配る FrameBus。
+            指定した場合は、フレームレートの制限を通ったフレームを書き込みます
+        :param latency_stamp: 送信側の Sendonly が書き込んだバーコードを読み出し、
+            キャプチャしてから表示するまでの時間を latency_meter に記録するかどうか
+        :param sink_classes: 受信に使うシンクのクラス。FakeSora の場合は FAKE_SINK_CLASSES
+        :param audio: 音声ストリームを受信するかどうか。
+            False の場合は音声のシンクを作らず、再生もしません
         """
-        self._signaling_urls: list[str] = signaling_urls
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy は {DROP_POLICIES} のいずれかを指定してください")
+        if video_fps_limit is not None and video_fps_limit <= 0:
+            raise ValueError("video_fps_limit には正の値を指定してください")
+        super().__init__(
+            sora or Sora(openh264=openh264_path, use_hardware_encoder=use_hwa),
+            signaling_urls,
+            reconnect=reconnect,
+            url_selector=url_selector,
+            sink_classes=sink_classes,
+        )
         self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._data_channel_signaling: Optional[bool] = data_channel_signaling
+        self._audio: bool = audio
 
         self._output_frequency: int = output_frequency
         self._output_channels: int = output_channels
 
-        self._sora: Sora = Sora(openh264=openh264_path, use_hardware_encoder=use_hwa)
-        self._connection: SoraConnection = self._sora.create_connection(
+        # トラック ID ごとのシンク。on_track と notify のスレッドから更新する
+        self._tracks_lock = threading.Lock()
+        self._audio_tracks: dict[str, tuple[SoraMediaTrack, SoraAudioSink]] = {}
+        self._video_tracks: dict[str, _VideoTrack] = {}
+        self._video_fps_limit: Optional[float] = video_fps_limit
+        self._frame_bus: Optional[FrameBus] = frame_bus
+        # 音声はすべてのトラックを混ぜて再生する
+        self._audio_mixer = AudioMixer(output_frequency, output_channels)
+        self._stream_fps_limits: dict[str, Optional[float]] = {}
+        self._latency_meter: Optional[LatencyMeter] = LatencyMeter() if latency_stamp else None
+
+        self._q_out: queue.Queue = queue.Queue(video_queue_size)
+        self._drop_policy: str = drop_policy
+        # キューが一杯で捨てたフレームの数
+        self.dropped_frames: int = 0
+        # フレームレートの制限で捨てたフレームの数
+        self.decimated_frames: int = 0
+
+        # トラックを受信したときと、送信元が切断してトラックがなくなったときに呼ばれるコールバック
+        self.on_track_added: Optional[Callable[[SoraMediaTrack], None]] = None
+        self.on_track_removed: Optional[Callable[[SoraMediaTrack], None]] = None
+
+        self._notify_dispatcher.on("connection.destroyed", self._on_connection_destroyed)
+
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        # 再接続するとトラックは新しい接続で届き直すので、前の接続のトラックは外す
+        self._remove_tracks(lambda track: True)
+        connection = self._sora.create_connection(
             signaling_urls=signaling_urls,
             role="recvonly",
-            channel_id=channel_id,
-            metadata=metadata,
-            data_channel_signaling=data_channel_signaling,
+            channel_id=self._channel_id,
+            metadata=self._metadata,
+            audio=self._audio,
+            data_channel_signaling=self._data_channel_signaling,
         )
-        self._connection_id: Optional[str] = None
-
-        self._connected: Event = Event()
-        self._switched: bool = False
-        self._closed: Event = Event()
-        self._default_connection_timeout_s: float = 10.0
-
-        self._audio_sink: Optional[SoraAudioSink] = None
-        self._video_sink: Optional[SoraVideoSink] = None
-
-        self._q_out: queue.Queue = queue.Queue()
-
-        self._connection.on_set_offer = self._on_set_offer
-        self._connection.on_switched = self._on_switched
-        self._connection.on_notify = self._on_notify
-        self._connection.on_disconnect = self._on_disconnect
-        self._connection.on_track = self._on_track
-
-    def connect(self) -> None:
-        """
-        Sora への接続を確立します。
-
-        :raises AssertionError: タイムアウト期間内に接続が確立できなかった場合
-        """
-        self._connection.connect()
+        connection.on_track = self._on_track
+        return connection
 
-        assert self._connected.wait(
-            self._default_connection_timeout_s
-        ), "Could not connect to Sora."
-
-    def disconnect(self) -> None:
-        """Sora から切断します。"""
-        self._connection.disconnect()
-
-    def get_stats(self):
-        raw_stats = self._connection.get_stats()
-        return json.loads(raw_stats)
+    @property
+    def tracks(self) -> list[SoraMediaTrack]:
+        """受信中のトラック。"""
+        with self._tracks_lock:
+            return [video.track for video in self._video_tracks.values()] + [
+                track for track, _ in self._audio_tracks.values()
+            ]
 
     @property
-    def connected(self) -> bool:
-        return self._connected.is_set()
+    def audio_sinks(self) -> dict[str, SoraAudioSink]:
+        """受信中の音声トラックのトラック ID ごとの SoraAudioSink。"""
+        with self._tracks_lock:
+            return {track_id: sink for track_id, (_, sink) in self._audio_tracks.items()}
 
     @property
-    def switched(self) -> bool:
-        """データチャネルシグナリングへの切り替えが完了しているかどうかを示すブール値。"""
-        return self._switched
+    def audio_mixer(self) -> AudioMixer:
+        """受信中の音声トラックを混ぜる AudioMixer。トラックごとのゲインを変更できます。"""
+        return self._audio_mixer
 
     @property
-    def closed(self):
-        """接続が閉じられているかどうかを示すブール値。"""
-        return self._closed.is_set()
+    def latency_meter(self) -> Optional[LatencyMeter]:
+        """キャプチャから表示までの時間の LatencyMeter。latency_stamp が False なら None。"""
+        return self._latency_meter
 
-    def _on_set_offer(self, raw_message: str) -> None:
+    def set_video_fps_limit(self, stream_id: str, fps_limit: Optional[float]) -> None:
         """
-        オファー設定イベントを処理します。
+        ストリームから受け取るフレームレートの上限を変更します。
 
-        :param raw_message: オファーを含む生のメッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        if message["type"] == "offer":
-            self._connection_id = message["connection_id"]
+        受信中のトラックと、このあと届くトラックの両方に適用します。
 
-    def _on_switched(self, raw_message: str) -> None:
-        message = json.loads(raw_message)
-        if message["type"] == "switched":
-            print(f"Switched to DataChannel Signaling: connection_id={self._connection_id}")
-            self._switched = True
+        :param stream_id: 送信元のストリーム ID
+        :param fps_limit: フレームレートの上限。None の場合は制限しません
+        """
+        if fps_limit is not None and fps_limit <= 0:
+            raise ValueError("fps_limit には正の値を指定してください")
+        with self._tracks_lock:
+            self._stream_fps_limits[stream_id] = fps_limit
+            for video in self._video_tracks.values():
+                if video.track.stream_id == stream_id:
+                    video.set_fps_limit(fps_limit)
+
+    def _on_video_frame(self, video: _VideoTrack, frame: SoraVideoFrame) -> None:
+        """
+        受信したビデオフレームを処理します。
 
-    def _on_notify(self, raw_message: str) -> None:
+        :param video: フレームを受信したトラック
+        :param frame: 受信したビデオフレーム
         """
-        Sora からの通知イベントを処理します。
+        received_ns = time.monotonic_ns()
+        if not video.accept(received_ns):
+            self.decimated_frames += 1
+            return
+        if self._frame_bus is not None:
+            started_ns = self._instrumentation.now()
+            self._frame_bus.publish(frame.data(), video.track.stream_id, received_ns)
+            self._instrumentation.record("recvonly.frame_bus", started_ns)
+        # 受信スレッドからメインスレッドで取り出されるまでの待ち時間を計測できるように、時刻を添える
+        item = (
+            self._instrumentation.now(),
+            TrackFrame(video.track.stream_id, video.track.id, frame, received_ns),
+        )
+        try:
+            self._q_out.put_nowait(item)
+            return
+        except queue.Full:
+            self.dropped_frames += 1
+            if self._drop_policy == "drop_newest":
+                return
+        # 表示が追いつかない場合は古いフレームを捨てて、受信スレッドを止めない
+        try:
+            self._q_out.get_nowait()
+            self._q_out.put_nowait(item)
+        except (queue.Empty, queue.Full):
+            pass
 
-        :param raw_message: 生の通知メッセージ
+    def _on_track(self, track: SoraMediaTrack) -> None:
         """
-        message: dict[str, Any] = json.loads(raw_message)
-        if (
-            message["type"] == "notify"
-            and message["event_type"] == "connection.created"
-            and message["connection_id"] == self._connection_id
-        ):
-            print(f"Connected Sora: connection_id={self._connection_id}")
-            self._connected.set()
+        新しいメディアトラックを処理します。
 
-    def _on_disconnect(self, error_code: SoraSignalingErrorCode, message: str) -> None:
+        :param track: 新しいメディアトラック
+        """
+        if track.kind == "audio":
+            if not self._audio:
+                return
+            sink = self._sink_classes.audio_sink(
+                track, self._output_frequency, self._output_channels
+            )
+            with self._tracks_lock:
+                self._audio_tracks[track.id] = (track, sink)
+            self._audio_mixer.add_track(track.id, sink)
+        elif track.kind == "video":
+            with self._tracks_lock:
+                fps_limit = self._stream_fps_limits.get(track.stream_id, self._video_fps_limit)
+                video = _VideoTrack(track, self._sink_classes.video_sink(track), fps_limit)
+                self._video_tracks[track.id] = video
+            video.sink.on_frame = lambda frame: self._on_video_frame(video, frame)
+        else:
+            return
+        if self.on_track_added is not None:
+            self.on_track_added(track)
+
+    def _on_connection_destroyed(self, message: dict[str, Any]) -> None:
         """
-        切断イベントを処理します。
+        connection.destroyed の通知を処理します。
 
-        :param error_code: 切断のエラーコード
-        :param message: 切断メッセージ
+        :param message: パース済みの通知メッセージ
         """
-        print(f"Disconnected Sora: error_code='{error_code}' message='{message}'")
-        self._connected.clear()
-        self._closed.is_set()
+        # トラックのストリーム ID は送信元の connection_id
+        connection_id = message.get("connection_id")
+        self._remove_tracks(lambda track: track.stream_id == connection_id)
 
-    def _on_video_frame(self, frame: SoraVideoFrame) -> None:
+    def _remove_tracks(self, predicate: Callable[[SoraMediaTrack], bool]) -> None:
         """
-        受信したビデオフレームを処理します。
+        条件に合うトラックのシンクを外し、on_track_removed を呼びます。
 
-        :param frame: 受信したビデオフレーム
+        :param predicate: 外すトラックであれば True を返す関数
         """
-        self._q_out.put(frame)
+        removed = []
+        with self._tracks_lock:
+            for track_id, video in list(self._video_tracks.items()):
+                if predicate(video.track):
+                    # 外したあとに届いたフレームはキューに入れない
+                    video.sink.on_frame = None
+                    del self._video_tracks[track_id]
+                    removed.append(video.track)
+            for track_id, (track, _) in list(self._audio_tracks.items()):
+                if predicate(track):
+                    del self._audio_tracks[track_id]
+                    self._audio_mixer.remove_track(track_id)
+                    removed.append(track)
+        if self.on_track_removed is not None:
+            for track in removed:
+                self.on_track_removed(track)
+
+    def get_track_frame(self, timeout: float) -> Optional[TrackFrame]:
+        """
+        表示待ちのキューから、送信元のストリームとトラックを添えたフレームを 1 つ取り出します。
 
-    def _on_track(self, track: SoraMediaTrack) -> None:
+        :param timeout: フレームが届くまで待つ時間（秒）
+        :return: 受信したフレーム。届かなかった場合は None
         """
-        新しいメディアトラックを処理します。
+        try:
+            enqueued_ns, item = self._q_out.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._instrumentation.record("recvonly.queue_wait", enqueued_ns)
+        return item
+
+    def get_video_frame(self, timeout: float) -> Optional[SoraVideoFrame]:
+        """
+        表示待ちのキューからフレームを 1 つ取り出します。
 
-        :param track: 新しいメディアトラック
+        :param timeout: フレームが届くまで待つ時間（秒）
+        :return: 受信したフレーム。届かなかった場合は None
         """
-        if track.kind == "audio":
-            self._audio_sink = SoraAudioSink(track, self._output_frequency, self._output_channels)
-        if track.kind == "video":
-            self._video_sink = SoraVideoSink(track)
-            self._video_sink.on_frame = self._on_video_frame
+        if (item := self.get_track_frame(timeout)) is None:
+            return None
+        return item.frame
 
     def _callback(
-        self, outdata: ndarray, frames: int, time: Any, status: sounddevice.CallbackFlags
+        self, outdata: ndarray, frames: int, time: Any, status: "sounddevice.CallbackFlags"
     ) -> None:
         """
         音声出力のためのコールバック関数。
@@ -185,67 +349,104 @@ class Recvonly:
         :param time: タイミング情報（未使用）
         :param status: ストリームのステータス
         """
-        if self._audio_sink is not None:
-            success, data = self._audio_sink.read(frames)
-            if success:
-                if data.shape[0] != frames:
-                    print("Audio data is insufficient: ", data.shape, frames)
-                outdata[:] = data
-            else:
-                print("Unable to obtain audio data")
+        started_ns = self._instrumentation.now()
+        # 混合スレッドが混ぜておいた音声をコピーするだけにする
+        self._audio_mixer.read_into(outdata)
+        self._instrumentation.record("recvonly.audio_callback", started_ns)
 
     def run(self) -> None:
         """ビデオフレームの受信と表示、および音声の再生を行うメインループ。"""
-        with sounddevice.OutputStream(
-            channels=self._output_channels,
-            callback=self._callback,
-            samplerate=self._output_frequency,
-            dtype="int16",
-        ):
+        # 表示と再生に使うライブラリは実行するときに読み込む
+        import cv2  # type: ignore
+
+        output_stream: ContextManager = contextlib.nullcontext()
+        # 音声を受信しない場合はスピーカーを開かない
+        if self._audio:
+            import sounddevice  # type: ignore
+
+            self._audio_mixer.start()
+            output_stream = sounddevice.OutputStream(
+                channels=self._output_channels,
+                callback=self._callback,
+                samplerate=self._output_frequency,
+                dtype="int16",
+            )
+        with output_stream:
             self.connect()
+            instrumentation = self._instrumentation
+            latency_meter = self._latency_meter
+            # ストリームごとにウィンドウを開き、送信元が切断したら閉じる
+            windows: set[str] = set()
             try:
-                while self._connected.is_set():
-                    try:
-                        frame = self._q_out.get(timeout=1)
-                    except queue.Empty:
+                while not self._closed.is_set():
+                    item = self.get_track_frame(timeout=1)
+                    streams = {track.stream_id for track in self.tracks}
+                    for stream_id in windows - streams:
+                        cv2.destroyWindow(stream_id)
+                    windows &= streams
+                    if item is None or item.stream_id not in streams:
                         continue
-                    cv2.imshow("frame", frame.data())
-                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                    started_ns = instrumentation.now()
+                    data = item.frame.data()
+                    cv2.imshow(item.stream_id, data)
+                    windows.add(item.stream_id)
+                    key = cv2.waitKey(1)
+                    instrumentation.record("recvonly.render", started_ns)
+                    # 表示し終えた時刻で、送信側がキャプチャしてからの時間を求める
+                    if latency_meter is not None:
+                        latency_ns = latency_meter.measure(item.stream_id, data)
+                        if latency_ns is not None:
+                            instrumentation.record_value("recvonly.glass_to_glass", latency_ns)
+                    startup_timing.mark("first_frame")
+                    if key & 0xFF == ord("q"):
                         break
             except KeyboardInterrupt:
                 pass
             finally:
                 self.disconnect()
                 cv2.destroyAllWindows()
+        self._audio_mixer.stop()
 
 
 def recvonly() -> None:
     """
-    環境変数を使用して Recvonly インスタンスを設定し実行します。
+    設定を使用して Recvonly インスタンスを設定し実行します。
 
-    :raises ValueError: 必要な環境変数が設定されていない場合
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
     """
-    load_dotenv()
-
-    if not (raw_signaling_urls := os.getenv("SORA_SIGNALING_URLS")):
-        raise ValueError("環境変数 SORA_SIGNALING_URLS が設定されていません")
-    signaling_urls = raw_signaling_urls.split(",")
-
-    if not (channel_id := os.getenv("SORA_CHANNEL_ID")):
-        raise ValueError("環境変数 SORA_CHANNEL_ID が設定されていません")
-
-    metadata = None
-    if raw_metadata := os.getenv("SORA_METADATA"):
-        metadata = json.loads(raw_metadata)
-
-    openh264_path = os.getenv("OPENH264_PATH")
-
-    use_hwa = bool(os.getenv("USE_HWA", "True"))
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
 
     recvonly = Recvonly(
-        signaling_urls, channel_id, metadata=metadata, openh264_path=openh264_path, use_hwa=use_hwa
+        config.signaling_urls,
+        config.channel_id,
+        metadata=config.metadata,
+        openh264_path=config.openh264_path,
+        use_hwa=config.use_hwa,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+        video_queue_size=config.recv_queue_size,
+        drop_policy=config.recv_drop_policy,
+        video_fps_limit=config.recv_video_fps_limit,
+        latency_stamp=config.latency_stamp,
     )
-    recvonly.run()
+
+    # stats_csv が指定されていれば、統計情報を定期的に取得して終了時に CSV で書き出す
+    stats_collector: Optional[StatsCollector] = None
+    if stats_csv_path := config.stats_csv:
+        stats_collector = StatsCollector(recvonly.get_raw_stats, interval_s=config.stats_interval_s)
+        stats_collector.start()
+
+    try:
+        recvonly.run()
+    finally:
+        if (latency_meter := recvonly.latency_meter) is not None:
+            print(f"Glass-to-glass latency: {latency_meter.snapshot()}")
+        if stats_collector is not None:
+            stats_collector.stop()
+            with open(stats_csv_path, "w") as f:
+                stats_collector.to_csv(f)
 
 
 if __name__ == "__main__":
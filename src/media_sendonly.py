@@ -1,24 +1,31 @@
-import json
-import os
+import contextlib
 import platform
 import threading
-import time
-from threading import Event
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, ContextManager, Optional, Union
 
 import cv2  # type: ignore
-import numpy
-import sounddevice  # type: ignore
-from dotenv import load_dotenv
 from numpy import ndarray
-from sora_sdk import (
-    Sora,
-    SoraConnection,
-    SoraSignalingErrorCode,
-)
-
-
-class Sendonly:
+from sora_sdk import Sora, SoraAudioSource, SoraConnection, SoraVideoSource
+
+import startup_timing
+from adaptive_capture import AdaptationController
+from audio_converter import AudioConverter
+from audio_ring_buffer import AudioRingBuffer
+from config import get_config
+from connection_manager import ConnectionManager
+from instrumentation import enable_instrumentation_from_config
+from latency_stamp import now_us, stamp_frame
+from media_file_capture import MediaFileCapture
+from scene_change import StaticSceneFilter
+from signaling_url_selector import SignalingUrlSelector
+from stats_collector import StatsCollector
+from synthetic_media import SyntheticAudioGenerator, SyntheticVideoGenerator
+
+if TYPE_CHECKING:
+    import sounddevice  # type: ignore
+
+
+class Sendonly(ConnectionManager):
     """
     Sora にビデオと音声ストリームを送信するためのクラス。
 
@@ -40,7 +47,16 @@ class Sendonly:
         use_hwa: bool = False,
         audio_channels: int = 1,
         audio_sample_rate: int = 16000,
-        video_capture: Optional[cv2.VideoCapture] = None,
+        video_capture: Optional[Union[cv2.VideoCapture, MediaFileCapture]] = None,
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        sora: Optional[Sora] = None,
+        adaptive: bool = False,
+        audio_device_sample_rate: Optional[int] = None,
+        audio_device_channels: Optional[int] = None,
+        static_scene_threshold: Optional[float] = None,
+        static_scene_keepalive_fps: float = 1.0,
+        latency_stamp: bool = False,
     ):
         """
         Sendonly インスタンスを初期化します。
@@ -55,140 +71,124 @@ class Sendonly:
         :param openh264_path: OpenH264 ライブラリへのパス
         :param audio_channels: 音声チャンネル数（デフォルト: 1）
         :param audio_sample_rate: 音声サンプリングレート（デフォルト: 16000）
-        :param video_capture: カメラからのビデオキャプチャ
+        :param video_capture: カメラからのビデオキャプチャ、もしくは MediaFileCapture
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param sora: 複数の接続で共有する Sora インスタンス。省略した場合は新しく作成します
+        :param adaptive: 統計情報に合わせて送信前に解像度とフレームレートを落とすかどうか
+        :param audio_device_sample_rate: マイクのサンプリングレート。省略した場合はデバイスの既定値
+        :param audio_device_channels: マイクのチャンネル数。省略した場合は audio_channels
+        :param static_scene_threshold: 映像が変化したとみなす輝度の差の平均。指定した場合は、
+            変化していない間のフレームを static_scene_keepalive_fps まで間引きます
+        :param static_scene_keepalive_fps: 映像が変化していない間に送るフレームレート
+        :param latency_stamp: フレームの左上にキャプチャした時刻のバーコードを書き込むかどうか。
+            受信側の Recvonly で latency_stamp を指定すると、表示するまでの時間を計測できます
         """
-        self._signaling_urls: list[str] = signaling_urls
+        super().__init__(
+            sora or Sora(openh264=openh264_path, use_hardware_encoder=use_hwa),
+            signaling_urls,
+            reconnect=reconnect,
+            url_selector=url_selector,
+        )
         self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._audio: Optional[bool] = audio
+        self._video: Optional[bool] = video
+        self._video_codec_type: Optional[str] = video_codec_type
+        self._video_bit_rate: Optional[int] = video_bit_rate
+        self._data_channel_signaling: Optional[bool] = data_channel_signaling
 
         self._audio_channels: int = audio_channels
         self._audio_sample_rate: int = audio_sample_rate
-
-        self._sora: Sora = Sora(openh264=openh264_path, use_hardware_encoder=use_hwa)
+        self._audio_device_sample_rate: Optional[int] = audio_device_sample_rate
+        self._audio_device_channels: int = audio_device_channels or audio_channels
 
         self._fake_audio_thread: Optional[threading.Thread] = None
         self._fake_video_thread: Optional[threading.Thread] = None
 
+        # ソースは再接続をまたいで使い回す
         self._audio_source = self._sora.create_audio_source(
             self._audio_channels, self._audio_sample_rate
         )
         self._video_source = self._sora.create_video_source()
+        # マイクの音声は 10 ms ずつにそろえてから audio_source に渡す。
+        # マイクと audio_source の形式が違う場合は run() で変換付きのものに作り直す
+        self._audio_ring_buffer = AudioRingBuffer(self._audio_sample_rate, self._audio_channels)
+
+        if video_capture is not None:
+            self._video_capture = video_capture
 
-        self._connection: SoraConnection = self._sora.create_connection(
+        self._adaptation: Optional[AdaptationController] = None
+        if adaptive:
+            self._adaptation = AdaptationController(
+                self.get_raw_stats,
+                target_bitrate_bps=video_bit_rate * 1000 if video_bit_rate is not None else None,
+            )
+
+        self._static_scene_filter: Optional[StaticSceneFilter] = None
+        if static_scene_threshold is not None:
+            self._static_scene_filter = StaticSceneFilter(
+                static_scene_threshold, keepalive_fps=static_scene_keepalive_fps
+            )
+        self._latency_stamp: bool = latency_stamp
+
+    @property
+    def audio_source(self) -> SoraAudioSource:
+        """音声を送信する SoraAudioSource。"""
+        return self._audio_source
+
+    @property
+    def video_source(self) -> SoraVideoSource:
+        """映像を送信する SoraVideoSource。"""
+        return self._video_source
+
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        return self._sora.create_connection(
             signaling_urls=signaling_urls,
             role="sendonly",
-            channel_id=channel_id,
-            metadata=metadata,
-            audio=audio,
-            video=video,
-            video_codec_type=video_codec_type,
-            video_bit_rate=video_bit_rate,
-            data_channel_signaling=data_channel_signaling,
+            channel_id=self._channel_id,
+            metadata=self._metadata,
+            audio=self._audio,
+            video=self._video,
+            video_codec_type=self._video_codec_type,
+            video_bit_rate=self._video_bit_rate,
+            data_channel_signaling=self._data_channel_signaling,
             audio_source=self._audio_source,
             video_source=self._video_source,
         )
-        self._connection_id: Optional[str] = None
-
-        self._connected: Event = Event()
-        self._switched: bool = False
-        self._closed: Event = Event()
-        self._default_connection_timeout_s: float = 10.0
 
-        self._connection.on_set_offer = self._on_set_offer
-        self._connection.on_switched = self._on_switched
-        self._connection.on_notify = self._on_notify
-        self._connection.on_disconnect = self._on_disconnect
-
-        if video_capture is not None:
-            self._video_capture = video_capture
-
-    def connect(self, fake_audio=False, fake_video=False) -> None:
+    def connect(
+        self,
+        fake_audio: Union[bool, SyntheticAudioGenerator] = False,
+        fake_video: Union[bool, SyntheticVideoGenerator] = False,
+    ) -> None:
         """
         Sora への接続を確立します。
 
+        :param fake_audio: 合成音声を送信するかどうか。SyntheticAudioGenerator も指定できます
+        :param fake_video: 合成映像を送信するかどうか。SyntheticVideoGenerator も指定できます
         :raises AssertionError: タイムアウト期間内に接続が確立できなかった場合
         """
-        self._connection.connect()
+        # 合成メディアのスレッドは _closed を見て止まるので、接続して _closed を下ろしてから始める
+        super().connect()
 
         if fake_audio:
-            self._fake_audio_thread = threading.Thread(target=self._fake_audio_loop, daemon=True)
+            if not isinstance(fake_audio, SyntheticAudioGenerator):
+                fake_audio = SyntheticAudioGenerator(self._audio_sample_rate, self._audio_channels)
+            self._fake_audio_thread = threading.Thread(
+                target=fake_audio.run, args=(self._audio_source, self._closed), daemon=True
+            )
             self._fake_audio_thread.start()
 
         if fake_video:
-            self._fake_video_thread = threading.Thread(target=self._fake_video_loop, daemon=True)
+            if not isinstance(fake_video, SyntheticVideoGenerator):
+                fake_video = SyntheticVideoGenerator()
+            self._fake_video_thread = threading.Thread(
+                target=fake_video.run, args=(self._video_source, self._closed), daemon=True
+            )
             self._fake_video_thread.start()
 
-        assert self._connected.wait(
-            self._default_connection_timeout_s
-        ), "Could not connect to Sora."
-
-    def disconnect(self) -> None:
-        """Sora から切断します。"""
-        self._connection.disconnect()
-
-    def get_stats(self):
-        raw_stats = self._connection.get_stats()
-        return json.loads(raw_stats)
-
-    @property
-    def connected(self) -> bool:
-        return self._connected.is_set()
-
-    @property
-    def switched(self) -> bool:
-        return self._switched
-
-    def _fake_audio_loop(self):
-        while not self._closed.is_set():
-            time.sleep(0.02)
-            self._audio_source.on_data(numpy.zeros((320, 1), dtype=numpy.int16))
-
-    def _fake_video_loop(self):
-        while not self._closed.is_set():
-            time.sleep(1.0 / 30)
-            self._video_source.on_captured(numpy.zeros((480, 640, 3), dtype=numpy.uint8))
-
-    def _on_set_offer(self, raw_message: str) -> None:
-        """
-        オファー設定イベントを処理します。
-
-        :param raw_message: オファーを含む生のメッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        if message["type"] == "offer":
-            self._connection_id = message["connection_id"]
-
-    def _on_switched(self, raw_message: str) -> None:
-        message = json.loads(raw_message)
-        if message["type"] == "switched":
-            print(f"Switched to DataChannel Signaling: connection_id={self._connection_id}")
-            self._switched = True
-
-    def _on_notify(self, raw_message: str) -> None:
-        """
-        Sora からの通知イベントを処理します。
-
-        :param raw_message: 生の通知メッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        if (
-            message["type"] == "notify"
-            and message["event_type"] == "connection.created"
-            and message["connection_id"] == self._connection_id
-        ):
-            print(f"Connected Sora: connection_id={self._connection_id}")
-            self._connected.set()
-
-    def _on_disconnect(self, error_code: SoraSignalingErrorCode, message: str) -> None:
-        """
-        切断イベントを処理します。
-
-        :param error_code: 切断のエラーコード
-        :param message: 切断メッセージ
-        """
-        print(f"Disconnected Sora: error_code='{error_code}' message='{message}'")
-        self._connected.clear()
-        self._closed.set()
-
+    def _on_close(self) -> None:
         if self._fake_audio_thread is not None:
             self._fake_audio_thread.join(timeout=10)
 
@@ -196,40 +196,114 @@ class Sendonly:
             self._fake_video_thread.join(timeout=10)
 
     def _sounddevice_input_stream_callback(
-        self, indata: ndarray, frames: int, time: Any, status: sounddevice.CallbackFlags
+        self, indata: ndarray, frames: int, time: Any, status: "sounddevice.CallbackFlags"
     ) -> None:
         """
         音声入力のためのコールバック関数。
 
+        リングバッファにコピーするだけで、形式の変換と on_data は送信スレッドで行います。
+
         :param indata: 入力された音声データ
         :param frames: 処理するフレーム数
         :param time: タイミング情報（未使用）
         :param status: ステータスフラグ
         """
-        self._audio_source.on_data(indata)
+        started_ns = self._instrumentation.now()
+        self._audio_ring_buffer.write(indata)
+        self._instrumentation.record("sendonly.audio_callback", started_ns)
 
     def run(self) -> None:
         """
         ビデオフレームの送信と音声の送信を行うメインループ。
+
+        video_capture が MediaFileCapture で音声も送れる場合は、
+        マイクの代わりにファイルの音声を送ります。audio が False の場合はマイクを開きません。
         """
-        with sounddevice.InputStream(
-            samplerate=self._audio_sample_rate,
-            channels=self._audio_channels,
-            dtype="int16",
-            callback=self._sounddevice_input_stream_callback,
+        input_stream: ContextManager = contextlib.nullcontext()
+        # 音声を送らない場合はマイクを開かない
+        if self._audio is not False and not (
+            isinstance(self._video_capture, MediaFileCapture)
+            and self._video_capture.start_audio(
+                self._audio_source, self._audio_sample_rate, self._audio_channels
+            )
         ):
-            self.connect()
-            try:
-                while self._connected.is_set():
+            # マイクを使う場合だけ PortAudio を読み込む
+            import sounddevice  # type: ignore
+
+            # マイクはデバイス本来の形式で開き、OS に変換させない
+            device_sample_rate = self._audio_device_sample_rate or int(
+                sounddevice.query_devices(kind="input")["default_samplerate"]
+            )
+            if (device_sample_rate, self._audio_device_channels) != (
+                self._audio_sample_rate,
+                self._audio_channels,
+            ):
+                # PortAudio のコールバックではコピーだけにして、変換は送信スレッドで行う
+                self._audio_ring_buffer = AudioRingBuffer(
+                    device_sample_rate,
+                    self._audio_device_channels,
+                    converter=AudioConverter(
+                        device_sample_rate,
+                        self._audio_device_channels,
+                        self._audio_sample_rate,
+                        self._audio_channels,
+                    ),
+                )
+            input_stream = sounddevice.InputStream(
+                samplerate=device_sample_rate,
+                channels=self._audio_device_channels,
+                dtype="int16",
+                callback=self._sounddevice_input_stream_callback,
+            )
+            self._audio_ring_buffer.start(self._audio_source)
+        instrumentation = self._instrumentation
+        adaptation = self._adaptation
+        static_scene_filter = self._static_scene_filter
+        latency_stamp = self._latency_stamp
+        try:
+            with input_stream:
+                self.connect()
+                if adaptation is not None:
+                    adaptation.start()
+                # 再接続中もキャプチャを止めずにソースへ渡し続ける
+                while not self._closed.is_set():
+                    started_ns = instrumentation.now()
                     success, frame = self._video_capture.read()
                     if not success:
+                        # ループしないファイルを最後まで再生した場合など
+                        if not self._video_capture.isOpened():
+                            break
+                        continue
+                    instrumentation.record("sendonly.capture", started_ns)
+                    captured_us = now_us() if latency_stamp else 0
+                    # 映像が変化していない間はキープアライブの分だけ送る
+                    if static_scene_filter is not None:
+                        started_ns = instrumentation.now()
+                        send = static_scene_filter.process(frame)
+                        instrumentation.record("sendonly.scene_change", started_ns)
+                        if not send:
+                            continue
+                    # 間引くフレームはエンコーダーに渡さない
+                    if adaptation is not None and (frame := adaptation.process(frame)) is None:
                         continue
+                    # 変化の判定と縮小の後に書き込み、送るフレームの大きさに合わせたバーコードにする
+                    if latency_stamp:
+                        started_ns = instrumentation.now()
+                        stamp_frame(frame, captured_us)
+                        instrumentation.record("sendonly.latency_stamp", started_ns)
+                    started_ns = instrumentation.now()
                     self._video_source.on_captured(frame)
-            except KeyboardInterrupt:
-                pass
-            finally:
-                self.disconnect()
-                self._video_capture.release()
+                    instrumentation.record("sendonly.on_captured", started_ns)
+                    startup_timing.mark("first_frame")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # 接続やマイクを開くのに失敗した場合も、送信スレッドとキャプチャを止める
+            if adaptation is not None:
+                adaptation.stop()
+            self.disconnect()
+            self._video_capture.release()
+            self._audio_ring_buffer.stop()
 
 
 def get_video_capture(
@@ -281,56 +355,65 @@ def get_video_capture(
 
 def sendonly() -> None:
     """
-    環境変数を使用して Sendonly インスタンスを設定し実行します。
+    設定を使用して Sendonly インスタンスを設定し実行します。
 
-    :raises ValueError: 必要な環境変数が設定されていない場合
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
     """
-    load_dotenv()
-
-    if not (raw_signaling_urls := os.getenv("SORA_SIGNALING_URLS")):
-        raise ValueError("環境変数 SORA_SIGNALING_URLS が設定されていません")
-    signaling_urls = raw_signaling_urls.split(",")
-
-    if not (channel_id := os.getenv("SORA_CHANNEL_ID")):
-        raise ValueError("環境変数 SORA_CHANNEL_ID が設定されていません")
-
-    metadata = None
-    if raw_metadata := os.getenv("SORA_METADATA"):
-        metadata = json.loads(raw_metadata)
-
-    video_codec_type = os.getenv("SORA_VIDEO_CODEC_TYPE", "VP9")
-    video_bit_rate = int(os.getenv("SORA_VIDEO_BIT_RATE", "500"))
-    video_width = int(os.getenv("SORA_VIDEO_WIDTH", "640"))
-    video_height = int(os.getenv("SORA_VIDEO_HEIGHT", "360"))
-    video_fps = int(os.getenv("SORA_VIDEO_FPS", "30"))
-    video_fourcc = os.getenv("SORA_VIDEO_FOURCC", "MJPG")
-
-    camera_id = int(os.getenv("SORA_CAMERA_ID", "0"))
-
-    # OpenCV を利用したビデオキャプチャの設定
-    video_capture = get_video_capture(
-        camera_id=camera_id,
-        video_width=video_width,
-        video_height=video_height,
-        video_fps=video_fps,
-        video_fourcc=video_fourcc,
-    )
-
-    openh264_path = os.getenv("OPENH264_PATH")
-
-    use_hwa = bool(os.getenv("USE_HWA", "True"))
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
+
+    video_capture: Union[cv2.VideoCapture, MediaFileCapture]
+    if config.video_file:
+        # カメラの代わりにファイルやネットワーク上のストリームを再生する
+        video_capture = MediaFileCapture(
+            config.video_file,
+            loop=config.video_file_loop,
+            buffer_frames=config.video_file_buffer_frames,
+        )
+    else:
+        # OpenCV を利用したビデオキャプチャの設定
+        video_capture = get_video_capture(
+            camera_id=config.camera_id if config.camera_id is not None else 0,
+            video_width=config.video_width or 640,
+            video_height=config.video_height or 360,
+            video_fps=config.video_fps,
+            video_fourcc=config.video_fourcc,
+        )
 
     sendonly = Sendonly(
-        signaling_urls,
-        channel_id,
-        metadata=metadata,
-        video_codec_type=video_codec_type,
-        video_bit_rate=video_bit_rate,
-        openh264_path=openh264_path,
-        use_hwa=use_hwa,
+        config.signaling_urls,
+        config.channel_id,
+        metadata=config.metadata,
+        video_codec_type=config.video_codec_type,
+        video_bit_rate=config.video_bit_rate,
+        openh264_path=config.openh264_path,
+        use_hwa=config.use_hwa,
         video_capture=video_capture,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+        adaptive=config.adaptive,
+        # 指定がなければマイクはデバイスの既定のサンプリングレートで開いて変換する
+        audio_device_sample_rate=config.audio_device_sample_rate,
+        audio_device_channels=config.audio_device_channels,
+        static_scene_threshold=config.static_scene_threshold,
+        static_scene_keepalive_fps=config.static_scene_keepalive_fps,
+        latency_stamp=config.latency_stamp,
     )
-    sendonly.run()
+
+    # stats_csv が指定されていれば、統計情報を定期的に取得して終了時に CSV で書き出す
+    stats_collector: Optional[StatsCollector] = None
+    if stats_csv_path := config.stats_csv:
+        stats_collector = StatsCollector(sendonly.get_raw_stats, interval_s=config.stats_interval_s)
+        stats_collector.start()
+
+    try:
+        sendonly.run()
+    finally:
+        if stats_collector is not None:
+            stats_collector.stop()
+            with open(stats_csv_path, "w") as f:
+                stats_collector.to_csv(f)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,17 @@
-import json
-import os
 import random
 import time
-from threading import Event
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
-from dotenv import load_dotenv
-from sora_sdk import Sora, SoraConnection, SoraSignalingErrorCode
+from sora_sdk import Sora, SoraConnection
 
+from config import get_config
+from connection_manager import ConnectionManager
+from file_transfer import FileTransfer
+from instrumentation import enable_instrumentation_from_config
+from signaling_url_selector import SignalingUrlSelector
 
-class Messaging:
+
+class Messaging(ConnectionManager):
     """Sora を使用してメッセージングを行うクラス。"""
 
     def __init__(
@@ -18,6 +20,9 @@ class Messaging:
         channel_id: str,
         data_channels: list[dict[str, Any]],
         metadata: Optional[dict[str, Any]] = None,
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        sora: Optional[Sora] = None,
     ):
         """
         Messaging インスタンスを初期化します。
@@ -29,134 +34,75 @@ class Messaging:
         :param channel_id: 接続するチャンネル ID
         :param data_channels: データチャネルの設定リスト
         :param metadata: 接続のためのオプションのメタデータ
+        :param reconnect: 意図しない切断時に自動で再接続するかどうか
+        :param url_selector: 接続を試すシグナリング URL の順番を決めるセレクター
+        :param sora: 利用する Sora インスタンス。省略した場合は新しく作成します
         """
-        self._data_channels = data_channels
-
-        self._sora = Sora()
-        self._connection: SoraConnection = self._sora.create_connection(
-            signaling_urls=signaling_urls,
-            role="sendrecv",
-            channel_id=channel_id,
-            metadata=metadata,
-            audio=False,
-            video=False,
-            data_channels=self._data_channels,
-            data_channel_signaling=True,
+        super().__init__(
+            sora or Sora(), signaling_urls, reconnect=reconnect, url_selector=url_selector
         )
-        self._connection_id: Optional[str] = None
-
-        self._connected = Event()
-        self._switched: bool = False
-        self._closed = Event()
-        self._default_connection_timeout_s: float = 10.0
+        self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
+        self._data_channels = data_channels
 
         self._label = data_channels[0]["label"]
         self._sendable_data_channels: set = set()
         self._is_data_channel_ready = False
+        # ラベルごとに、受信したメッセージを print せずに渡す関数
+        self._message_handlers: dict[str, Callable[[bytes], None]] = {}
 
         self.sender_id = random.randint(1, 10000)
 
-        self._connection.on_set_offer = self._on_set_offer
-        self._connection.on_switched = self._on_switched
-        self._connection.on_notify = self._on_notify
-        self._connection.on_data_channel = self._on_data_channel
-        self._connection.on_message = self._on_message
-        self._connection.on_disconnect = self._on_disconnect
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        # データチャネルは接続ごとに作り直されるので、準備完了フラグも戻す
+        self._sendable_data_channels.clear()
+        self._is_data_channel_ready = False
 
-    @property
-    def closed(self):
-        """接続が閉じられているかどうかを示すブール値。"""
-        return self._closed.is_set()
+        connection = self._sora.create_connection(
+            signaling_urls=signaling_urls,
+            role="sendrecv",
+            channel_id=self._channel_id,
+            metadata=self._metadata,
+            audio=False,
+            video=False,
+            data_channels=self._data_channels,
+            data_channel_signaling=True,
+        )
+        connection.on_data_channel = self._on_data_channel
+        connection.on_message = self._on_message
+        return connection
 
-    def connect(self):
+    def add_message_handler(self, label: str, handler: Callable[[bytes], None]) -> None:
         """
-        Sora への接続を確立します。
+        データチャネルで受信したメッセージを渡す関数を登録します。
 
-        :raises AssertionError: タイムアウト期間内に接続が確立できなかった場合
+        :param label: データチャネルのラベル
+        :param handler: 受信したバイトデータを受け取る関数
         """
-        self._connection.connect()
-
-        assert self._connected.wait(
-            self._default_connection_timeout_s
-        ), "Could not connect to Sora."
-
-    def disconnect(self):
-        """Sora から切断します。"""
-        self._connection.disconnect()
-
-    def get_stats(self):
-        raw_stats = self._connection.get_stats()
-        stats = json.loads(raw_stats)
-        return stats
-
-    @property
-    def connected(self) -> bool:
-        return self._connected.is_set()
+        self._message_handlers[label] = handler
 
-    @property
-    def switched(self) -> bool:
-        return self._switched
-
-    def send(self, data: bytes):
+    def send(self, data: bytes, label: Optional[str] = None):
         """
         データチャネルを通じてメッセージを送信します。
 
         :param data: 送信するバイトデータ
+        :param label: 送信するデータチャネルのラベル。省略した場合は最初のデータチャネル
         """
         # on_data_channel() が呼ばれるまではデータチャネルの準備ができていないので待機
-        while not self._is_data_channel_ready and not self._closed.is_set():
-            time.sleep(0.01)
-
-        self._connection.send_data_channel(self._label, data)
-
-    def _on_set_offer(self, raw_message: str):
-        """
-        オファー設定イベントを処理します。
-
-        :param raw_message: オファーを含む生のメッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        if message["type"] == "offer":
-            # "type": "offer" に入ってくる自分の connection_id を保存する
-            self._connection_id = message["connection_id"]
-
-    def _on_switched(self, raw_message: str):
-        """
-        スイッチイベントを処理します。
-
-        :param raw_message: 生のスイッチメッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        if message["type"] == "switched":
-            self._switched = True
-
-    def _on_notify(self, raw_message: str):
-        """
-        Sora からの通知イベントを処理します。
+        if label is None:
+            label = self._label
+            while not self._is_data_channel_ready and not self._closed.is_set():
+                time.sleep(0.01)
+        else:
+            while label not in self._sendable_data_channels and not self._closed.is_set():
+                time.sleep(0.01)
 
-        :param raw_message: 生の通知メッセージ
-        """
-        message: dict[str, Any] = json.loads(raw_message)
-        # "type": "notify" の "connection.created" で通知される connection_id が
-        # 自分の connection_id と一致する場合に接続完了とする
-        if (
-            message["type"] == "notify"
-            and message["event_type"] == "connection.created"
-            and message["connection_id"] == self._connection_id
-        ):
-            print(f"Connected Sora: connection_id={self._connection_id}")
-            self._connected.set()
-
-    def _on_disconnect(self, error_code: SoraSignalingErrorCode, message: str):
-        """
-        切断イベントを処理します。
+        if self._connection is None or self._closed.is_set():
+            return
 
-        :param error_code: 切断のエラーコード
-        :param message: 切断メッセージ
-        """
-        print(f"Disconnected Sora: error_code='{error_code}' message='{message}'")
-        self._connected.clear()
-        self._closed.set()
+        started_ns = self._instrumentation.now()
+        self._connection.send_data_channel(label, data)
+        self._instrumentation.record("messaging.send", started_ns)
 
     def _on_message(self, label: str, data: bytes):
         """
@@ -165,6 +111,9 @@ class Messaging:
         :param label: データチャネルのラベル
         :param data: 受信したバイトデータ
         """
+        if (handler := self._message_handlers.get(label)) is not None:
+            handler(data)
+            return
         print(f"Received message: label={label}, data={data.decode('utf-8')}")
 
     def _on_data_channel(self, label: str):
@@ -185,34 +134,56 @@ class Messaging:
 
 
 def sendrecv():
-    # .env ファイルを読み込む
-    load_dotenv()
-
-    # 必須引数
-    if not (raw_signaling_urls := os.getenv("SORA_SIGNALING_URLS")):
-        raise ValueError("環境変数 SORA_SIGNALING_URLS が設定されていません")
-    signaling_urls = raw_signaling_urls.split(",")
-
-    if not (channel_id := os.getenv("SORA_CHANNEL_ID")):
-        raise ValueError("環境変数 SORA_CHANNEL_ID が設定されていません")
-
-    if not (messaging_label := os.getenv("SORA_MESSAGING_LABEL")):
-        raise ValueError("環境変数 SORA_MESSAGING_LABEL が設定されていません")
-
-    # オプション引数
-    metadata = None
-    if raw_metadata := os.getenv("SORA_METADATA"):
-        metadata = json.loads(raw_metadata)
-
-    data_channels = [{"label": messaging_label, "direction": "sendrecv"}]
-    messaging_sendrecv = Messaging(signaling_urls, channel_id, data_channels, metadata)
+    # .env ファイルや環境変数から設定を読み込む
+    config = get_config()
+    config.require("signaling_urls", "channel_id", "messaging_label")
+    enable_instrumentation_from_config(config)
+
+    data_channels = [{"label": config.messaging_label, "direction": "sendrecv"}]
+    file_label = config.file_transfer_label
+    if file_label is not None:
+        data_channels.append({"label": file_label, "direction": "sendrecv"})
+    messaging_sendrecv = Messaging(
+        config.signaling_urls,
+        config.channel_id,
+        data_channels,
+        config.metadata,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
+    )
+
+    file_transfer: Optional[FileTransfer] = None
+    if file_label is not None:
+        file_transfer = FileTransfer(
+            lambda data: messaging_sendrecv.send(data, label=file_label),
+            receive_dir=config.file_transfer_dir,
+            chunk_size=config.file_transfer_chunk_size,
+            window=config.file_transfer_window,
+        )
+        file_transfer.on_file_received = lambda path: print(f"Received file: {path}")
+        messaging_sendrecv.add_message_handler(file_label, file_transfer.handle_message)
 
     # Sora に接続する
     messaging_sendrecv.connect()
     try:
         while not messaging_sendrecv.closed:
-            # input で入力された文字列を utf-8 でエンコードして送信
             message = input()
+            # "/send <パス>" でファイルを送信する
+            if file_transfer is not None and message.startswith("/send "):
+                try:
+                    stats = file_transfer.send_file(message.removeprefix("/send ").strip())
+                except (OSError, TimeoutError) as e:
+                    # パスの打ち間違いや応答がない場合も、セッションは続ける
+                    print(f"Failed to send file: {e}")
+                    continue
+                print(
+                    f"Sent file: name={stats.name} size={stats.size} "
+                    f"elapsed={stats.elapsed_s:.2f}s "
+                    f"throughput={stats.throughput_bps / 1_000_000:.2f}Mbps "
+                    f"retransmitted_chunks={stats.retransmitted_chunks}"
+                )
+                continue
+            # input で入力された文字列を utf-8 でエンコードして送信
             messaging_sendrecv.send(message.encode("utf-8"))
     except KeyboardInterrupt:
         pass
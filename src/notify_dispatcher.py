@@ -0,0 +1,79 @@
+import json
+import threading
+from typing import Any, Callable
+
+try:
+    # orjson がインストールされていれば、より高速な JSON デコーダーとして利用する
+    import orjson  # type: ignore
+
+    loads: Callable[[str], Any] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+NotifyHandler = Callable[[dict[str, Any]], None]
+
+
+class NotifyDispatcher:
+    """
+    Sora からの type: notify のメッセージを event_type ごとにハンドラーへ振り分けるクラス。
+
+    大きなチャンネルでは notify の量が参加者数に応じて増えるため、
+    購読されている event_type が生の文字列に含まれていないメッセージは JSON をパースせずに捨てます。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers: dict[str, list[NotifyHandler]] = {}
+        # 生の文字列に対する事前フィルター。"connection.created" のようにダブルクォートで囲む
+        self._needles: tuple[str, ...] = ()
+
+    def on(self, event_type: str, handler: NotifyHandler) -> None:
+        """
+        event_type のハンドラーを登録します。
+
+        :param event_type: "connection.created" などの event_type
+        :param handler: パース済みのメッセージを受け取るハンドラー
+        """
+        with self._lock:
+            self._handlers.setdefault(event_type, []).append(handler)
+            self._update_needles()
+
+    def off(self, event_type: str, handler: NotifyHandler) -> None:
+        """
+        event_type のハンドラーの登録を解除します。
+
+        :param event_type: "connection.created" などの event_type
+        :param handler: 登録済みのハンドラー
+        """
+        with self._lock:
+            handlers = self._handlers.get(event_type, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if not handlers:
+                self._handlers.pop(event_type, None)
+            self._update_needles()
+
+    def dispatch(self, raw_message: str) -> bool:
+        """
+        生の notify メッセージを、購読されている場合だけパースしてハンドラーに渡します。
+
+        :param raw_message: 生の通知メッセージ
+        :return: いずれかのハンドラーに渡した場合は True
+        """
+        # on() / off() で差し替えられるので、参照を 1 度だけ読む
+        needles = self._needles
+        if not any(needle in raw_message for needle in needles):
+            return False
+
+        message: dict[str, Any] = loads(raw_message)
+        if message.get("type") != "notify":
+            return False
+        handlers = self._handlers.get(message.get("event_type", ""))
+        if not handlers:
+            return False
+        for handler in tuple(handlers):
+            handler(message)
+        return True
+
+    def _update_needles(self) -> None:
+        self._needles = tuple(f'"{event_type}"' for event_type in self._handlers)
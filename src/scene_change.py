@@ -0,0 +1,75 @@
+import time
+from typing import Optional
+
+import cv2  # type: ignore
+import numpy as np
+
+
+class StaticSceneFilter:
+    """
+    映像が変化していない間、on_captured に渡すフレームをキープアライブの分まで間引くクラス。
+
+    フレームを縮小した輝度のサムネイルを作り、最後に送ったフレームのサムネイルとの
+    画素あたりの差の絶対値の平均 (SAD / 画素数) がしきい値以下なら変化していないとみなします。
+    直前のフレームではなく最後に送ったフレームと比べるので、ゆっくりした変化も取りこぼしません。
+    サムネイルのバッファは事前に確保して使い回します。
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        keepalive_fps: float = 1.0,
+        thumbnail_size: tuple[int, int] = (64, 36),
+    ):
+        """
+        StaticSceneFilter インスタンスを初期化します。
+
+        :param threshold: 変化したとみなす、サムネイルの画素あたりの輝度の差の平均 (0 から 255)
+        :param keepalive_fps: 変化していない間に送るフレームレート
+        :param thumbnail_size: 比べるサムネイルの (幅, 高さ)
+        """
+        if threshold < 0:
+            raise ValueError("threshold には 0 以上を指定してください")
+        if keepalive_fps <= 0:
+            raise ValueError("keepalive_fps には正の値を指定してください")
+        self._threshold: float = threshold
+        self._keepalive_interval_s: float = 1 / keepalive_fps
+        self._thumbnail_size: tuple[int, int] = thumbnail_size
+
+        width, height = thumbnail_size
+        self._small = np.empty((height, width, 3), dtype=np.uint8)
+        self._thumbnail = np.empty((height, width), dtype=np.uint8)
+        self._reference = np.empty((height, width), dtype=np.uint8)
+        self._diff = np.empty((height, width), dtype=np.uint8)
+        self._has_reference: bool = False
+        self._last_sent_at: float = 0.0
+
+        # 間引いたフレームの数
+        self.suppressed_frames: int = 0
+
+    def process(self, frame: np.ndarray, now: Optional[float] = None) -> bool:
+        """
+        フレームを送るかどうかを判定します。
+
+        :param frame: キャプチャした (高さ, 幅, 3) の BGR のフレーム
+        :param now: 現在の時刻（time.monotonic() の値）。省略した場合は現在の時刻
+        :return: 送る場合は True
+        """
+        if now is None:
+            now = time.monotonic()
+        cv2.resize(frame, self._thumbnail_size, dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._thumbnail)
+
+        changed = True
+        if self._has_reference:
+            cv2.absdiff(self._thumbnail, self._reference, dst=self._diff)
+            changed = float(self._diff.mean()) > self._threshold
+        if not changed and now - self._last_sent_at < self._keepalive_interval_s:
+            self.suppressed_frames += 1
+            return False
+
+        # 送るフレームのサムネイルを次の比較の基準にする
+        self._thumbnail, self._reference = self._reference, self._thumbnail
+        self._has_reference = True
+        self._last_sent_at = now
+        return True
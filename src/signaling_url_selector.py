@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+# スコアを保存するキャッシュファイルのデフォルトの場所
+DEFAULT_CACHE_PATH = Path.home().joinpath(".cache", "sora-sdk-examples", "signaling_urls.json")
+
+
+@dataclass
+class SignalingUrlScore:
+    """シグナリング URL ごとの接続実績。"""
+
+    # 接続にかかった時間の指数移動平均（秒）。まだ接続したことがなければ None
+    latency_s: Optional[float] = None
+    # 連続で失敗した回数
+    failures: int = 0
+    # 最後に失敗した時刻（UNIX 時間）
+    last_failure_at: float = 0.0
+
+
+class SignalingUrlSelector:
+    """
+    シグナリング URL ごとの接続時間と失敗を記録し、速くて健全な URL から順に並べるクラス。
+
+    スコアは小さな JSON ファイルに保存し、プロセスをまたいで引き継ぎます。
+    """
+
+    def __init__(
+        self,
+        signaling_urls: list[str],
+        cache_path: Optional[Path] = DEFAULT_CACHE_PATH,
+        latency_alpha: float = 0.3,
+        failure_cooldown_s: float = 300.0,
+    ):
+        """
+        SignalingUrlSelector インスタンスを初期化します。
+
+        :param signaling_urls: Sora シグナリング URL のリスト
+        :param cache_path: スコアを保存するファイルのパス。None の場合は保存しない
+        :param latency_alpha: 接続時間の指数移動平均の係数
+        :param failure_cooldown_s: 失敗した URL を再び健全とみなすまでの時間（秒）
+        """
+        self._signaling_urls: list[str] = signaling_urls
+        self._cache_path: Optional[Path] = cache_path
+        self._latency_alpha: float = latency_alpha
+        self._failure_cooldown_s: float = failure_cooldown_s
+
+        self._lock = threading.Lock()
+        self._scores: dict[str, SignalingUrlScore] = {
+            url: SignalingUrlScore() for url in signaling_urls
+        }
+        self._load()
+
+    def ordered(self) -> list[str]:
+        """
+        接続を試す順に並べたシグナリング URL を返します。
+
+        健全で接続時間が短い URL、まだ接続したことがない URL、失敗が続いている URL の順です。
+        """
+        now = time.time()
+        with self._lock:
+
+            def key(index_url: tuple[int, str]) -> tuple[int, float]:
+                index, url = index_url
+                score = self._scores[url]
+                if score.failures > 0 and now - score.last_failure_at < self._failure_cooldown_s:
+                    return (2, score.failures)
+                if score.latency_s is None:
+                    return (1, index)
+                return (0, score.latency_s)
+
+            return [url for _, url in sorted(enumerate(self._signaling_urls), key=key)]
+
+    def record_success(self, url: str, latency_s: float) -> None:
+        """
+        接続に成功したことを記録します。
+
+        :param url: 接続したシグナリング URL
+        :param latency_s: 接続にかかった時間（秒）
+        """
+        with self._lock:
+            score = self._scores.setdefault(url, SignalingUrlScore())
+            if score.latency_s is None:
+                score.latency_s = latency_s
+            else:
+                score.latency_s += self._latency_alpha * (latency_s - score.latency_s)
+            score.failures = 0
+        self._save()
+
+    def record_failure(self, url: str) -> None:
+        """
+        接続に失敗したことを記録します。
+
+        :param url: 接続に失敗したシグナリング URL
+        """
+        with self._lock:
+            score = self._scores.setdefault(url, SignalingUrlScore())
+            score.failures += 1
+            score.last_failure_at = time.time()
+        self._save()
+
+    def score(self, url: str) -> SignalingUrlScore:
+        """指定した URL のスコアを返します。"""
+        with self._lock:
+            return SignalingUrlScore(**asdict(self._scores[url]))
+
+    def _load(self) -> None:
+        if self._cache_path is None or not self._cache_path.exists():
+            return
+        try:
+            cached = json.loads(self._cache_path.read_text())
+        except (OSError, ValueError):
+            # 壊れたキャッシュは無視して作り直す
+            return
+        if not isinstance(cached, dict):
+            return
+        for url in self._signaling_urls:
+            if isinstance(raw_score := cached.get(url), dict):
+                try:
+                    self._scores[url] = SignalingUrlScore(**raw_score)
+                except TypeError:
+                    continue
+
+    def _save(self) -> None:
+        if self._cache_path is None:
+            return
+        with self._lock:
+            # 他の URL リストで使っているスコアを消さないように、既存のキャッシュにマージする
+            cached: dict = {}
+            if self._cache_path.exists():
+                try:
+                    cached = json.loads(self._cache_path.read_text())
+                except (OSError, ValueError):
+                    cached = {}
+                if not isinstance(cached, dict):
+                    cached = {}
+            cached.update({url: asdict(score) for url, score in self._scores.items()})
+            try:
+                self._cache_path.parent.mkdir(parents=True, exist_ok=True)
+                # 書き込み途中のファイルを読まないように、一時ファイルに書いてから置き換える
+                tmp_path = self._cache_path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(cached))
+                os.replace(tmp_path, self._cache_path)
+            except OSError as e:
+                print(f"Failed to save signaling URL scores: {e}")
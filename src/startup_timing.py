@@ -0,0 +1,34 @@
+import json
+import sys
+import threading
+import time
+
+# 起動時間の基準。cli.py から最初に import されるので、ほぼプロセスの開始時刻になる
+_started_ns = time.perf_counter_ns()
+_enabled = False
+_marked: set[str] = set()
+_lock = threading.Lock()
+
+
+def enable() -> None:
+    """起動時間の出力を有効にします。"""
+    global _enabled
+    _enabled = True
+
+
+def mark(event: str) -> None:
+    """
+    起動からの経過時間を標準エラー出力に JSON で書き出します。
+
+    同じイベントは最初の 1 回だけ書き出すので、フレームごとのループから呼び出しても構いません。
+
+    :param event: イベントの名前。"import" や "first_frame" など
+    """
+    if not _enabled or event in _marked:
+        return
+    with _lock:
+        if event in _marked:
+            return
+        _marked.add(event)
+    elapsed_ms = (time.perf_counter_ns() - _started_ns) / 1_000_000
+    print(json.dumps({"startup": event, "elapsed_ms": round(elapsed_ms, 3)}), file=sys.stderr)
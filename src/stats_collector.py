@@ -0,0 +1,264 @@
+import math
+import threading
+import time
+from typing import Any, Callable, Optional, TextIO
+
+import numpy as np
+
+from notify_dispatcher import loads
+
+# リングバッファに保存する数値の項目
+STATS_FIELDS: tuple[str, ...] = (
+    "outbound_bitrate_bps",
+    "inbound_bitrate_bps",
+    "outbound_fps",
+    "inbound_fps",
+    "frames_dropped",
+    "jitter_s",
+    "round_trip_time_s",
+    "available_outgoing_bitrate_bps",
+    "encode_time_per_frame_s",
+    "quality_limitation",
+)
+
+# quality_limitation に保存する値は qualityLimitationReason のこのタプル内の位置
+QUALITY_LIMITATION_REASONS: tuple[str, ...] = ("none", "cpu", "bandwidth", "other")
+
+
+class StatsCollector:
+    """
+    接続の統計情報を定期的に取得し、必要な項目だけを数値のリングバッファに保存するクラス。
+
+    巨大な統計情報のレポートはサンプリングごとに 1 度だけパースし、
+    ビットレートやフレームレート、ジッター、RTT などの数値だけを残します。
+    保存した値は Prometheus のテキスト形式や CSV で書き出せます。
+    """
+
+    def __init__(
+        self,
+        get_raw_stats: Callable[[], Optional[str]],
+        interval_s: float = 1.0,
+        capacity: int = 3600,
+    ):
+        """
+        StatsCollector インスタンスを初期化します。
+
+        :param get_raw_stats: 生の統計情報を返す関数。ConnectionManager.get_raw_stats など
+        :param interval_s: 統計情報を取得する間隔（秒）
+        :param capacity: リングバッファに保存するサンプル数
+        """
+        self._get_raw_stats = get_raw_stats
+        self._interval_s: float = interval_s
+        self._capacity: int = capacity
+
+        self._lock = threading.Lock()
+        self._timestamps = np.full(capacity, np.nan, dtype=np.float64)
+        self._values = np.full((capacity, len(STATS_FIELDS)), np.nan, dtype=np.float64)
+        # 次に書き込む位置と、これまでに書き込んだサンプル数
+        self._index: int = 0
+        self._count: int = 0
+
+        # ビットレートを求めるための前回のバイト数と時刻
+        self._prev_bytes_sent: Optional[int] = None
+        self._prev_bytes_received: Optional[int] = None
+        # 1 フレームあたりのエンコード時間を求めるための前回の累計
+        self._prev_total_encode_time_s: Optional[float] = None
+        self._prev_frames_encoded: Optional[int] = None
+        self._prev_sampled_at: Optional[float] = None
+
+        self.encoder_implementation: Optional[str] = None
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """統計情報の取得を別スレッドで開始します。"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """統計情報の取得を停止します。"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def sample(self) -> bool:
+        """
+        統計情報を 1 度取得してリングバッファに保存します。
+
+        :return: 保存できた場合は True
+        """
+        if (raw_stats := self._get_raw_stats()) is None:
+            return False
+        self.add(loads(raw_stats), time.monotonic())
+        return True
+
+    def add(self, stats: list[dict[str, Any]], sampled_at: float) -> None:
+        """
+        パース済みの統計情報から必要な項目を取り出してリングバッファに保存します。
+
+        :param stats: パース済みの統計情報
+        :param sampled_at: 取得した時刻（time.monotonic() の値）
+        """
+        bytes_sent = 0
+        bytes_received = 0
+        outbound_fps = math.nan
+        inbound_fps = math.nan
+        frames_dropped = math.nan
+        jitter_s = math.nan
+        round_trip_time_s = math.nan
+        remote_round_trip_time_s = math.nan
+        available_outgoing_bitrate_bps = math.nan
+        total_encode_time_s = 0.0
+        frames_encoded = 0
+        quality_limitation = math.nan
+
+        for stat in stats:
+            stat_type = stat.get("type")
+            if stat_type == "outbound-rtp":
+                bytes_sent += stat.get("bytesSent", 0)
+                if stat.get("kind") == "video":
+                    # サイマルキャストでは複数あるので、一番高いフレームレートを採用する
+                    outbound_fps = np.fmax(outbound_fps, stat.get("framesPerSecond", math.nan))
+                    if implementation := stat.get("encoderImplementation"):
+                        self.encoder_implementation = implementation
+                    total_encode_time_s += stat.get("totalEncodeTime", 0.0)
+                    frames_encoded += stat.get("framesEncoded", 0)
+                    if (
+                        reason := stat.get("qualityLimitationReason")
+                    ) in QUALITY_LIMITATION_REASONS:
+                        # サイマルキャストでは一番厳しい理由を採用する
+                        quality_limitation = np.fmax(
+                            quality_limitation, QUALITY_LIMITATION_REASONS.index(reason)
+                        )
+            elif stat_type == "inbound-rtp":
+                bytes_received += stat.get("bytesReceived", 0)
+                jitter_s = np.fmax(jitter_s, stat.get("jitter", math.nan))
+                if stat.get("kind") == "video":
+                    inbound_fps = np.fmax(inbound_fps, stat.get("framesPerSecond", math.nan))
+                    frames_dropped = np.nansum([frames_dropped, stat.get("framesDropped", 0)])
+            elif stat_type == "candidate-pair":
+                if stat.get("nominated") and stat.get("state") == "succeeded":
+                    round_trip_time_s = stat.get("currentRoundTripTime", math.nan)
+                    available_outgoing_bitrate_bps = stat.get("availableOutgoingBitrate", math.nan)
+            elif stat_type == "remote-inbound-rtp":
+                remote_round_trip_time_s = np.fmax(
+                    remote_round_trip_time_s, stat.get("roundTripTime", math.nan)
+                )
+
+        if math.isnan(round_trip_time_s):
+            round_trip_time_s = remote_round_trip_time_s
+
+        outbound_bitrate_bps = self._bitrate(bytes_sent, self._prev_bytes_sent, sampled_at)
+        inbound_bitrate_bps = self._bitrate(bytes_received, self._prev_bytes_received, sampled_at)
+        encode_time_per_frame_s = math.nan
+        if (
+            self._prev_frames_encoded is not None
+            and self._prev_total_encode_time_s is not None
+            and frames_encoded > self._prev_frames_encoded
+        ):
+            encode_time_per_frame_s = (total_encode_time_s - self._prev_total_encode_time_s) / (
+                frames_encoded - self._prev_frames_encoded
+            )
+        self._prev_bytes_sent = bytes_sent
+        self._prev_bytes_received = bytes_received
+        self._prev_total_encode_time_s = total_encode_time_s
+        self._prev_frames_encoded = frames_encoded
+        self._prev_sampled_at = sampled_at
+
+        with self._lock:
+            self._timestamps[self._index] = sampled_at
+            self._values[self._index] = (
+                outbound_bitrate_bps,
+                inbound_bitrate_bps,
+                outbound_fps,
+                inbound_fps,
+                frames_dropped,
+                jitter_s,
+                round_trip_time_s,
+                available_outgoing_bitrate_bps,
+                encode_time_per_frame_s,
+                quality_limitation,
+            )
+            self._index = (self._index + 1) % self._capacity
+            self._count += 1
+
+    def latest(self) -> dict[str, float]:
+        """最後に保存したサンプルを項目名をキーにした辞書で返します。"""
+        with self._lock:
+            if self._count == 0:
+                return {}
+            row = self._values[(self._index - 1) % self._capacity]
+            return dict(zip(STATS_FIELDS, row.tolist()))
+
+    def series(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        保存しているサンプルを古い順に返します。
+
+        :return: 時刻の配列と、STATS_FIELDS の順に並んだ値の 2 次元配列
+        """
+        with self._lock:
+            if self._count < self._capacity:
+                return (
+                    self._timestamps[: self._index].copy(),
+                    self._values[: self._index].copy(),
+                )
+            return (
+                np.roll(self._timestamps, -self._index),
+                np.roll(self._values, -self._index, axis=0),
+            )
+
+    def to_prometheus(self, labels: Optional[dict[str, str]] = None) -> str:
+        """
+        最新の値を Prometheus のテキスト形式で返します。
+
+        :param labels: すべてのメトリクスに付けるラベル
+        """
+        label_items = [f'{key}="{value}"' for key, value in (labels or {}).items()]
+        label_text = "{" + ",".join(label_items) + "}" if label_items else ""
+        lines = []
+        for field, value in self.latest().items():
+            if math.isnan(value):
+                continue
+            lines.append(f"# TYPE sora_{field} gauge")
+            lines.append(f"sora_{field}{label_text} {value}")
+        if self.encoder_implementation is not None:
+            info_labels = ",".join(
+                label_items + [f'implementation="{self.encoder_implementation}"']
+            )
+            lines.append("# TYPE sora_encoder_info gauge")
+            lines.append(f"sora_encoder_info{{{info_labels}}} 1")
+        return "\n".join(lines) + "\n"
+
+    def to_csv(self, file: TextIO) -> None:
+        """
+        保存しているサンプルを古い順に CSV で書き出します。
+
+        :param file: 書き出し先のファイル
+        """
+        timestamps, values = self.series()
+        file.write(",".join(("timestamp",) + STATS_FIELDS) + "\n")
+        np.savetxt(file, np.column_stack((timestamps, values)), delimiter=",", fmt="%.6g")
+
+    def _bitrate(self, total_bytes: int, prev_bytes: Optional[int], sampled_at: float) -> float:
+        if prev_bytes is None or self._prev_sampled_at is None:
+            return math.nan
+        elapsed_s = sampled_at - self._prev_sampled_at
+        # 再接続でカウンターが戻った場合は求められない
+        if elapsed_s <= 0 or total_bytes < prev_bytes:
+            return math.nan
+        return (total_bytes - prev_bytes) * 8 / elapsed_s
+
+    def _run(self) -> None:
+        # sleep の誤差が積み重ならないように、次に取得する時刻を基準に待つ
+        next_sample_at = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Failed to collect stats: {e}")
+            next_sample_at += self._interval_s
+            if self._stopped.wait(max(0.0, next_sample_at - time.monotonic())):
+                break
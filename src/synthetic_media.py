@@ -0,0 +1,224 @@
+import threading
+import time
+from typing import Optional
+
+import cv2  # type: ignore
+import numpy as np
+from sora_sdk import SoraAudioSource, SoraVideoSource
+
+# 合成映像のパターン
+VIDEO_PATTERNS = ("black", "testcard", "counter")
+# 合成音声のパターン
+AUDIO_PATTERNS = ("silence", "tone", "noise")
+
+# カラーバーの色 (BGR)
+_COLOR_BARS = (
+    (192, 192, 192),
+    (0, 192, 192),
+    (192, 192, 0),
+    (0, 192, 0),
+    (192, 0, 192),
+    (0, 0, 192),
+    (192, 0, 0),
+    (0, 0, 0),
+)
+
+
+class DeadlinePacer:
+    """
+    単調増加する時計の上で、開始時刻からの n 番目の締め切りまで待つペーサー。
+
+    sleep の誤差は次の締め切りで吸収されるので、sleep を繰り返すだけのループと違ってずれません。
+    大きく遅れた場合は、遅れを取り戻そうと連続で処理しないように締め切りを今に合わせ直します。
+    """
+
+    def __init__(self, rate_hz: float, max_lag_intervals: int = 3):
+        """
+        DeadlinePacer インスタンスを初期化します。
+
+        :param rate_hz: 1 秒あたりの回数
+        :param max_lag_intervals: 締め切りを合わせ直すまでに許容する遅れ（間隔の個数）
+        """
+        self._interval_ns: float = 1_000_000_000 / rate_hz
+        self._max_lag_ns: float = self._interval_ns * max_lag_intervals
+        self._started_ns: Optional[int] = None
+        self._count: int = 0
+
+    def wait(self, stop: Optional[threading.Event] = None) -> bool:
+        """
+        次の締め切りまで待ちます。
+
+        :param stop: set されたら待機を打ち切るイベント
+        :return: 締め切りまで待った場合は True、stop で打ち切られた場合は False
+        """
+        now_ns = time.perf_counter_ns()
+        if self._started_ns is None:
+            self._started_ns = now_ns
+        self._count += 1
+        # 締め切りは毎回開始時刻から計算するので、丸め誤差も積み重ならない
+        deadline_ns = self._started_ns + round(self._count * self._interval_ns)
+        remaining_ns = deadline_ns - now_ns
+        if remaining_ns > 0:
+            if stop is None:
+                time.sleep(remaining_ns / 1_000_000_000)
+            elif stop.wait(remaining_ns / 1_000_000_000):
+                return False
+        elif -remaining_ns > self._max_lag_ns:
+            self._started_ns = now_ns
+            self._count = 0
+        return stop is None or not stop.is_set()
+
+
+class SyntheticVideoGenerator:
+    """
+    事前に確保したバッファを使い回して合成映像を生成するクラス。
+
+    パターンは次のとおりです。
+
+    - black: 黒一色
+    - testcard: カラーバーの上を白い縦線が動くテストカード
+    - counter: testcard にフレーム番号と送信時刻 (ms) を焼き込んだもの。遅延の計測に利用します
+    """
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        fps: float = 30,
+        pattern: str = "black",
+        buffer_count: int = 3,
+    ):
+        """
+        SyntheticVideoGenerator インスタンスを初期化します。
+
+        :param width: 映像の幅
+        :param height: 映像の高さ
+        :param fps: フレームレート
+        :param pattern: 映像のパターン
+        :param buffer_count: 順番に使い回すバッファの数
+        """
+        if pattern not in VIDEO_PATTERNS:
+            raise ValueError(f"pattern は {VIDEO_PATTERNS} のいずれかを指定してください: {pattern}")
+        self.width: int = width
+        self.height: int = height
+        self.fps: float = fps
+        self.pattern: str = pattern
+
+        self._buffers = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(buffer_count)]
+        self._background = np.zeros((height, width, 3), dtype=np.uint8)
+        if pattern != "black":
+            bar_width = max(1, width // len(_COLOR_BARS))
+            for i, color in enumerate(_COLOR_BARS):
+                self._background[:, i * bar_width : (i + 1) * bar_width] = color
+        self._bar_width: int = max(1, width // 32)
+        self.frame_number: int = 0
+
+    def next_frame(self) -> np.ndarray:
+        """
+        次のフレームを生成します。
+
+        返すバッファは buffer_count フレーム後に上書きされます。
+        """
+        buffer = self._buffers[self.frame_number % len(self._buffers)]
+        if self.pattern != "black":
+            np.copyto(buffer, self._background)
+            x = (self.frame_number * 4) % self.width
+            buffer[:, x : x + self._bar_width] = 255
+            if self.pattern == "counter":
+                text = f"{self.frame_number} {time.monotonic_ns() // 1_000_000}"
+                scale = max(0.5, self.height / 480)
+                cv2.putText(
+                    buffer,
+                    text,
+                    (8, int(40 * scale)),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    scale,
+                    (255, 255, 255),
+                    max(1, int(2 * scale)),
+                )
+        self.frame_number += 1
+        return buffer
+
+    def run(self, video_source: SoraVideoSource, stop: threading.Event) -> None:
+        """
+        stop が set されるまで、フレームレートに合わせてフレームを video_source に渡します。
+
+        :param video_source: フレームを渡す SoraVideoSource
+        :param stop: set されたら終了するイベント
+        """
+        pacer = DeadlinePacer(self.fps)
+        while pacer.wait(stop):
+            video_source.on_captured(self.next_frame())
+
+
+class SyntheticAudioGenerator:
+    """
+    事前に生成した 1 秒分の波形から 10 ms ずつのビューを切り出して合成音声を生成するクラス。
+
+    1 秒分の波形はサンプリングレートで割り切れる 10 ms のチャンクに分かれるので、
+    チャンクごとのコピーやメモリ確保は発生しません。
+
+    パターンは次のとおりです。
+
+    - silence: 無音
+    - tone: 正弦波
+    - noise: ホワイトノイズ
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        channels: int = 1,
+        pattern: str = "silence",
+        frequency_hz: int = 440,
+        amplitude: float = 0.1,
+        chunk_ms: int = 10,
+    ):
+        """
+        SyntheticAudioGenerator インスタンスを初期化します。
+
+        :param sample_rate: サンプリングレート
+        :param channels: チャンネル数
+        :param pattern: 音声のパターン
+        :param frequency_hz: tone の周波数（Hz）。1 秒でちょうど周期が揃うように整数で指定します
+        :param amplitude: フルスケールに対する振幅
+        :param chunk_ms: 1 回に渡す長さ（ms）
+        """
+        if pattern not in AUDIO_PATTERNS:
+            raise ValueError(f"pattern は {AUDIO_PATTERNS} のいずれかを指定してください: {pattern}")
+        self.sample_rate: int = sample_rate
+        self.channels: int = channels
+        self.pattern: str = pattern
+        self.chunk_ms: int = chunk_ms
+        self.samples_per_chunk: int = sample_rate * chunk_ms // 1000
+
+        peak = amplitude * np.iinfo(np.int16).max
+        if pattern == "tone":
+            t = np.arange(sample_rate, dtype=np.float64) / sample_rate
+            wave = peak * np.sin(2 * np.pi * frequency_hz * t)
+        elif pattern == "noise":
+            wave = np.random.default_rng().uniform(-peak, peak, sample_rate)
+        else:
+            wave = np.zeros(sample_rate)
+        self._wave = np.ascontiguousarray(
+            np.repeat(wave.astype(np.int16)[:, np.newaxis], channels, axis=1)
+        )
+        self._chunk_count: int = sample_rate // self.samples_per_chunk
+        self.chunk_number: int = 0
+
+    def next_chunk(self) -> np.ndarray:
+        """次の 10 ms 分の (samples_per_chunk, channels) の int16 のビューを返します。"""
+        start = (self.chunk_number % self._chunk_count) * self.samples_per_chunk
+        self.chunk_number += 1
+        return self._wave[start : start + self.samples_per_chunk]
+
+    def run(self, audio_source: SoraAudioSource, stop: threading.Event) -> None:
+        """
+        stop が set されるまで、実時間に合わせて音声を audio_source に渡します。
+
+        :param audio_source: 音声を渡す SoraAudioSource
+        :param stop: set されたら終了するイベント
+        """
+        pacer = DeadlinePacer(1000 / self.chunk_ms)
+        while pacer.wait(stop):
+            audio_source.on_data(self.next_chunk())
@@ -1,94 +1,60 @@
-import json
-import os
-from threading import Event
 from typing import Any, Optional
 
-from dotenv import load_dotenv
-from sora_sdk import (
-    Sora,
-    SoraAudioFrame,
-    SoraAudioStreamSink,
-    SoraMediaTrack,
-    SoraVAD,
-)
+from sora_sdk import Sora, SoraAudioFrame, SoraConnection, SoraMediaTrack
 
+import startup_timing
+from config import get_config
+from connection_manager import ConnectionManager, SinkClasses
+from instrumentation import enable_instrumentation_from_config
+from signaling_url_selector import SignalingUrlSelector
 
-class VAD:
+
+class VAD(ConnectionManager):
     def __init__(
-        self, signaling_urls: list[str], channel_id: str, metadata: Optional[dict[str, Any]]
+        self,
+        signaling_urls: list[str],
+        channel_id: str,
+        metadata: Optional[dict[str, Any]],
+        reconnect: bool = False,
+        url_selector: Optional[SignalingUrlSelector] = None,
+        sora: Optional[Sora] = None,
+        sink_classes: Optional[SinkClasses] = None,
     ):
-        self._signaling_urls: list[str] = signaling_urls
+        # _connected が set されるまで 30 秒待つ
+        super().__init__(
+            sora or Sora(),
+            signaling_urls,
+            connection_timeout_s=30.0,
+            reconnect=reconnect,
+            url_selector=url_selector,
+            sink_classes=sink_classes,
+        )
         self._channel_id: str = channel_id
+        self._metadata: Optional[dict[str, Any]] = metadata
 
-        self._vad = SoraVAD()
-
-        self._connection_id: str
-
-        # 接続した
-        self._connected: Event = Event()
-        # 終了
-        self._closed = Event()
+        self._vad = self._sink_classes.vad()
 
         self._audio_output_frequency: int = 24000
         self._audio_output_channels: int = 1
 
-        self._sora = Sora()
-
-        self._connection = self._sora.create_connection(
+    def _create_connection(self, signaling_urls: list[str]) -> SoraConnection:
+        connection = self._sora.create_connection(
             signaling_urls=signaling_urls,
             role="recvonly",
-            channel_id=channel_id,
-            metadata=metadata,
+            channel_id=self._channel_id,
+            metadata=self._metadata,
             audio=True,
             video=False,
         )
-
-        self._connection.on_set_offer = self._on_set_offer
-        self._connection.on_notify = self._on_notify
-        self._connection.on_disconnect = self._on_disconnect
-
-        self._connection.on_track = self._on_track
-
-    def connect(self):
-        self._connection.connect()
-
-        # _connected が set されるまで 30 秒待つ
-        assert self._connected.wait(30)
-
-        return self
-
-    def disconnect(self):
-        self._connection.disconnect()
-
-    def get_stats(self):
-        raw_stats = self._connection.get_stats()
-        stats = json.loads(raw_stats)
-        return stats
-
-    def _on_set_offer(self, raw_offer):
-        offer = json.loads(raw_offer)
-        if offer["type"] == "offer":
-            self._connection_id = offer["connection_id"]
-            print(f"Received 'Offer': connection_id={self._connection_id}")
-
-    def _on_notify(self, raw_message):
-        message = json.loads(raw_message)
-        if (
-            message["type"] == "notify"
-            and message["event_type"] == "connection.created"
-            and message["connection_id"] == self._connection_id
-        ):
-            print(f"Connected Sora: connection_id={self._connection_id}")
-            self._connected.set()
-
-    def _on_disconnect(self, error_code, message):
-        print(f"Disconnected Sora: error_code='{error_code}' message='{message}'")
-        self._closed = True
-        self._connected.clear()
+        connection.on_track = self._on_track
+        return connection
 
     def _on_frame(self, frame: SoraAudioFrame):
         # frame が音声である確率を求める
+        started_ns = self._instrumentation.now()
         voice_probability = self._vad.analyze(frame)
+        self._instrumentation.record("vad.analyze", started_ns)
+        startup_timing.mark("first_frame")
         if voice_probability > 0.95:  # 0.95 は libwebrtc の判定値
             print(f"Voice! voice_probability={voice_probability}")
         else:
@@ -97,7 +63,7 @@ class VAD:
     def _on_track(self, track: SoraMediaTrack):
         if track.kind == "audio":
             # SoraAudioStreamSink
-            self._audio_stream_sink = SoraAudioStreamSink(
+            self._audio_stream_sink = self._sink_classes.audio_stream_sink(
                 track, self._audio_output_frequency, self._audio_output_channels
             )
             self._audio_stream_sink.on_frame = self._on_frame
@@ -106,7 +72,8 @@ class VAD:
         """ビデオフレームの受信と表示、および音声の再生を行うメインループ。"""
         self.connect()
         try:
-            while self._connected.is_set():
+            # 再接続を待つ間も含めて、閉じられるまで待機する
+            while not self._closed.wait(1):
                 pass
         except KeyboardInterrupt:
             pass
@@ -116,27 +83,20 @@ class VAD:
 
 def vad() -> None:
     """
-    環境変数を使用して Sendonly インスタンスを設定し実行します。
+    設定を使用して VAD インスタンスを設定し実行します。
 
-    :raises ValueError: 必要な環境変数が設定されていない場合
+    :raises ValueError: 必要な設定がない場合や、設定の値が不正な場合
     """
-    load_dotenv()
-
-    if not (raw_signaling_urls := os.getenv("SORA_SIGNALING_URLS")):
-        raise ValueError("環境変数 SORA_SIGNALING_URLS が設定されていません")
-    signaling_urls = raw_signaling_urls.split(",")
-
-    if not (channel_id := os.getenv("SORA_CHANNEL_ID")):
-        raise ValueError("環境変数 SORA_CHANNEL_ID が設定されていません")
-
-    metadata = None
-    if raw_metadata := os.getenv("SORA_METADATA"):
-        metadata = json.loads(raw_metadata)
+    config = get_config()
+    config.require("signaling_urls", "channel_id")
+    enable_instrumentation_from_config(config)
 
     vad = VAD(
-        signaling_urls,
-        channel_id,
-        metadata=metadata,
+        config.signaling_urls,
+        config.channel_id,
+        metadata=config.metadata,
+        reconnect=True,
+        url_selector=SignalingUrlSelector(config.signaling_urls),
     )
     vad.run()
 
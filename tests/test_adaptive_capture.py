@@ -0,0 +1,25 @@
+import numpy as np
+
+from adaptive_capture import AdaptationController
+
+
+def test_adaptation_controller() -> None:
+    controller = AdaptationController(
+        lambda: None, levels=((1.0, 1), (0.5, 2)), degrade_hold_s=2.0, upgrade_hold_s=10.0
+    )
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    assert controller.process(frame) is frame
+
+    # CPU で制限されたら 1 段階下げる
+    assert controller.update({"quality_limitation": 1.0}, 0.0) == 1
+    assert controller.process(frame) is not None
+    assert controller.process(frame) is None
+    resized = controller.process(frame)
+    assert resized is not None
+    assert resized.shape == (240, 320, 3)
+
+    # 余裕のある状態が upgrade_hold_s 続いたら戻す
+    healthy = {"quality_limitation": 0.0, "encode_time_per_frame_s": 0.001}
+    assert controller.update(healthy, 1.0) == 1
+    assert controller.update(healthy, 5.0) == 1
+    assert controller.update(healthy, 11.0) == 0
@@ -0,0 +1,33 @@
+import numpy as np
+
+from audio_converter import AudioConverter
+
+
+def _tone(sample_rate: int, frequency_hz: int = 440) -> np.ndarray:
+    t = np.arange(sample_rate) / sample_rate
+    return (np.sin(2 * np.pi * frequency_hz * t) * 10000).astype(np.int16)
+
+
+def test_audio_converter_resample() -> None:
+    converter = AudioConverter(48000, 2, 16000, 1)
+    tone = _tone(48000)
+    stereo = np.stack([tone, tone], axis=1)
+
+    # 10 ms の倍数でない長さで渡しても、まとめて 1 秒分が出力される
+    outputs = [converter.convert(stereo[i : i + 700]).copy() for i in range(0, 48000, 700)]
+    output = np.concatenate(outputs)
+    assert output.shape[1] == 1
+    assert abs(len(output) - 16000) < 16
+
+    # 振幅が保たれている
+    assert 9000 < np.abs(output[1000:]).max() < 11000
+
+
+def test_audio_converter_channels() -> None:
+    converter = AudioConverter(16000, 1, 16000, 2)
+    output = converter.convert(np.array([[1], [2]], dtype=np.int16))
+    assert output.tolist() == [[1, 1], [2, 2]]
+
+    converter = AudioConverter(16000, 2, 16000, 1)
+    output = converter.convert(np.array([[100, 200]], dtype=np.int16))
+    assert output.tolist() == [[150]]
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pytest
+
+from audio_level import MIN_DBFS, AudioLevelMeter, AudioLevelMonitor
+from fake_sora import (
+    FAKE_SINK_CLASSES,
+    FakeAudioFrame,
+    FakeAudioSource,
+    FakeMediaTrack,
+    FakeSora,
+    FakeSoraServer,
+)
+from media_sendonly import Sendonly
+from synthetic_media import SyntheticAudioGenerator
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+def _sine(amplitude: float, samples: int = 480) -> np.ndarray:
+    t = np.arange(samples) / 48000
+    wave = np.round(np.sin(2 * np.pi * 1000 * t) * amplitude * 32767).astype(np.int16)
+    return np.repeat(wave[:, np.newaxis], 2, axis=1)
+
+
+def test_audio_level_meter() -> None:
+    meter = AudioLevelMeter(peak_hold_s=0.5, peak_decay_db_per_s=20.0)
+    level = meter.process("loud", _sine(1.0), now=0.0)
+    assert level.rms_dbfs == pytest.approx(-3.01, abs=0.05)
+    assert level.peak_dbfs == pytest.approx(0.0, abs=0.01)
+    assert meter.process("quiet", _sine(0.01), now=0.0).rms_dbfs == pytest.approx(-43.0, abs=0.1)
+    assert meter.process("silent", np.zeros((480, 2), dtype=np.int16), now=0.0).rms_dbfs == MIN_DBFS
+
+    # ピークは peak_hold_s の間保持してから、peak_decay_db_per_s で下げる
+    now = 0.0
+    for _ in range(49):
+        now += 0.01
+        level = meter.process("loud", _sine(0.01), now=now)
+    assert level.peak_hold_dbfs == pytest.approx(0.0, abs=0.01)
+    for _ in range(50):
+        now += 0.01
+        level = meter.process("loud", _sine(0.01), now=now)
+    assert level.peak_hold_dbfs == pytest.approx(-10.0, abs=0.3)
+
+    # 順位付けは平滑化した RMS で行うので、直前まで大きかったトラックはすぐには下がらない
+    assert [track_id for track_id, _ in meter.loudest(3)] == ["loud", "quiet", "silent"]
+    assert meter.silent_tracks(-60) == ["silent"]
+    meter.remove_track("silent")
+    assert meter.level("silent") is None
+
+
+def test_audio_level_monitor_tracks_each_sender() -> None:
+    server = FakeSoraServer()
+    monitor = AudioLevelMonitor(
+        SIGNALING_URLS, "level", None, sora=FakeSora(server), sink_classes=FAKE_SINK_CLASSES
+    )
+    sendonly = Sendonly(SIGNALING_URLS, "level", video=False, sora=FakeSora(server))
+    generator = SyntheticAudioGenerator(16000, 1, pattern="tone")
+
+    monitor.connect()
+    sendonly.connect()
+    try:
+        deadline = time.monotonic() + 5
+        while not monitor.meter.loudest(1) and time.monotonic() < deadline:
+            sendonly.audio_source.on_data(generator.next_chunk())
+        [(_, level)] = monitor.meter.loudest(1)
+        assert level.rms_dbfs > -40
+        assert "Loudest: [" in monitor.report()
+    finally:
+        sendonly.disconnect()
+
+    # 送信元が切断するとトラックのレベルを破棄する
+    deadline = time.monotonic() + 5
+    while monitor.meter.loudest(1) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert monitor.meter.loudest(1) == []
+    monitor.disconnect()
+
+
+def test_audio_level_monitor_ignores_frames_after_track_removed() -> None:
+    monitor = AudioLevelMonitor(
+        SIGNALING_URLS, "level", None, sora=FakeSora(), sink_classes=FAKE_SINK_CLASSES
+    )
+    track = FakeMediaTrack("audio", "sender", FakeAudioSource(1, 16000))
+    monitor._on_track(track)
+    (_, sink) = monitor._sinks[track.id]
+    # トラックを外す前に取り出した、配信中のコールバック
+    on_frame = sink.on_frame
+    monitor._remove_track(track.id)
+
+    on_frame(FakeAudioFrame(np.zeros((160, 1), dtype=np.int16), 16000, None))
+    assert monitor.meter.silent_tracks(0.0) == []
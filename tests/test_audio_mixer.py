@@ -0,0 +1,59 @@
+import numpy as np
+
+from audio_mixer import AudioMixer
+
+
+class _ConstantSink:
+    def __init__(self, value: int, channels: int = 1):
+        self.value = value
+        self.channels = channels
+        self.available = True
+
+    def read(self, frames: int, timeout: float):
+        if not self.available:
+            return False, None
+        return True, np.full((frames, self.channels), self.value, dtype=np.int16)
+
+
+def test_audio_mixer() -> None:
+    mixer = AudioMixer(16000, 1, block_ms=10, buffer_blocks=2)
+    quiet = _ConstantSink(1000)
+    loud = _ConstantSink(2000)
+    mixer.add_track("quiet", quiet)
+    mixer.add_track("loud", loud, gain=0.5)
+    assert mixer.fill() == 2
+    assert mixer.fill() == 0
+
+    # コールバックの長さはブロックの長さとは限らない
+    out = np.empty((100, 1), dtype=np.int16)
+    mixer.read_into(out)
+    assert (out == 2000).all()
+    assert mixer.fill() == 0
+
+    # 届いていないトラックは無音として混ぜる
+    loud.available = False
+    mixer.read_into(np.empty((100, 1), dtype=np.int16))
+    assert mixer.fill() == 1
+    mixer.read_into(np.empty((120, 1), dtype=np.int16))
+    mixer.read_into(out)
+    assert (out == 1000).all()
+
+    # 足りない分は無音にして数える
+    mixer.read_into(out)
+    assert mixer.underflows == 40
+    assert (out[:60] == 1000).all()
+    assert (out[60:] == 0).all()
+
+
+def test_audio_mixer_soft_clip() -> None:
+    mixer = AudioMixer(16000, 2, block_ms=10, buffer_blocks=1)
+    for i in range(50):
+        mixer.add_track(str(i), _ConstantSink(-20000, channels=2))
+    mixer.fill()
+    out = np.empty((160, 2), dtype=np.int16)
+    mixer.read_into(out)
+    # 最大値を超える値は折り返さずに最大値の手前に収める
+    assert -32767 <= out.min() < -31000
+
+    mixer.remove_track("0")
+    assert mixer.track_count == 49
@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+
+from audio_converter import AudioConverter
+from audio_ring_buffer import AudioRingBuffer
+
+
+def test_audio_ring_buffer() -> None:
+    ring_buffer = AudioRingBuffer(16000, 1, capacity_ms=30)
+    assert ring_buffer.read() is None
+
+    # PortAudio のブロックサイズは 10 ms の倍数とは限らない
+    data = np.arange(250, dtype=np.int16).reshape(-1, 1)
+    ring_buffer.write(data)
+    assert ring_buffer.read()[:, 0].tolist() == list(range(160))
+    assert ring_buffer.available == 90
+
+    # リングの継ぎ目をまたいでも続きの 10 ms を返す
+    ring_buffer.write(data)
+    assert ring_buffer.overflows == 0
+    chunk = ring_buffer.read()
+    assert chunk[:, 0].tolist() == list(range(160, 250)) + list(range(70))
+
+    # 一杯になったら溢れた分を捨てて数える
+    ring_buffer.write(data)
+    ring_buffer.write(data)
+    assert ring_buffer.overflows == 180 + 250 * 2 - 480
+    assert ring_buffer.available == 480
+
+
+class _RecordingSource:
+    def __init__(self) -> None:
+        self.chunks: list[np.ndarray] = []
+
+    def on_data(self, data: np.ndarray) -> None:
+        self.chunks.append(data.copy())
+
+
+def test_audio_ring_buffer_converts_on_feeder_thread() -> None:
+    # マイクの 44.1 kHz ステレオを書き込み、送信スレッドで 16 kHz モノラルに変換して渡す
+    ring_buffer = AudioRingBuffer(44100, 2, converter=AudioConverter(44100, 2, 16000, 1))
+    source = _RecordingSource()
+    ring_buffer.start(source)  # type: ignore[arg-type]
+    try:
+        block = np.full((512, 2), 1000, dtype=np.int16)
+        for _ in range(10):
+            ring_buffer.write(block)
+        deadline = time.monotonic() + 5
+        while len(source.chunks) < 11 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        ring_buffer.stop()
+    # 441 サンプルずつ読み出すので、変換後もちょうど 10 ms ずつになる
+    assert len(source.chunks) == 5120 // 441
+    assert all(chunk.shape == (160, 1) for chunk in source.chunks)
+    assert abs(int(source.chunks[-1][-1, 0]) - 1000) < 20
@@ -0,0 +1,56 @@
+from benchmark import BenchmarkCapture, compare_with_baseline, run_benchmarks
+
+
+def test_benchmark_capture_frame_index() -> None:
+    capture = BenchmarkCapture(64, 48, duration_s=10)
+    for expected in range(3):
+        success, frame = capture.read()
+        assert success
+        assert BenchmarkCapture.frame_index(frame) == expected
+    assert len(capture.captured_ns) == 3
+    capture.release()
+    assert capture.read() == (False, None)
+
+
+def test_compare_with_baseline() -> None:
+    baseline = {
+        "results": {
+            "sendonly": {"frames_per_s": 100.0, "latency_p99_ms": 10.0, "frames_received": 100},
+            "vad": {"frames_per_s": 1000.0},
+        }
+    }
+    report = {
+        "results": {
+            # フレームレートは 5 % の低下なので許容し、遅延は 50 % の悪化なので検出する
+            "sendonly": {"frames_per_s": 95.0, "latency_p99_ms": 15.0, "frames_received": 10},
+        }
+    }
+    report["results"]["vad"] = {"frames_per_s": 1000.0}
+    regressions = compare_with_baseline(report, baseline, threshold=0.1)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("sendonly.latency_p99_ms")
+    assert compare_with_baseline(report, baseline, threshold=0.6) == []
+
+
+def test_compare_with_baseline_reports_missing_results() -> None:
+    baseline = {
+        "results": {
+            "sendonly": {"frames_per_s": 100.0, "latency_p99_ms": 10.0, "frames_received": 100},
+            "vad": {"frames_per_s": 1000.0},
+        }
+    }
+    # フレームが届かなくなったシナリオは frames_received しか返さない
+    report = {"results": {"sendonly": {"frames_received": 0}}}
+    assert compare_with_baseline(report, baseline, threshold=0.1) == [
+        "sendonly.frames_per_s: missing from the report",
+        "sendonly.latency_p99_ms: missing from the report",
+        "vad: missing from the report",
+    ]
+
+
+def test_run_benchmarks_messaging() -> None:
+    report = run_benchmarks(["messaging"], duration_s=0.2)
+    metrics = report["results"]["messaging"]
+    assert metrics["messages_echoed"] == metrics["messages_sent"]
+    assert metrics["messages_per_s"] > 0
+    assert metrics["rtt_p50_ms"] > 0
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import startup_timing
+from cli import COMMANDS
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+def test_messaging_does_not_import_media_libraries() -> None:
+    # 読み込み済みのモジュールに左右されないように、別のプロセスで messaging だけを読み込む
+    module_name, _ = COMMANDS["messaging"]
+    code = (
+        "import importlib, json, sys\n"
+        f"importlib.import_module({module_name!r})\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    python_path = os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env={**os.environ, "PYTHONPATH": python_path},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = set(json.loads(result.stdout.splitlines()[-1]))
+    assert module_name in modules
+    assert not {"cv2", "mediapipe", "sounddevice"} & modules
+
+
+def test_startup_timing_mark(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.setattr(startup_timing, "_marked", set())
+    startup_timing.mark("import")
+    # 有効にするまでは書き出さない
+    assert capsys.readouterr().err == ""
+
+    monkeypatch.setattr(startup_timing, "_enabled", True)
+    for event in ["import", "connected", "first_frame", "first_frame", "import"]:
+        startup_timing.mark(event)
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    # 同じイベントは最初の 1 回だけ、呼び出した順に書き出す
+    assert [line["startup"] for line in lines] == ["import", "connected", "first_frame"]
+    elapsed = [line["elapsed_ms"] for line in lines]
+    assert elapsed == sorted(elapsed)
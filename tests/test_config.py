@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from config import load_config
+
+
+def test_load_config(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.json"
+    config_file.write_text(
+        json.dumps(
+            {
+                "video_bit_rate": 800,
+                "streams": {"high": {"video_bit_rate": 2000, "video_codec_type": "AV1"}},
+            }
+        )
+    )
+    config = load_config(
+        str(config_file),
+        dotenv_path=str(tmp_path / ".env"),
+        environ={
+            "SORA_SIGNALING_URLS": "wss://1.example.com/signaling,wss://2.example.com/signaling",
+            "SORA_METADATA": '{"access_token": "secret"}',
+            "SORA_VIDEO_BIT_RATE": "900",
+            "USE_HWA": "False",
+        },
+    )
+    assert len(config.signaling_urls) == 2
+    assert config.metadata == {"access_token": "secret"}
+    # 環境変数がファイルより優先される
+    assert config.video_bit_rate == 900
+    # bool("False") のように True にならない
+    assert config.use_hwa is False
+
+    high = config.stream("high")
+    assert high.video_bit_rate == 2000
+    assert high.video_codec_type == "AV1"
+
+    with pytest.raises(ValueError, match="SORA_CHANNEL_ID"):
+        config.require("channel_id")
+
+
+@pytest.mark.parametrize(
+    "environ",
+    [
+        {"USE_HWA": "Flase"},
+        {"SORA_VIDEO_FPS": "thirty"},
+        {"SORA_RECV_QUEUE_SIZE": "0"},
+        {"SORA_RECV_DROP_POLICY": "block"},
+    ],
+)
+def test_load_config_invalid(tmp_path: Path, environ: dict[str, str]) -> None:
+    with pytest.raises(ValueError):
+        load_config(dotenv_path=str(tmp_path / ".env"), environ=environ)
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+import pytest
+
+import connection_manager
+from connection_manager import ConnectionManager, ConnectionState, backoff_delay
+from fake_sora import FakeSora
+from signaling_url_selector import SignalingUrlSelector
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+class StubConnection:
+    """
+    SoraConnection の代わり。
+
+    behavior が "accept" なら connect() で接続を完了させ、"reject" なら認証の失敗のように切断し、
+    "timeout" なら何も返さずにタイムアウトさせます。
+    コールバックは SDK と同じく別スレッドから呼びます。
+    """
+
+    def __init__(self, behavior: str, signaling_urls: list[str]):
+        self.on_set_offer: Optional[Callable[[str], None]] = None
+        self.on_switched: Optional[Callable[[str], None]] = None
+        self.on_notify: Optional[Callable[[str], None]] = None
+        self.on_disconnect: Optional[Callable[[Any, str], None]] = None
+        self.connection_id: str = str(uuid.uuid4())
+        # 実際の SoraConnection と同じく、接続した URL は公開しない
+        self.signaling_urls: list[str] = signaling_urls
+        self.disconnected: bool = False
+        self._behavior: str = behavior
+
+    def _later(self, callback: Callable[[], None]) -> None:
+        threading.Thread(target=callback, daemon=True).start()
+
+    def connect(self) -> None:
+        if self._behavior == "accept":
+            self._later(self._handshake)
+        elif self._behavior == "reject":
+            self.drop("WEBSOCKET_ONCLOSE", "authentication failed")
+
+    def disconnect(self) -> None:
+        self.disconnected = True
+        self.drop("CLOSE_SUCCEEDED", "disconnected")
+
+    def drop(self, error_code: str = "WEBSOCKET_ONCLOSE", message: str = "lost") -> None:
+        if (on_disconnect := self.on_disconnect) is not None:
+            self._later(lambda: on_disconnect(error_code, message))
+
+    def _handshake(self) -> None:
+        assert self.on_set_offer is not None and self.on_notify is not None
+        self.on_set_offer(json.dumps({"type": "offer", "connection_id": self.connection_id}))
+        created = {"type": "notify", "event_type": "connection.created"}
+        self.on_notify(json.dumps(created | {"connection_id": self.connection_id}))
+
+
+class StubManager(ConnectionManager):
+    """behaviors の順に StubConnection を作る ConnectionManager。使い切ったらタイムアウトさせる。"""
+
+    def __init__(
+        self, behaviors: list[str], signaling_urls: list[str] = SIGNALING_URLS, **kwargs: Any
+    ):
+        kwargs.setdefault("connection_timeout_s", 0.1)
+        kwargs.setdefault("reconnect_backoff_initial_s", 0.01)
+        kwargs.setdefault("reconnect_backoff_max_s", 0.01)
+        super().__init__(FakeSora(), signaling_urls, **kwargs)
+        self._behaviors: list[str] = behaviors
+        self.connections: list[StubConnection] = []
+
+    def _create_connection(self, signaling_urls: list[str]) -> Any:
+        index = len(self.connections)
+        behavior = self._behaviors[index] if index < len(self._behaviors) else "timeout"
+        self.connections.append(StubConnection(behavior, signaling_urls))
+        return self.connections[-1]
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_backoff_delay() -> None:
+    for attempt in range(10):
+        delay = backoff_delay(attempt, 0.5, 30.0)
+        assert 0 <= delay <= min(30.0, 0.5 * (2**attempt))
+
+
+def test_connection_manager_requires_create_connection() -> None:
+    # _create_connection() を実装していないサブクラスは作れない
+    with pytest.raises(TypeError):
+        ConnectionManager(FakeSora(), SIGNALING_URLS)  # type: ignore[abstract]
+
+
+def test_connect_timeout() -> None:
+    manager = StubManager(["timeout"])
+    with pytest.raises(AssertionError):
+        manager.connect()
+    # タイムアウトした接続は切断して閉じる
+    assert manager.connections[0].disconnected
+    assert manager.state == ConnectionState.CLOSED
+    assert manager.closed
+
+
+def test_stale_disconnect_is_ignored() -> None:
+    manager = StubManager(["timeout", "accept"], reconnect=True, max_reconnect_attempts=2)
+    manager.connect()
+    stale, current = manager.connections
+    assert manager.connected
+
+    # タイムアウトした前の接続から遅れて届いた切断は無視する
+    assert stale.on_disconnect is not None
+    stale.on_disconnect("WEBSOCKET_ONCLOSE", "late")
+    assert manager.connected
+    assert manager.state == ConnectionState.CONNECTED
+
+    manager.disconnect()
+    assert manager._closed.wait(5)
+    assert current.disconnected
+
+
+def test_max_reconnect_attempts() -> None:
+    manager = StubManager(["timeout"] * 3, reconnect=True, max_reconnect_attempts=3)
+    with pytest.raises(AssertionError):
+        manager.connect()
+    assert len(manager.connections) == 3
+
+    # 接続した後の再接続も max_reconnect_attempts 回で諦める
+    manager = StubManager(["accept"], reconnect=True, max_reconnect_attempts=2)
+    states: list[ConnectionState] = []
+    manager.on_state_change = states.append
+    manager.connect()
+    manager.connections[0].drop()
+    assert manager._closed.wait(5)
+    assert len(manager.connections) == 3
+    assert states == [
+        ConnectionState.CONNECTING,
+        ConnectionState.CONNECTED,
+        ConnectionState.RECONNECTING,
+        ConnectionState.CLOSED,
+    ]
+
+
+def test_disconnect_during_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    # ジッターで待機が 0 秒近くにならないように、バックオフを固定する
+    monkeypatch.setattr(connection_manager, "backoff_delay", lambda *args: 10.0)
+    manager = StubManager(["accept"], reconnect=True)
+    manager.connect()
+    manager.connections[0].drop()
+    assert _wait_for(lambda: manager.state == ConnectionState.RECONNECTING)
+
+    started_at = time.monotonic()
+    manager.disconnect()
+    assert manager._closed.wait(5)
+    # バックオフの待機を打ち切って閉じ、新しい接続は作らない
+    assert time.monotonic() - started_at < 5
+    assert len(manager.connections) == 1
+
+
+def test_url_selector_accounting() -> None:
+    urls = [f"wss://{i}.example.com/signaling" for i in range(3)]
+    selector = SignalingUrlSelector(urls, cache_path=None)
+    manager = StubManager(
+        ["timeout", "reject", "accept"],
+        signaling_urls=urls,
+        connection_timeout_s=1.0,
+        url_connection_timeout_s=0.05,
+        url_selector=selector,
+    )
+    manager.connect()
+    # スコアの順に URL を 1 つずつ試す
+    assert [connection.signaling_urls for connection in manager.connections] == [
+        [url] for url in urls
+    ]
+    # タイムアウトした URL だけ失敗として記録し、認証の失敗は記録しない
+    assert [selector.score(url).failures for url in urls] == [1, 0, 0]
+    # 接続できた URL の接続時間を記録する
+    assert selector.score(urls[1]).latency_s is None
+    assert selector.score(urls[2]).latency_s is not None
+    assert selector.ordered()[0] == urls[2]
+    manager.disconnect()
+    assert manager._closed.wait(5)
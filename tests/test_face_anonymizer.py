@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from face_anonymizer import FaceAnonymizer
+
+
+def _frame() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("mode", ["blur", "pixelate"])
+def test_anonymizer_changes_only_face_boxes(mode: str) -> None:
+    frame = _frame()
+    original = frame.copy()
+
+    FaceAnonymizer(mode).apply(frame, [(20, 30, 40, 50), (150, 100, 40, 40)])
+
+    changed = np.any(frame != original, axis=2)
+    assert changed[30:80, 20:60].mean() > 0.5
+    # はみ出した領域はフレームの中だけを書き換える
+    assert changed[100:, 150:].any()
+    changed[30:80, 20:60] = False
+    changed[100:, 150:] = False
+    assert not changed.any()
+
+
+def test_pixelate_makes_uniform_blocks() -> None:
+    frame = _frame()
+    FaceAnonymizer("pixelate", pixelate_blocks=4).apply(frame, [(0, 0, 40, 40)])
+    # 40 ピクセルを 4 ブロックにするので、10 x 10 のブロックはそれぞれ 1 色になる
+    block = frame[10:20, 20:30].reshape(-1, 3)
+    assert (block == block[0]).all()
+
+
+def test_anonymizer_without_faces_does_nothing() -> None:
+    frame = _frame()
+    original = frame.copy()
+    FaceAnonymizer("blur").apply(frame, [])
+    assert (frame == original).all()
+
+
+def test_anonymizer_rejects_logo_mode() -> None:
+    with pytest.raises(ValueError):
+        FaceAnonymizer("logo")
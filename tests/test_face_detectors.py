@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from face_detectors import FaceBox, FaceDetector, box_iou, calibrate_face_detectors
+
+FACE = FaceBox(0.2, 0.2, 0.2, 0.2)
+
+
+class StaticFaceDetector(FaceDetector):
+    def __init__(self, name: str, nominal_accuracy: float, boxes: list[FaceBox], delay: int):
+        self.name = name
+        self.nominal_accuracy = nominal_accuracy
+        self._boxes = boxes
+        self._delay = delay
+        self.closed = False
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        # 検出時間に差をつけるために無駄な計算をする
+        for _ in range(self._delay):
+            frame.sum()
+        return self._boxes
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_box_iou() -> None:
+    assert box_iou(FACE, FACE) == pytest.approx(1.0)
+    assert box_iou(FACE, FaceBox(0.3, 0.2, 0.2, 0.2)) == pytest.approx(1 / 3)
+    assert box_iou(FACE, FaceBox(0.6, 0.6, 0.1, 0.1)) == 0.0
+
+
+def test_face_detector_requires_detect() -> None:
+    # detect() を実装していないバックエンドは作れない
+    with pytest.raises(TypeError):
+        FaceDetector()  # type: ignore[abstract]
+
+
+def test_calibrate_picks_fastest_accurate_detector() -> None:
+    frames = [np.zeros((120, 160, 3), dtype=np.uint8)] * 3
+    reference = StaticFaceDetector("reference", 0.9, [FACE], delay=50)
+    fast = StaticFaceDetector("fast", 0.85, [FaceBox(0.21, 0.2, 0.2, 0.2)], delay=0)
+    # 顔を見逃すバックエンドは速くても精度が足りない
+    missing = StaticFaceDetector("missing", 0.6, [], delay=0)
+
+    selected, results = calibrate_face_detectors([reference, fast, missing], frames, 0.8)
+
+    assert selected is fast
+    accuracies = {result.name: result.accuracy for result in results}
+    assert accuracies["reference"] == pytest.approx(0.9)
+    assert accuracies["fast"] == pytest.approx(0.9)
+    assert accuracies["missing"] == 0.0
+    assert reference.closed and missing.closed and not fast.closed
+
+    # 精度の下限を満たすバックエンドがない場合は最も精度の高いものを選ぶ
+    selected, _ = calibrate_face_detectors([missing], frames, 0.8)
+    assert selected is missing
+
+
+def test_calibrate_without_detectors() -> None:
+    with pytest.raises(ValueError):
+        calibrate_face_detectors([], [np.zeros((2, 2, 3), dtype=np.uint8)], 0.8)
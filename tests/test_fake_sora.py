@@ -0,0 +1,173 @@
+import threading
+
+from connection_manager import ConnectionState
+from fake_sora import FAKE_SINK_CLASSES, FakeSora, FakeSoraServer, drop_connection
+from media_recvonly import Recvonly
+from media_sendonly import Sendonly
+from messaging import Messaging
+from synthetic_media import SyntheticAudioGenerator, SyntheticVideoGenerator
+from vad import VAD
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+def test_sendonly_loopback_to_recvonly() -> None:
+    server = FakeSoraServer()
+    recvonly = Recvonly(
+        SIGNALING_URLS, "loopback", sora=FakeSora(server), sink_classes=FAKE_SINK_CLASSES
+    )
+    sendonly = Sendonly(SIGNALING_URLS, "loopback", sora=FakeSora(server))
+
+    recvonly.connect()
+    sendonly.connect(
+        fake_audio=SyntheticAudioGenerator(16000, 1, pattern="tone"),
+        fake_video=SyntheticVideoGenerator(160, 120, pattern="testcard"),
+    )
+    try:
+        frame = recvonly.get_video_frame(timeout=5)
+        assert frame is not None
+        assert frame.data().shape == (120, 160, 3)
+        (audio_sink,) = recvonly.audio_sinks.values()
+        success, data = audio_sink.read(160, timeout=5)
+        assert success
+        assert data.shape == (160, 1)
+    finally:
+        sendonly.disconnect()
+        recvonly.disconnect()
+    assert sendonly._closed.wait(5)
+    assert recvonly._closed.wait(5)
+
+
+def test_recvonly_tracks_each_publisher() -> None:
+    server = FakeSoraServer()
+    recvonly = Recvonly(
+        SIGNALING_URLS,
+        "multi",
+        sora=FakeSora(server),
+        sink_classes=FAKE_SINK_CLASSES,
+        video_fps_limit=1,
+    )
+    removed = []
+    recvonly.on_track_removed = removed.append
+    speaker = Sendonly(SIGNALING_URLS, "multi", sora=FakeSora(server), audio=False)
+    other = Sendonly(SIGNALING_URLS, "multi", sora=FakeSora(server), audio=False)
+
+    recvonly.connect()
+    speaker.connect(fake_video=SyntheticVideoGenerator(160, 120, fps=60))
+    other.connect(fake_video=SyntheticVideoGenerator(160, 120, fps=60))
+    try:
+        assert speaker._connection_id is not None and other._connection_id is not None
+        recvonly.set_video_fps_limit(speaker._connection_id, None)
+        counts = {speaker._connection_id: 0, other._connection_id: 0}
+        for _ in range(40):
+            if (item := recvonly.get_track_frame(timeout=5)) is not None:
+                counts[item.stream_id] += 1
+        # 話者は制限なしで受け取り、他のストリームは 1 fps に間引く
+        assert counts[speaker._connection_id] > counts[other._connection_id]
+        assert recvonly.decimated_frames > 0
+
+        other.disconnect()
+        assert other._closed.wait(5)
+        for _ in range(50):
+            if removed:
+                break
+            recvonly.get_track_frame(timeout=0.1)
+        assert [track.stream_id for track in removed] == [other._connection_id]
+        assert len(recvonly.tracks) == 1
+    finally:
+        speaker.disconnect()
+        recvonly.disconnect()
+    assert recvonly._closed.wait(5)
+
+
+def test_vad_analyzes_resampled_audio() -> None:
+    server = FakeSoraServer()
+    vad = VAD(SIGNALING_URLS, "vad", None, sora=FakeSora(server), sink_classes=FAKE_SINK_CLASSES)
+    received = threading.Event()
+    sample_rates: list[int] = []
+
+    def on_frame(frame) -> None:
+        sample_rates.append(frame.sample_rate_hz)
+        received.set()
+
+    vad._on_frame = on_frame  # type: ignore[method-assign]
+    sendonly = Sendonly(SIGNALING_URLS, "vad", sora=FakeSora(server))
+
+    vad.connect()
+    sendonly.connect(fake_audio=SyntheticAudioGenerator(16000, 1, pattern="tone"))
+    try:
+        assert received.wait(5)
+        # VAD は 24 kHz で受け取るので、16 kHz の送信側からリサンプリングされる
+        assert sample_rates[0] == 24000
+    finally:
+        sendonly.disconnect()
+        vad.disconnect()
+
+
+def test_messaging_exchanges_messages_and_reconnects() -> None:
+    server = FakeSoraServer()
+    data_channels = [{"label": "#test", "direction": "sendrecv"}]
+    sender = Messaging(
+        SIGNALING_URLS,
+        "messaging",
+        data_channels,
+        sora=FakeSora(server),
+        reconnect=True,
+    )
+    receiver = Messaging(SIGNALING_URLS, "messaging", data_channels, sora=FakeSora(server))
+    messages: list[tuple[str, bytes]] = []
+    received = threading.Event()
+
+    def on_message(label: str, data: bytes) -> None:
+        messages.append((label, data))
+        received.set()
+
+    receiver._on_message = on_message  # type: ignore[method-assign]
+
+    receiver.connect()
+    sender.connect()
+    try:
+        sender.send(b"hello")
+        assert received.wait(5)
+        assert messages == [("#test", b"hello")]
+
+        # 意図しない切断の後に再接続し、再びメッセージを送れる
+        reconnected = threading.Event()
+        sender.on_state_change = lambda state: (
+            reconnected.set() if state == ConnectionState.CONNECTED else None
+        )
+        drop_connection(sender._connection)  # type: ignore[arg-type]
+        assert reconnected.wait(10)
+        received.clear()
+        sender.send(b"again")
+        assert received.wait(5)
+        assert messages[-1] == ("#test", b"again")
+    finally:
+        sender.disconnect()
+        receiver.disconnect()
+
+
+def test_sendonly_connect_again_restarts_fake_media() -> None:
+    sendonly = Sendonly(SIGNALING_URLS, "again", audio=False, sora=FakeSora(FakeSoraServer()))
+    for _ in range(2):
+        sendonly.connect(fake_video=SyntheticVideoGenerator(160, 120))
+        try:
+            # 2 回目の接続でも合成映像のスレッドはすぐには終わらない
+            assert sendonly._fake_video_thread is not None
+            assert sendonly._fake_video_thread.is_alive()
+        finally:
+            sendonly.disconnect()
+        assert sendonly._closed.wait(5)
+
+
+def test_fake_connection_exposes_only_sdk_surface() -> None:
+    connection = FakeSora(FakeSoraServer()).create_connection(role="sendonly", channel_id="sdk")
+    # 実際の SoraConnection にない属性に頼ったコードをテストで見逃さないようにする
+    public = {name for name in dir(connection) if not name.startswith("_")}
+    assert {name for name in public if not name.startswith("on_")} == {
+        "connect",
+        "disconnect",
+        "send_data_channel",
+        "get_stats",
+    }
+    connection.disconnect()
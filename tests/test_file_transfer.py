@@ -0,0 +1,148 @@
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from fake_sora import FakeSora, FakeSoraServer
+from file_transfer import FileTransfer
+from messaging import Messaging
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+def _link(
+    tmp_path: Path,
+    tamper: Callable[[bytes], bytes | None],
+    tamper_reply: Callable[[bytes], bytes | None] = lambda data: data,
+    **kwargs,
+) -> FileTransfer:
+    # 送信側のメッセージを tamper で、受信側の応答を tamper_reply で書き換えるか捨ててから、
+    # 同じスレッドで相手に渡す
+    receiver: FileTransfer
+
+    def to_receiver(data: bytes) -> None:
+        if (data := tamper(data)) is not None:
+            receiver.handle_message(data)
+
+    def to_sender(data: bytes) -> None:
+        if (data := tamper_reply(data)) is not None:
+            sender.handle_message(data)
+
+    sender = FileTransfer(to_receiver, chunk_size=1024, window=8, **kwargs)
+    receiver = FileTransfer(to_sender, receive_dir=tmp_path, chunk_size=1024)
+    return sender
+
+
+def test_file_transfer_over_data_channel(tmp_path: Path) -> None:
+    server = FakeSoraServer()
+    data_channels = [
+        {"label": "#test", "direction": "sendrecv"},
+        {"label": "#file", "direction": "sendrecv"},
+    ]
+    sender = Messaging(SIGNALING_URLS, "file", data_channels, sora=FakeSora(server))
+    receiver = Messaging(SIGNALING_URLS, "file", data_channels, sora=FakeSora(server))
+    sending = FileTransfer(lambda data: sender.send(data, label="#file"), chunk_size=16 * 1024)
+    receiving = FileTransfer(
+        lambda data: receiver.send(data, label="#file"), receive_dir=tmp_path / "received"
+    )
+    (tmp_path / "received").mkdir()
+    sender.add_message_handler("#file", sending.handle_message)
+    receiver.add_message_handler("#file", receiving.handle_message)
+    received: list[Path] = []
+    done = threading.Event()
+    receiving.on_file_received = lambda path: (received.append(path), done.set())
+
+    source = tmp_path / "snapshot.bin"
+    source.write_bytes(os.urandom(1024 * 1024 + 123))
+
+    receiver.connect()
+    sender.connect()
+    try:
+        stats = sending.send_file(source)
+        assert done.wait(5)
+        assert received == [tmp_path / "received" / "snapshot.bin"]
+        assert received[0].read_bytes() == source.read_bytes()
+        assert stats.bytes_sent == stats.size == 1024 * 1024 + 123
+        assert stats.retransmitted_chunks == 0
+        assert stats.throughput_bps > 0
+    finally:
+        sender.disconnect()
+        receiver.disconnect()
+
+
+def test_file_transfer_retransmits_corrupted_chunk(tmp_path: Path) -> None:
+    corrupted = []
+
+    def corrupt_once(data: bytes) -> bytes:
+        # 4 番目のチャンクを 1 度だけ壊す
+        if data[0] == 3 and int.from_bytes(data[5:13], "big") == 3 and not corrupted:
+            corrupted.append(True)
+            return data[:-1] + bytes([data[-1] ^ 0xFF])
+        return data
+
+    sender = _link(tmp_path, corrupt_once)
+    payload = os.urandom(20 * 1024)
+    stats = sender.send_bytes(payload, "../log.txt")
+    # ディレクトリを含む名前でも受信側のディレクトリの外には書かない
+    assert (tmp_path / "log.txt").read_bytes() == payload
+    assert stats.retransmitted_chunks > 0
+
+
+def test_file_transfer_resumes_from_received_chunks(tmp_path: Path) -> None:
+    dropping = [True]
+
+    def drop_after_fifth_chunk(data: bytes) -> bytes | None:
+        if dropping[0] and data[0] == 3 and int.from_bytes(data[5:13], "big") >= 5:
+            return None
+        return data
+
+    sender = _link(tmp_path, drop_after_fifth_chunk, ack_timeout_s=0.05, max_retries=1)
+    payload = os.urandom(10 * 1024 + 10)
+    with pytest.raises(TimeoutError):
+        sender.send_bytes(payload, "log.txt")
+    assert not (tmp_path / "log.txt").exists()
+
+    dropping[0] = False
+    stats = sender.send_bytes(payload, "log.txt")
+    assert (tmp_path / "log.txt").read_bytes() == payload
+    assert stats.bytes_sent == len(payload) - 5 * 1024
+
+
+def test_file_transfer_resumes_after_receiver_restart(tmp_path: Path) -> None:
+    def drop_after_fifth_chunk(data: bytes) -> bytes | None:
+        if data[0] == 3 and int.from_bytes(data[5:13], "big") >= 5:
+            return None
+        return data
+
+    payload = os.urandom(10 * 1024 + 10)
+    sender = _link(tmp_path, drop_after_fifth_chunk, ack_timeout_s=0.05, max_retries=1)
+    with pytest.raises(TimeoutError):
+        sender.send_bytes(payload, "log.txt")
+    assert (tmp_path / "log.txt.part.progress").exists()
+
+    # 受信側を作り直しても、.part を上書きせずに受け取り済みのチャンクの続きから受け取る
+    stats = _link(tmp_path, lambda data: data).send_bytes(payload, "log.txt")
+    assert (tmp_path / "log.txt").read_bytes() == payload
+    assert stats.bytes_sent == len(payload) - 5 * 1024
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["log.txt"]
+
+
+def test_file_transfer_recovers_from_lost_acks(tmp_path: Path) -> None:
+    dropped: set[int] = set()
+
+    def drop_first_ack(data: bytes) -> bytes | None:
+        # それぞれの確認応答を最初の 1 度だけ捨てる。最後の確認応答も失われる
+        value = int.from_bytes(data[5:13], "big")
+        if data[0] == 4 and value not in dropped:
+            dropped.add(value)
+            return None
+        return data
+
+    sender = _link(tmp_path, lambda data: data, drop_first_ack, ack_timeout_s=0.05, max_retries=3)
+    payload = os.urandom(10 * 1024 + 10)
+    stats = sender.send_bytes(payload, "log.txt")
+    assert (tmp_path / "log.txt").read_bytes() == payload
+    assert 11 in dropped
+    assert stats.retransmitted_chunks > 0
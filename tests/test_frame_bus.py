@@ -0,0 +1,47 @@
+import multiprocessing
+
+import numpy as np
+
+from frame_bus import FrameBus, FrameBusReader
+
+
+def _read_means(name: str, ready, results) -> None:
+    with FrameBusReader(name, reader_index=1) as reader:
+        ready.set()
+        for _ in range(3):
+            frame = reader.read(timeout=5)
+            results.put(None if frame is None else (frame.stream_id, int(frame.data.mean())))
+
+
+def test_frame_bus() -> None:
+    with FrameBus(slot_count=4, slot_size=120 * 160 * 3, max_readers=2) as bus:
+        reader = FrameBusReader(bus.name)
+        assert reader.read(timeout=0.01) is None
+        for i in range(6):
+            bus.publish(np.full((120, 160, 3), i, dtype=np.uint8), stream_id=f"stream-{i}")
+
+        # 一周以上遅れた読み出し側は、上書きされていない最も古いフレームまで飛ばす
+        frame = reader.read(timeout=1)
+        assert frame is not None
+        assert (frame.seq, frame.stream_id, frame.data.shape) == (3, "stream-2", (120, 160, 3))
+        assert (frame.data == 2).all()
+        assert reader.skipped == 2
+        assert bus.reader_lags()[0] == 3
+        reader.close()
+
+
+def test_frame_bus_across_processes() -> None:
+    # fork は Windows と macOS で使えないので、どのプラットフォームにもある spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    results = context.Queue()
+    with FrameBus(slot_count=8, slot_size=64 * 64 * 3, max_readers=2) as bus:
+        worker = context.Process(target=_read_means, args=(bus.name, ready, results))
+        worker.start()
+        assert ready.wait(10)
+        for i in range(3):
+            bus.publish(np.full((64, 64, 3), i * 10, dtype=np.uint8), stream_id="remote")
+        received = [results.get(timeout=10) for _ in range(3)]
+        worker.join(timeout=10)
+    assert received == [("remote", 0), ("remote", 10), ("remote", 20)]
+    assert worker.exitcode == 0
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+
+import hideface_bridge
+from face_anonymizer import FaceAnonymizer
+from face_detectors import FaceBox, FaceDetector
+from fake_sora import FAKE_SINK_CLASSES, FakeSora, FakeSoraServer
+from hideface_bridge import HidefaceBridge
+from media_recvonly import Recvonly
+from media_sendonly import Sendonly
+from synthetic_media import SyntheticAudioGenerator, SyntheticVideoGenerator
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+class _CenterFaceDetector(FaceDetector):
+    name = "center"
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        return [FaceBox(0.4, 0.4, 0.2, 0.2)]
+
+
+def test_hideface_bridge_republishes_each_stream(monkeypatch) -> None:
+    monkeypatch.setattr(
+        hideface_bridge._BridgeStreamer, "_load_face_detector", lambda self: _CenterFaceDetector()
+    )
+    anonymized = []
+    apply = FaceAnonymizer.apply
+
+    def record_apply(self, frame, boxes):
+        anonymized.append((frame.shape, boxes))
+        apply(self, frame, boxes)
+
+    monkeypatch.setattr(FaceAnonymizer, "apply", record_apply)
+    server = FakeSoraServer()
+    bridge = HidefaceBridge(
+        SIGNALING_URLS,
+        "source",
+        "output",
+        sora=FakeSora(server),
+        sink_classes=FAKE_SINK_CLASSES,
+        mode="pixelate",
+    )
+    viewer = Recvonly(
+        SIGNALING_URLS, "output", sora=FakeSora(server), sink_classes=FAKE_SINK_CLASSES
+    )
+    sendonly = Sendonly(SIGNALING_URLS, "source", sora=FakeSora(server))
+
+    thread = threading.Thread(target=bridge.run, daemon=True)
+    thread.start()
+    viewer.connect()
+    sendonly.connect(
+        fake_audio=SyntheticAudioGenerator(16000, 1),
+        fake_video=SyntheticVideoGenerator(160, 120, pattern="testcard"),
+    )
+    try:
+        frame = viewer.get_video_frame(timeout=5)
+        assert frame is not None
+        assert frame.data().shape == (120, 160, 3)
+        # 受信したフレームの顔の領域をモザイクにしてから送り直している
+        assert anonymized[0] == ((120, 160, 3), [(54, 34, 51, 38)])
+        assert bridge.stream_ids == [sendonly._connection_id]
+        (latency,) = bridge.latency_snapshot().values()
+        assert latency["count"] > 0
+        # 送信元が音声も送っていても、ブリッジは音声を受信しない
+        assert [track.kind for track in bridge._recvonly.tracks] == ["video"]
+        assert bridge._recvonly.audio_sinks == {}
+
+        # 送信元が切断したらワーカーを止める
+        sendonly.disconnect()
+        deadline = time.monotonic() + 5
+        while bridge.stream_ids and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert bridge.stream_ids == []
+    finally:
+        sendonly.disconnect()
+        viewer.disconnect()
+        bridge.disconnect()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
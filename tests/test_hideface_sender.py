@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from face_detectors import FaceBox, FaceDetector
+from fake_sora import FakeSora
+from hideface_sender import LogoStreamer
+
+
+class _NoFaceDetector(FaceDetector):
+    name = "none"
+
+    def detect(self, frame: np.ndarray) -> list[FaceBox]:
+        return []
+
+
+class _Capture:
+    def __init__(self) -> None:
+        self.released = False
+
+    def isOpened(self) -> bool:
+        return not self.released
+
+    def read(self) -> tuple[bool, np.ndarray]:
+        return True, np.zeros((120, 160, 3), dtype=np.uint8)
+
+    def release(self) -> None:
+        self.released = True
+
+
+def test_logo_streamer_releases_capture_when_connect_fails(monkeypatch) -> None:
+    def fail(self: LogoStreamer) -> None:
+        raise AssertionError("Could not connect to Sora.")
+
+    monkeypatch.setattr(LogoStreamer, "connect", fail)
+    monkeypatch.setattr(LogoStreamer, "_load_face_detector", lambda self: _NoFaceDetector())
+    capture = _Capture()
+    streamer = LogoStreamer(
+        ["wss://fake.example.com/signaling"],
+        "sendonly",
+        "hideface",
+        None,
+        camera_id=0,
+        video_width=None,
+        video_height=None,
+        video_fps=None,
+        video_fourcc=None,
+        sora=FakeSora(),
+        video_capture=capture,
+    )
+    with pytest.raises(AssertionError):
+        streamer.run()
+    assert capture.released
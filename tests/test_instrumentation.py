@@ -0,0 +1,24 @@
+from instrumentation import Histogram, Instrumentation, NullInstrumentation
+
+
+def test_histogram() -> None:
+    histogram = Histogram()
+    for value_ns in range(1, 1001):
+        histogram.record(value_ns * 1000)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 1000
+    # バケットの下限で近似するので、相対誤差は約 6% 以内
+    assert 0.94 * 500_000 <= snapshot["p50_ns"] <= 500_000
+    assert 0.94 * 1_000_000 <= snapshot["max_ns"] <= 1_000_000
+
+
+def test_instrumentation() -> None:
+    instrumentation = Instrumentation()
+    started_ns = instrumentation.now()
+    instrumentation.record("stage", started_ns)
+    assert instrumentation.snapshot()["stages"]["stage"]["count"] == 1
+
+    null_instrumentation = NullInstrumentation()
+    null_instrumentation.record("stage", null_instrumentation.now())
+    assert null_instrumentation.snapshot() == {}
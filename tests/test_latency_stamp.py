@@ -0,0 +1,49 @@
+import cv2  # type: ignore
+import numpy as np
+
+from benchmark import run_benchmarks
+from latency_stamp import LatencyMeter, read_stamp, stamp_frame
+from synthetic_media import SyntheticVideoGenerator
+
+MASK = (1 << 40) - 1
+
+
+def test_stamp_survives_compression_and_scaling() -> None:
+    generator = SyntheticVideoGenerator(640, 480, pattern="testcard")
+    assert read_stamp(generator.next_frame()) is None
+
+    frame = generator.next_frame()
+    timestamp_us = 1_700_000_000_123_456
+    assert stamp_frame(frame, timestamp_us)
+    assert read_stamp(frame) == timestamp_us & MASK
+
+    # 強く圧縮しても、送信側で解像度を落としても読み出せる
+    _, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 30])
+    decoded = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    assert read_stamp(decoded) == timestamp_us & MASK
+    scaled = cv2.resize(decoded, (320, 240), interpolation=cv2.INTER_AREA)
+    assert read_stamp(scaled) == timestamp_us & MASK
+
+    # 小さすぎるフレームには書き込まない
+    assert not stamp_frame(np.zeros((16, 16, 3), dtype=np.uint8), timestamp_us)
+
+
+def test_latency_meter() -> None:
+    meter = LatencyMeter()
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    stamp_frame(frame, 5_000_000)
+    assert meter.measure("stream", frame, received_us=5_012_000) == 12_000_000
+    # 送信側の時計が進んでいる場合は記録しない
+    assert meter.measure("stream", frame, received_us=4_000_000) is None
+    assert meter.measure("stream", np.zeros_like(frame)) is None
+    assert meter.unmeasured_frames == 2
+    snapshot = meter.snapshot()["stream"]
+    assert snapshot["count"] == 1
+    assert 11_000_000 < snapshot["p50_ns"] <= 12_000_000
+
+
+def test_run_benchmarks_glass_to_glass() -> None:
+    metrics = run_benchmarks(["glass_to_glass"], duration_s=0.3)["results"]["glass_to_glass"]
+    assert metrics["frames_measured"] > 0
+    assert metrics["unmeasured_frames"] == 0
+    assert 0 < metrics["latency_p50_ms"] < 1000
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from fake_sora import FakeSora, FakeSoraServer
+from load_generator import LoadGenerator
+from media_sendonly import Sendonly
+from synthetic_media import SyntheticAudioGenerator, SyntheticVideoGenerator
+
+SIGNALING_URLS = ["wss://fake.example.com/signaling"]
+
+
+def _load_generator(connections: int) -> LoadGenerator:
+    return LoadGenerator(
+        SIGNALING_URLS,
+        "load",
+        None,
+        connections=connections,
+        ramp_up_rate=100,
+        video_codec_types=["VP8", "H264"],
+        video_bit_rates=[500],
+        video_generator=SyntheticVideoGenerator(160, 120, fps=30),
+        audio_generator=SyntheticAudioGenerator(16000, 1),
+        sora=FakeSora(FakeSoraServer()),
+    )
+
+
+def test_load_generator_reports_connections(capsys: pytest.CaptureFixture[str]) -> None:
+    _load_generator(3).run(duration_s=1.0, report_interval_s=0.1)
+
+    reports = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line[:1] == "{"]
+    assert max(report["connected"] for report in reports) == 3
+    final = reports[-1]
+    assert final["failed"] == 0
+    assert final["connect_time"]["count"] == 3
+    # FakeSora の統計情報からも接続ごとの送信ビットレートを集計する
+    assert any(report["outbound_bitrate"]["count"] == 3 for report in reports)
+
+
+@pytest.mark.parametrize(
+    "error", [AssertionError("Could not connect to Sora."), RuntimeError("unexpected")]
+)
+def test_load_generator_counts_failed_connections(
+    monkeypatch: pytest.MonkeyPatch, error: Exception
+) -> None:
+    def fail(self: Sendonly) -> None:
+        raise error
+
+    monkeypatch.setattr(Sendonly, "connect", fail)
+    generator = _load_generator(1)
+    generator._connect(0)
+
+    report = generator.report(0.0)
+    assert report["failed"] == 1
+    assert report["connected"] == 0
+    assert report["connect_time"]["count"] == 0
+    # 接続できなかったソースには合成メディアを配らない
+    assert generator._video_sources == () and generator._audio_sources == ()
@@ -0,0 +1,74 @@
+import time
+from pathlib import Path
+
+import cv2  # type: ignore
+import numpy as np
+
+from media_file_capture import MediaFileCapture
+
+FPS = 50
+FRAMES = 10
+
+
+def _write_video(path: Path) -> str:
+    # フレームごとに明るさを変え、読み出した順番を確かめられるようにする
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), FPS, (64, 48))
+    assert writer.isOpened()
+    for index in range(FRAMES):
+        writer.write(np.full((48, 64, 3), index * 20, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+def _index(frame: np.ndarray) -> int:
+    return round(float(frame.mean()) / 20)
+
+
+def test_media_file_capture_plays_once(tmp_path: Path) -> None:
+    capture = MediaFileCapture(_write_video(tmp_path / "clip.avi"), loop=False)
+    started = time.perf_counter()
+    indexes = []
+    while True:
+        success, frame = capture.read()
+        if not success:
+            break
+        assert frame is not None
+        indexes.append(_index(frame))
+    # 最後のフレームは PTS の (FRAMES - 1) / FPS 秒後より前には返さない
+    assert time.perf_counter() - started >= (FRAMES - 1) / FPS
+    assert indexes == list(range(FRAMES))
+    # Sendonly.run() は isOpened() が False になったら送信をやめる
+    assert not capture.isOpened()
+    capture.release()
+
+
+def test_media_file_capture_loops(tmp_path: Path) -> None:
+    capture = MediaFileCapture(_write_video(tmp_path / "clip.avi"), loop=True)
+    started = time.perf_counter()
+    indexes = []
+    for _ in range(FRAMES * 2 + 5):
+        success, frame = capture.read()
+        assert success and frame is not None
+        indexes.append(_index(frame))
+    # ループしても PTS は戻らず、フレームの間隔で再生し続ける
+    assert time.perf_counter() - started >= (FRAMES * 2 + 4) / FPS
+    assert indexes == [index % FRAMES for index in range(FRAMES * 2 + 5)]
+    assert capture.isOpened()
+    capture.release()
+    assert not capture.isOpened()
+
+
+def test_media_file_capture_shares_origin_with_audio(tmp_path: Path) -> None:
+    capture = MediaFileCapture(_write_video(tmp_path / "clip.avi"), loop=False)
+    # 音声は最初の read() までは送らない
+    assert not capture._playing.is_set()
+    success, _ = capture.read()
+    assert success and capture._playing.is_set()
+    assert capture._origin is not None
+
+    # 音声も映像と同じ再生開始時刻から、音声の PTS まで待つ
+    assert capture._pace(0.1)
+    assert time.perf_counter() - capture._origin >= 0.1
+    capture.release()
+    # release() したら待機を打ち切る
+    assert not capture._pace(10.0)
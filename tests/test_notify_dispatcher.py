@@ -0,0 +1,20 @@
+import json
+
+from notify_dispatcher import NotifyDispatcher
+
+
+def test_notify_dispatcher() -> None:
+    dispatcher = NotifyDispatcher()
+    received: list[dict] = []
+    dispatcher.on("connection.created", received.append)
+
+    created = {"type": "notify", "event_type": "connection.created", "connection_id": "A"}
+    destroyed = {"type": "notify", "event_type": "connection.destroyed", "connection_id": "A"}
+
+    assert dispatcher.dispatch(json.dumps(created))
+    # 購読していない event_type はパースせずに捨てる
+    assert not dispatcher.dispatch(json.dumps(destroyed))
+    assert received == [created]
+
+    dispatcher.off("connection.created", received.append)
+    assert not dispatcher.dispatch(json.dumps(created))
@@ -0,0 +1,23 @@
+import numpy as np
+
+from scene_change import StaticSceneFilter
+
+
+def test_static_scene_filter() -> None:
+    scene_filter = StaticSceneFilter(threshold=2.0, keepalive_fps=2.0)
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (360, 640, 3), dtype=np.uint8)
+    assert scene_filter.process(frame, now=0.0)
+
+    # 変化していない間はキープアライブの間隔で送る
+    noisy = np.clip(frame.astype(np.int16) + rng.integers(-3, 4, frame.shape), 0, 255)
+    assert not scene_filter.process(noisy.astype(np.uint8), now=0.1)
+    assert not scene_filter.process(frame, now=0.4)
+    assert scene_filter.process(frame, now=0.5)
+    assert scene_filter.suppressed_frames == 2
+
+    # 変化したらすぐに送る
+    changed = frame.copy()
+    changed[:180] = 255 - changed[:180]
+    assert scene_filter.process(changed, now=0.6)
+    assert not scene_filter.process(changed, now=0.7)
@@ -0,0 +1,19 @@
+from signaling_url_selector import SignalingUrlSelector
+
+
+def test_signaling_url_selector(tmp_path) -> None:
+    urls = ["wss://1.example.com/signaling", "wss://2.example.com/signaling"]
+    cache_path = tmp_path / "signaling_urls.json"
+
+    selector = SignalingUrlSelector(urls, cache_path=cache_path)
+    assert selector.ordered() == urls
+
+    selector.record_success(urls[0], 0.5)
+    selector.record_success(urls[1], 0.1)
+    assert selector.ordered() == [urls[1], urls[0]]
+
+    selector.record_failure(urls[1])
+    assert selector.ordered() == [urls[0], urls[1]]
+
+    # キャッシュファイルからスコアを引き継ぐ
+    assert SignalingUrlSelector(urls, cache_path=cache_path).ordered() == [urls[0], urls[1]]
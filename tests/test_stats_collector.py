@@ -0,0 +1,56 @@
+import io
+import math
+
+from stats_collector import STATS_FIELDS, StatsCollector
+
+
+def _stats(bytes_sent: int) -> list[dict]:
+    return [
+        {
+            "type": "outbound-rtp",
+            "kind": "video",
+            "bytesSent": bytes_sent,
+            "framesPerSecond": 30,
+            "encoderImplementation": "libvpx",
+            "framesEncoded": bytes_sent // 100,
+            "totalEncodeTime": bytes_sent / 10000,
+            "qualityLimitationReason": "bandwidth",
+        },
+        {
+            "type": "candidate-pair",
+            "nominated": True,
+            "state": "succeeded",
+            "currentRoundTripTime": 0.02,
+            "availableOutgoingBitrate": 300000,
+        },
+    ]
+
+
+def test_stats_collector() -> None:
+    collector = StatsCollector(lambda: None, capacity=2)
+    assert not collector.sample()
+
+    collector.add(_stats(0), 0.0)
+    assert math.isnan(collector.latest()["outbound_bitrate_bps"])
+
+    collector.add(_stats(1000), 1.0)
+    collector.add(_stats(3000), 2.0)
+    latest = collector.latest()
+    assert latest["outbound_bitrate_bps"] == 16000
+    assert latest["outbound_fps"] == 30
+    assert latest["round_trip_time_s"] == 0.02
+    assert latest["available_outgoing_bitrate_bps"] == 300000
+    assert math.isclose(latest["encode_time_per_frame_s"], 0.01)
+    assert latest["quality_limitation"] == 2
+    assert collector.encoder_implementation == "libvpx"
+
+    # リングバッファなので古いサンプルは捨てられる
+    timestamps, values = collector.series()
+    assert timestamps.tolist() == [1.0, 2.0]
+    assert values.shape == (2, len(STATS_FIELDS))
+
+    assert "sora_outbound_bitrate_bps 16000.0" in collector.to_prometheus()
+
+    f = io.StringIO()
+    collector.to_csv(f)
+    assert len(f.getvalue().splitlines()) == 3
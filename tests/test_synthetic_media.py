@@ -0,0 +1,38 @@
+import threading
+import time
+
+import numpy as np
+
+from synthetic_media import DeadlinePacer, SyntheticAudioGenerator, SyntheticVideoGenerator
+
+
+def test_deadline_pacer() -> None:
+    pacer = DeadlinePacer(200)
+    started = time.perf_counter()
+    for _ in range(40):
+        assert pacer.wait()
+    # 40 番目の締め切りは開始から 40 / 200 秒後。CI の負荷で遅れることはあるので下限だけ確かめる
+    assert time.perf_counter() - started >= 0.2
+
+    stop = threading.Event()
+    stop.set()
+    assert not DeadlinePacer(1).wait(stop)
+
+
+def test_synthetic_video_generator() -> None:
+    generator = SyntheticVideoGenerator(320, 240, pattern="counter", buffer_count=2)
+    first = generator.next_frame()
+    second = generator.next_frame()
+    assert first.shape == (240, 320, 3)
+    assert first is not second
+    # バッファは使い回す
+    assert generator.next_frame() is first
+
+
+def test_synthetic_audio_generator() -> None:
+    generator = SyntheticAudioGenerator(48000, 2, pattern="tone")
+    chunk = generator.next_chunk()
+    assert chunk.shape == (480, 2)
+    assert chunk.dtype == np.int16
+    assert chunk.flags.c_contiguous
+    assert np.abs(chunk).max() > 0